@@ -0,0 +1,281 @@
+"""
+AI Batch Service
+Background generation of many content variants (per group, language, tone)
+with bounded concurrency, live progress events and resumable jobs
+"""
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+from datetime import datetime, timezone
+import asyncio
+import os
+import uuid
+import logging
+
+from ai_response_cache import AIResponseCache
+from job_lease import JobLease
+
+logger = logging.getLogger(__name__)
+
+VARIANT_FIELDS = ("prompt", "language", "tone", "type")
+FINISHED_STATUSES = ("completed", "partial", "cancelled")
+
+
+class AIBatchService:
+    def __init__(self, db, generate: Callable[[Dict, Optional[str]], Awaitable[Dict]],
+                 concurrency: Optional[int] = None, max_variants: Optional[int] = None):
+        """
+        Initialize AI Batch Service
+
+        Args:
+            db: MongoDB database instance
+            generate: async (variant, tenant_id) -> {"content", "cached"}, checks
+                the response cache before calling the model
+            concurrency: Default variants generated at once per job (AI_BATCH_CONCURRENCY)
+            max_variants: Largest accepted batch (AI_BATCH_MAX_VARIANTS)
+        """
+        self.db = db
+        self.generate = generate
+        self.concurrency = concurrency or int(os.environ.get('AI_BATCH_CONCURRENCY', '4'))
+        self.max_variants = max_variants or int(os.environ.get('AI_BATCH_MAX_VARIANTS', '50'))
+        self.lease = JobLease(db.ai_batch_jobs)
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+
+    @staticmethod
+    def variant_key(variant: Dict) -> str:
+        """Identical specs in one batch share a single generation"""
+        return AIResponseCache.make_key(**{name: variant.get(name) for name in VARIANT_FIELDS})
+
+    async def create_job(self, user_id: str, variants: List[Dict], concurrency: Optional[int] = None) -> Dict:
+        """
+        Store a new job and start it in the background
+
+        Args:
+            user_id: Coach user id (also the LLM tenant)
+            variants: Variant specs (prompt, language, tone, type, regenerate, label)
+            concurrency: Variants generated at once, capped to the service default
+
+        Returns:
+            Job document
+        """
+        if not variants:
+            raise ValueError("At least one variant is required")
+        if len(variants) > self.max_variants:
+            raise ValueError(f"At most {self.max_variants} variants per batch")
+
+        now = datetime.now(timezone.utc).isoformat()
+        job = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "status": "pending",
+            "concurrency": max(1, min(concurrency or self.concurrency, self.concurrency)),
+            "total": len(variants),
+            "done": 0,
+            "failed": 0,
+            "cached": 0,
+            "variants": [
+                {
+                    **variant,
+                    "index": index,
+                    "key": self.variant_key(variant),
+                    "status": "pending",
+                    "content": None,
+                    "cached": False,
+                    "error": None
+                }
+                for index, variant in enumerate(variants)
+            ],
+            "created_at": now,
+            "updated_at": now
+        }
+        await self.db.ai_batch_jobs.insert_one(dict(job))
+        self.start(job["id"])
+        return job
+
+    def start(self, job_id: str) -> bool:
+        """
+        Run a job in the background unless it is already running in this process;
+        the runner gives up if another process holds the job's lease
+
+        Returns:
+            True if a runner was started
+        """
+        task = self._tasks.get(job_id)
+        if task and not task.done():
+            return False
+        task = self._tasks[job_id] = asyncio.get_running_loop().create_task(self._run(job_id))
+        task.add_done_callback(lambda done: self._forget(job_id, done))
+        return True
+
+    def _forget(self, job_id: str, task: asyncio.Task) -> None:
+        if self._tasks.get(job_id) is task:
+            del self._tasks[job_id]
+
+    def is_running(self, job_id: str) -> bool:
+        task = self._tasks.get(job_id)
+        return task is not None and not task.done()
+
+    async def resume(self, job_id: str, retry_failed: bool = True) -> bool:
+        """
+        Restart an interrupted or partially failed job; finished variants are kept
+
+        Args:
+            job_id: Job id
+            retry_failed: Also retry variants that failed
+
+        Returns:
+            True if a runner was started
+        """
+        if self.is_running(job_id):
+            return False
+        # Running in another process (live lease): leave it alone
+        job = await self.db.ai_batch_jobs.find_one(
+            {"$and": [{"id": job_id}, JobLease.expired()]},
+            {"_id": 0, "variants": 1}
+        )
+        if not job:
+            return False
+        updates = {"status": "pending", "updated_at": datetime.now(timezone.utc).isoformat()}
+        retried = 0
+        if retry_failed:
+            for variant in job["variants"]:
+                if variant["status"] == "failed":
+                    updates[f"variants.{variant['index']}.status"] = "pending"
+                    retried += 1
+        result = await self.db.ai_batch_jobs.update_one(
+            {"$and": [{"id": job_id}, JobLease.expired()]},
+            {"$set": updates, "$inc": {"failed": -retried}}
+        )
+        if result.matched_count == 0:
+            return False
+        return self.start(job_id)
+
+    async def resume_interrupted(self) -> int:
+        """Restart jobs left pending or running by a previous process (call at startup)"""
+        jobs = await self.db.ai_batch_jobs.find(
+            {"$and": [{"status": {"$in": ["pending", "running"]}}, JobLease.expired()]},
+            {"_id": 0, "id": 1}
+        ).to_list(length=100)
+        for job in jobs:
+            self.start(job["id"])
+        if jobs:
+            logger.info(f"Resumed {len(jobs)} interrupted AI batch job(s)")
+        return len(jobs)
+
+    async def cancel(self, job_id: str) -> bool:
+        """Stop a running job, variants already generated are kept"""
+        task = self._tasks.get(job_id)
+        if task and not task.done():
+            task.cancel()
+        result = await self.db.ai_batch_jobs.update_one(
+            {"id": job_id, "status": {"$in": ["pending", "running"]}},
+            {"$set": {"status": "cancelled", "updated_at": datetime.now(timezone.utc).isoformat()}}
+        )
+        if result.modified_count:
+            self._publish(job_id, "done", {"job_id": job_id, "status": "cancelled"})
+        return bool(result.modified_count)
+
+    async def _run(self, job_id: str) -> None:
+        # Only one process runs a job; another takes it over once the lease expired
+        acquired = await self.lease.acquire(
+            {"id": job_id, "status": {"$in": ["pending", "running"]}},
+            {"status": "running", "updated_at": datetime.now(timezone.utc).isoformat()}
+        )
+        if not acquired:
+            return
+        try:
+            async with self.lease.keep(job_id):
+                await self._generate(job_id)
+        finally:
+            try:
+                await self.lease.release(job_id)
+            except Exception as e:
+                logger.error(f"Error releasing AI batch job {job_id}: {e}")
+
+    async def _generate(self, job_id: str) -> None:
+        job = await self.db.ai_batch_jobs.find_one({"id": job_id}, {"_id": 0})
+
+        # One generation per distinct spec; duplicates get the same result
+        groups: Dict[str, List[Dict]] = {}
+        for variant in job["variants"]:
+            if variant["status"] == "pending":
+                groups.setdefault(variant["key"], []).append(variant)
+
+        semaphore = asyncio.Semaphore(job["concurrency"])
+
+        async def run_group(variants: List[Dict]) -> None:
+            async with semaphore:
+                # Cancelled meanwhile, possibly from another process: skip the rest
+                current = await self.db.ai_batch_jobs.find_one({"id": job_id}, {"_id": 0, "status": 1})
+                if not current or current["status"] != "running":
+                    return
+                try:
+                    result = await self.generate(variants[0], job["user_id"])
+                    update = {"status": "done", "content": result["content"], "cached": result.get("cached", False)}
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error generating AI batch variant {job_id}/{variants[0]['index']}: {e}")
+                    update = {"status": "failed", "error": str(e)}
+            await self._save_variants(job_id, variants, update)
+
+        try:
+            await asyncio.gather(*(run_group(variants) for variants in groups.values()))
+        except asyncio.CancelledError:
+            logger.info(f"AI batch job {job_id} cancelled")
+            raise
+
+        job = await self.db.ai_batch_jobs.find_one({"id": job_id}, {"_id": 0, "failed": 1, "status": 1})
+        if job and job["status"] == "running":
+            status = "partial" if job["failed"] else "completed"
+            await self._set_status(job_id, status)
+            self._publish(job_id, "done", {"job_id": job_id, "status": status})
+
+    async def _save_variants(self, job_id: str, variants: List[Dict], update: Dict) -> None:
+        fields = {}
+        for variant in variants:
+            for name, value in update.items():
+                fields[f"variants.{variant['index']}.{name}"] = value
+        fields["updated_at"] = datetime.now(timezone.utc).isoformat()
+        counter = "done" if update["status"] == "done" else "failed"
+        increments = {counter: len(variants)}
+        if update.get("cached"):
+            increments["cached"] = len(variants)
+        await self.db.ai_batch_jobs.update_one({"id": job_id}, {"$set": fields, "$inc": increments})
+
+        for variant in variants:
+            self._publish(job_id, "result", {**self.public_variant(variant), **update})
+
+    async def _set_status(self, job_id: str, status: str) -> None:
+        await self.db.ai_batch_jobs.update_one(
+            {"id": job_id},
+            {"$set": {"status": status, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        )
+
+    @staticmethod
+    def public_variant(variant: Dict) -> Dict:
+        """Variant as returned to clients (without the internal dedupe key)"""
+        return {name: value for name, value in variant.items() if name != "key"}
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        """Queue receiving (event, data) for every variant that finishes"""
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[job_id]
+
+    def _publish(self, job_id: str, event: str, data: Dict) -> None:
+        for queue in self._subscribers.get(job_id, ()):
+            queue.put_nowait((event, data))
+
+    async def stop(self) -> None:
+        """Cancel running jobs (call at shutdown); they are resumed on the next startup"""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -2,27 +2,105 @@
 AI Memory Service for conversational context
 Maintains conversation history for personalized responses
 """
-from typing import List, Dict, Optional
+from typing import Awaitable, Callable, List, Dict, Optional, Tuple
 from datetime import datetime, timezone
-from collections import deque
+from collections import deque, OrderedDict
+import asyncio
+import time
 import logging
 
+from pymongo import UpdateOne
+
 logger = logging.getLogger(__name__)
 
+# Cached message: (role, content, timestamp, channel)
+CachedMessage = Tuple[str, str, str, str]
+
+# Summarizer: (previous summary, messages to fold in) -> new summary
+Summarizer = Callable[[Optional[str], List[Dict]], Awaitable[str]]
+
 
 class AIMemoryService:
-    def __init__(self, db, max_history: int = 5):
+    def __init__(self, db, max_history: int = 5, max_cached_contacts: int = 5000,
+                 idle_ttl_seconds: int = 3600, flush_interval: float = 0.5,
+                 summarizer: Optional[Summarizer] = None, summary_batch: Optional[int] = None):
         """
         Initialize AI Memory Service
         
         Args:
             db: MongoDB database instance
             max_history: Maximum number of messages to keep in memory per contact
+            max_cached_contacts: Maximum number of contacts kept in the LRU cache
+            idle_ttl_seconds: Contacts not accessed for this long are evicted from the cache
+            flush_interval: Seconds between two write-behind flushes to the database
+            summarizer: Folds messages pushed out of the window into a running
+                summary per contact (no summary is kept without it)
+            summary_batch: Number of pushed-out messages summarized at once
+                (max_history by default)
         """
         self.db = db
         self.max_history = max_history
-        # In-memory cache for fast access
-        self.conversation_cache: Dict[str, deque] = {}
+        self.max_cached_contacts = max_cached_contacts
+        self.idle_ttl_seconds = idle_ttl_seconds
+        # In-memory LRU cache for fast access: contact_id -> [last_access, deque of CachedMessage, summary]
+        self.conversation_cache: "OrderedDict[str, list]" = OrderedDict()
+        # Rolling summaries: messages pushed out of the window wait here until
+        # the next background summarization (kept in memory only, so at most
+        # summary_batch - 1 messages per contact are lost on restart)
+        self.summarizer = summarizer
+        self.summary_batch = summary_batch or max_history
+        self._to_summarize: Dict[str, List[Dict]] = {}
+        self._summary_tasks: Dict[str, asyncio.Task] = {}
+        # Write-behind buffer: messages not yet persisted, per contact
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, List[Dict]] = {}
+        self._in_flight: Dict[str, List[Dict]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+    
+    @staticmethod
+    def _to_dict(message: CachedMessage) -> Dict:
+        """Expand a cached message tuple to the API/database format"""
+        role, content, timestamp, channel = message
+        return {"role": role, "content": content, "timestamp": timestamp, "channel": channel}
+    
+    @staticmethod
+    def _to_tuple(message: Dict) -> CachedMessage:
+        """Compact a message dict for the in-memory cache"""
+        return (message["role"], message["content"], message.get("timestamp"), message.get("channel", "unknown"))
+    
+    def _cache_entry(self, contact_id: str) -> Optional[list]:
+        """Get a cache entry and mark it as recently used"""
+        entry = self.conversation_cache.get(contact_id)
+        if entry is None:
+            return None
+        
+        now = time.monotonic()
+        if now - entry[0] > self.idle_ttl_seconds:
+            del self.conversation_cache[contact_id]
+            return None
+        
+        entry[0] = now
+        self.conversation_cache.move_to_end(contact_id)
+        return entry
+    
+    def _cache_get(self, contact_id: str) -> Optional[deque]:
+        """Get a cached conversation and mark it as recently used"""
+        entry = self._cache_entry(contact_id)
+        return entry[1] if entry is not None else None
+    
+    def _cache_put(self, contact_id: str, messages: deque, summary: Optional[str] = None) -> None:
+        """Cache a conversation, evicting idle and least recently used contacts"""
+        now = time.monotonic()
+        self.conversation_cache[contact_id] = [now, messages, summary]
+        self.conversation_cache.move_to_end(contact_id)
+        
+        # Least recently used entries sit at the front
+        while self.conversation_cache:
+            oldest_id, (last_access, _, _) = next(iter(self.conversation_cache.items()))
+            if len(self.conversation_cache) <= self.max_cached_contacts and now - last_access <= self.idle_ttl_seconds:
+                break
+            del self.conversation_cache[oldest_id]
     
     async def add_message(self, contact_id: str, role: str, content: str, 
                          channel: str = "whatsapp") -> None:
@@ -43,32 +121,180 @@ class AIMemoryService:
                 "channel": channel
             }
             
-            # Update in-memory cache
-            if contact_id not in self.conversation_cache:
-                self.conversation_cache[contact_id] = deque(maxlen=self.max_history)
+            # Update in-memory cache (load the stored window first so it stays complete)
+            cached = self._cache_get(contact_id)
+            if cached is None:
+                await self.get_conversation_history(contact_id)
+                cached = self._cache_get(contact_id)
+            if cached is None:
+                cached = deque(maxlen=self.max_history)
+                self._cache_put(contact_id, cached)
+            
+            if len(cached) == self.max_history and self.summarizer:
+                # The oldest message leaves the window: fold it into the summary
+                self._queue_for_summary(contact_id, self._to_dict(cached[0]))
+            cached.append(self._to_tuple(message))
             
-            self.conversation_cache[contact_id].append(message)
+            # Persist asynchronously (coalesced with the other messages of the contact)
+            pending = self._pending.setdefault(contact_id, [])
+            pending.append(message)
+            del pending[:-self.max_history]  # Older messages would be sliced away anyway
+            self._ensure_flusher()
             
-            # Persist to database
-            await self.db.conversation_history.update_one(
+            logger.info(f"Added {role} message to conversation for contact {contact_id}")
+        except Exception as e:
+            logger.error(f"Error adding message to conversation history: {e}")
+    
+    def _ensure_flusher(self) -> None:
+        """Start the background flush loop if it is not running"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+    
+    async def _flush_loop(self) -> None:
+        """Flush buffered messages every flush_interval until nothing is pending"""
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            # Shielded so that stopping the loop never abandons a write half-way
+            await asyncio.shield(self.flush())
+    
+    async def flush(self) -> None:
+        """
+        Persist buffered messages: one upsert per contact, all sent in a single bulk write
+        """
+        async with self._flush_lock:
+            if self._pending:
+                await self._write_pending()
+    
+    async def _write_pending(self) -> None:
+        """Write the current buffer (caller holds the flush lock)"""
+        pending, self._pending = self._pending, {}
+        self._in_flight = pending
+        now = datetime.now(timezone.utc).isoformat()
+        operations = [
+            UpdateOne(
                 {"contact_id": contact_id},
                 {
                     "$push": {
                         "messages": {
-                            "$each": [message],
+                            "$each": messages,
                             "$slice": -self.max_history  # Keep only last N messages
                         }
                     },
                     "$set": {
-                        "last_updated": datetime.now(timezone.utc).isoformat()
+                        "last_updated": now
                     }
                 },
                 upsert=True
             )
+            for contact_id, messages in pending.items()
+        ]
+        
+        try:
+            await self.db.conversation_history.bulk_write(operations, ordered=False)
+        except Exception as e:
+            logger.error(f"Error persisting conversation history: {e}")
+            # Put the messages back in front of anything buffered meanwhile
+            for contact_id, messages in pending.items():
+                merged = messages + self._pending.get(contact_id, [])
+                self._pending[contact_id] = merged[-self.max_history:]
+        finally:
+            self._in_flight = {}
+    
+    async def stop(self) -> None:
+        """Stop the flush loop and persist everything still buffered (call at shutdown)"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        self._flush_task = None
+        await self.flush()
+        # Summaries in progress are abandoned (see summary_batch in __init__)
+        for task in self._summary_tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._summary_tasks.values(), return_exceptions=True)
+        self._summary_tasks.clear()
+    
+    def _queue_for_summary(self, contact_id: str, message: Dict) -> None:
+        """Buffer a message pushed out of the window and summarize full batches in the background"""
+        queued = self._to_summarize.setdefault(contact_id, [])
+        queued.append(message)
+        # Bound the buffer if the summarizer keeps failing
+        del queued[:-self.summary_batch * 4]
+        
+        task = self._summary_tasks.get(contact_id)
+        if len(queued) >= self.summary_batch and (task is None or task.done()):
+            self._summary_tasks[contact_id] = asyncio.create_task(self._summarize(contact_id))
+    
+    async def _summarize(self, contact_id: str) -> None:
+        """Fold queued messages into the contact summary until less than a batch is left"""
+        while len(self._to_summarize.get(contact_id, [])) >= self.summary_batch:
+            batch = list(self._to_summarize[contact_id])
+            previous = await self.get_summary(contact_id)
+            try:
+                summary = (await self.summarizer(previous, batch)).strip()
+            except Exception as e:
+                logger.error(f"Error summarizing conversation for contact {contact_id}: {e}")
+                return
             
-            logger.info(f"Added {role} message to conversation for contact {contact_id}")
+            # clear_conversation may have run while the summarizer was working
+            queued = self._to_summarize.get(contact_id)
+            if queued is None:
+                return
+            del queued[:len(batch)]
+            if not queued:
+                del self._to_summarize[contact_id]
+            
+            entry = self.conversation_cache.get(contact_id)
+            if entry is not None:
+                entry[2] = summary
+            try:
+                await self.db.conversation_history.update_one(
+                    {"contact_id": contact_id},
+                    {"$set": {"summary": summary, "summary_updated_at": datetime.now(timezone.utc).isoformat()}},
+                    upsert=True
+                )
+            except Exception as e:
+                logger.error(f"Error saving conversation summary: {e}")
+    
+    async def get_summary(self, contact_id: str) -> Optional[str]:
+        """
+        Get the rolling summary of the messages older than the recent window
+        
+        Args:
+            contact_id: ID of the contact
+            
+        Returns:
+            Summary text or None
+        """
+        entry = self._cache_entry(contact_id)
+        if entry is not None:
+            return entry[2]
+        try:
+            conversation = await self.db.conversation_history.find_one(
+                {"contact_id": contact_id},
+                {"_id": 0, "summary": 1}
+            )
+            return conversation.get("summary") if conversation else None
         except Exception as e:
-            logger.error(f"Error adding message to conversation history: {e}")
+            logger.error(f"Error getting conversation summary: {e}")
+            return None
+    
+    async def get_memory(self, contact_id: str) -> Tuple[Optional[str], List[Dict]]:
+        """
+        Get everything the AI should know about a conversation
+        
+        Args:
+            contact_id: ID of the contact
+            
+        Returns:
+            (summary of older messages, recent messages in chronological order);
+            recent messages include the ones waiting to be summarized
+        """
+        history = await self.get_conversation_history(contact_id)
+        summary = await self.get_summary(contact_id)
+        return summary, self._to_summarize.get(contact_id, []) + history
     
     async def get_conversation_history(self, contact_id: str) -> List[Dict]:
         """
@@ -82,19 +308,33 @@ class AIMemoryService:
         """
         try:
             # Check cache first
-            if contact_id in self.conversation_cache:
-                return list(self.conversation_cache[contact_id])
+            cached = self._cache_get(contact_id)
+            if cached is not None:
+                return [self._to_dict(msg) for msg in cached]
             
-            # Load from database
+            # Load from database (only the last N messages)
             conversation = await self.db.conversation_history.find_one(
                 {"contact_id": contact_id},
-                {"_id": 0, "messages": 1}
+                {"_id": 0, "messages": {"$slice": -self.max_history}}
             )
             
-            if conversation and "messages" in conversation:
-                messages = conversation["messages"]
+            # Messages not flushed yet are newer than the stored ones; a write in
+            # flight may or may not be visible in the stored list already
+            stored = conversation.get("messages", []) if conversation else []
+            messages = list(stored)
+            seen = {(m.get("timestamp"), m["role"], m["content"]) for m in stored}
+            for msg in self._in_flight.get(contact_id, []) + self._pending.get(contact_id, []):
+                if (msg["timestamp"], msg["role"], msg["content"]) not in seen:
+                    messages.append(msg)
+            messages = messages[-self.max_history:]
+            
+            if messages:
                 # Update cache
-                self.conversation_cache[contact_id] = deque(messages, maxlen=self.max_history)
+                self._cache_put(
+                    contact_id,
+                    deque((self._to_tuple(msg) for msg in messages), maxlen=self.max_history),
+                    conversation.get("summary") if conversation else None
+                )
                 return messages
             
             return []
@@ -110,12 +350,15 @@ class AIMemoryService:
             contact_id: ID of the contact
         """
         try:
-            # Clear from cache
-            if contact_id in self.conversation_cache:
-                del self.conversation_cache[contact_id]
-            
-            # Clear from database
-            await self.db.conversation_history.delete_one({"contact_id": contact_id})
+            # Holding the flush lock keeps an in-flight write from recreating the document
+            async with self._flush_lock:
+                # Clear from cache and drop unsaved messages
+                self.conversation_cache.pop(contact_id, None)
+                self._pending.pop(contact_id, None)
+                self._to_summarize.pop(contact_id, None)
+                
+                # Clear from database
+                await self.db.conversation_history.delete_one({"contact_id": contact_id})
             
             logger.info(f"Cleared conversation history for contact {contact_id}")
         except Exception as e:
@@ -135,7 +378,7 @@ class AIMemoryService:
             Formatted context string for AI
         """
         try:
-            history = await self.get_conversation_history(contact_id)
+            summary, history = await self.get_memory(contact_id)
             
             context_parts = [
                 f"Conversation avec {contact_name}:",
@@ -146,6 +389,11 @@ class AIMemoryService:
                 context_parts.append(f"Contexte de la campagne: {campaign_context}")
                 context_parts.append("")
             
+            if summary:
+                context_parts.append("Résumé des échanges précédents:")
+                context_parts.append(summary)
+                context_parts.append("")
+            
             if history:
                 context_parts.append("Historique récent:")
                 for msg in history:
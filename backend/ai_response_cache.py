@@ -0,0 +1,136 @@
+"""
+AI Response Cache
+Exact-match cache for generated AI content (subject lines, CTAs, emails)
+"""
+from typing import Dict, Optional
+from datetime import datetime, timezone, timedelta
+import hashlib
+import json
+import logging
+
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class AIResponseCache:
+    def __init__(self, db, ttl_seconds: int = 7 * 24 * 3600, max_memory_entries: int = 1000):
+        """
+        Initialize AI Response Cache
+
+        Args:
+            db: MongoDB database instance
+            ttl_seconds: How long a cached response stays valid
+            max_memory_entries: Size of the in-memory LRU kept in front of MongoDB
+        """
+        self.collection = db.ai_response_cache
+        self.ttl_seconds = ttl_seconds
+        # In-memory LRU for the hottest entries
+        self.memory = TTLCache(maxsize=max_memory_entries, ttl=ttl_seconds)
+        self.stats = {
+            "memory_hits": 0,
+            "db_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "stores": 0
+        }
+
+    @staticmethod
+    def make_key(**fields) -> str:
+        """
+        Build a cache key from request fields
+
+        Strings are case-folded and whitespace-collapsed so trivially different
+        prompts ("Promo  été" vs "promo été") share the same entry.
+        """
+        normalized = {
+            name: " ".join(value.split()).casefold() if isinstance(value, str) else value
+            for name, value in fields.items()
+        }
+        payload = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def ensure_indexes(self) -> None:
+        """Create the lookup index and the TTL index that expires stale entries"""
+        await self.collection.create_index("key", unique=True)
+        # TTL indexes only work on BSON dates, so expires_at is not stored as ISO string
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def get(self, key: str) -> Optional[Dict]:
+        """
+        Get a cached response
+
+        Args:
+            key: Key built with make_key
+
+        Returns:
+            Cached value or None on miss
+        """
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            return value
+
+        try:
+            doc = await self.collection.find_one(
+                {"key": key, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+                {"_id": 0, "value": 1}
+            )
+        except Exception as e:
+            logger.error(f"Error reading AI response cache: {e}")
+            doc = None
+
+        if doc:
+            self.stats["db_hits"] += 1
+            self.memory[key] = doc["value"]
+            return doc["value"]
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Dict) -> None:
+        """
+        Store a response in memory and MongoDB
+
+        Args:
+            key: Key built with make_key
+            value: JSON-serialisable response payload
+        """
+        self.memory[key] = value
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.update_one(
+                {"key": key},
+                {
+                    "$set": {
+                        "value": value,
+                        "created_at": now.isoformat(),
+                        "expires_at": now + timedelta(seconds=self.ttl_seconds)
+                    }
+                },
+                upsert=True
+            )
+            self.stats["stores"] += 1
+        except Exception as e:
+            logger.error(f"Error writing AI response cache: {e}")
+
+    def record_bypass(self) -> None:
+        """Count a request that explicitly skipped the cache"""
+        self.stats["bypassed"] += 1
+
+    def get_stats(self) -> Dict:
+        """
+        Get hit-rate statistics
+
+        Returns:
+            Dictionary with counters and hit rate (bypassed requests excluded)
+        """
+        hits = self.stats["memory_hits"] + self.stats["db_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hits": hits,
+            "lookups": lookups,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self.memory)
+        }
@@ -0,0 +1,338 @@
+"""
+Analytics Digest
+Compact per-tenant analytics summary (campaigns, contacts, reservations,
+top items) for the AI assistant, refreshed section by section
+"""
+from typing import Dict, List, Optional, Set, Tuple
+from datetime import datetime, timezone, timedelta
+import asyncio
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Campaigns have no owner and are shared by every tenant; the other
+# sections are computed per coach (user_id)
+GLOBAL_SECTIONS = ("campaigns",)
+TENANT_SECTIONS = ("contacts", "reservations", "top_items")
+SECTIONS = GLOBAL_SECTIONS + TENANT_SECTIONS
+
+
+def _rate(part: int, total: int) -> float:
+    return round(part / total * 100, 1) if total else 0.0
+
+
+def _days_ago(days: int) -> str:
+    return (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+
+
+class AnalyticsDigestService:
+    def __init__(self, db, ttl_seconds: Optional[int] = None):
+        """
+        Initialize Analytics Digest Service
+
+        Each section is cached on its own and recomputed only when it was
+        marked dirty by a write (contact import, reservation, campaign send...)
+        or is older than ttl_seconds. Sections are also stored in MongoDB so a
+        restart does not recompute everything.
+
+        Args:
+            db: MongoDB database instance
+            ttl_seconds: Maximum age of a section (AI_ANALYTICS_DIGEST_TTL)
+        """
+        self.db = db
+        self.ttl_seconds = ttl_seconds or int(os.environ.get('AI_ANALYTICS_DIGEST_TTL', '900'))
+        # (scope, section) -> {"data": ..., "computed_at": iso, "expires_at": monotonic}
+        # scope is None for global sections, the tenant id otherwise
+        self._sections: Dict[Tuple[Optional[str], str], Dict] = {}
+        self._dirty: Set[Tuple[Optional[str], str]] = set()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._loaded: Set[str] = set()
+
+    @staticmethod
+    def _scope(tenant_id: str, section: str) -> Optional[str]:
+        return None if section in GLOBAL_SECTIONS else tenant_id
+
+    def mark_dirty(self, tenant_id: Optional[str], *sections: str) -> None:
+        """
+        Flag sections for recomputation on the next read
+
+        Args:
+            tenant_id: Coach whose data changed, None for every tenant
+            sections: Section names (all sections if none given)
+        """
+        for section in sections or SECTIONS:
+            if section in GLOBAL_SECTIONS:
+                self._dirty.add((None, section))
+            elif tenant_id is not None:
+                self._dirty.add((tenant_id, section))
+            else:
+                self._dirty.update(key for key in self._sections if key[1] == section)
+
+    def _is_fresh(self, key: Tuple[Optional[str], str]) -> bool:
+        entry = self._sections.get(key)
+        return entry is not None and key not in self._dirty and entry["expires_at"] > time.monotonic()
+
+    async def _load_stored(self, tenant_id: str) -> None:
+        """Load the sections stored by a previous process, once per tenant"""
+        if tenant_id in self._loaded:
+            return
+        self._loaded.add(tenant_id)
+        try:
+            docs = await self.db.analytics_digests.find(
+                {"scope": {"$in": [tenant_id, None]}},
+                {"_id": 0}
+            ).to_list(length=len(SECTIONS))
+        except Exception as e:
+            logger.error(f"Error loading analytics digest: {e}")
+            return
+
+        now = datetime.now(timezone.utc)
+        for doc in docs:
+            key = (doc["scope"], doc["section"])
+            if key in self._sections:
+                continue
+            age = (now - datetime.fromisoformat(doc["computed_at"])).total_seconds()
+            if age < self.ttl_seconds:
+                self._sections[key] = {
+                    "data": doc["data"],
+                    "computed_at": doc["computed_at"],
+                    "expires_at": time.monotonic() + self.ttl_seconds - age
+                }
+
+    async def get_digest(self, tenant_id: str) -> Dict:
+        """
+        Get the digest of a tenant, recomputing only stale sections
+
+        Args:
+            tenant_id: Coach user id
+
+        Returns:
+            section -> data, plus computed_at of the oldest section
+        """
+        lock = self._locks.setdefault(tenant_id, asyncio.Lock())
+        async with lock:
+            await self._load_stored(tenant_id)
+            stale = [section for section in SECTIONS if not self._is_fresh((self._scope(tenant_id, section), section))]
+            if stale:
+                results = await asyncio.gather(
+                    *(getattr(self, f"_compute_{section}")(tenant_id) for section in stale),
+                    return_exceptions=True
+                )
+                for section, result in zip(stale, results):
+                    if isinstance(result, Exception):
+                        logger.error(f"Error computing analytics digest section {section}: {result}")
+                        continue
+                    await self._store(self._scope(tenant_id, section), section, result)
+
+        digest = {}
+        computed = []
+        for section in SECTIONS:
+            entry = self._sections.get((self._scope(tenant_id, section), section))
+            digest[section] = entry["data"] if entry else None
+            if entry:
+                computed.append(entry["computed_at"])
+        digest["computed_at"] = min(computed) if computed else None
+        return digest
+
+    async def _store(self, scope: Optional[str], section: str, data: Dict) -> None:
+        key = (scope, section)
+        computed_at = datetime.now(timezone.utc).isoformat()
+        self._sections[key] = {
+            "data": data,
+            "computed_at": computed_at,
+            "expires_at": time.monotonic() + self.ttl_seconds
+        }
+        self._dirty.discard(key)
+        try:
+            await self.db.analytics_digests.update_one(
+                {"scope": scope, "section": section},
+                {"$set": {"data": data, "computed_at": computed_at}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Error saving analytics digest: {e}")
+
+    async def _compute_campaigns(self, tenant_id: str) -> Dict:
+        """Email and WhatsApp campaign totals and the latest email campaigns"""
+        email_totals, whatsapp_totals, recent = await asyncio.gather(
+            self.db.campaigns.aggregate([
+                {"$match": {"status": "sent"}},
+                {"$group": {
+                    "_id": None,
+                    "count": {"$sum": 1},
+                    "sent": {"$sum": "$stats.sent"},
+                    "opened": {"$sum": "$stats.opened"},
+                    "clicked": {"$sum": "$stats.clicked"}
+                }}
+            ]).to_list(length=1),
+            self.db.whatsapp_campaigns.aggregate([
+                {"$match": {"status": "sent"}},
+                {"$group": {
+                    "_id": None,
+                    "count": {"$sum": 1},
+                    "sent": {"$sum": "$stats.sent"},
+                    "read": {"$sum": "$stats.read"},
+                    "replied": {"$sum": "$stats.replied"}
+                }}
+            ]).to_list(length=1),
+            self.db.campaigns.find(
+                {"status": "sent"},
+                {"_id": 0, "title": 1, "stats": 1}
+            ).sort("sent_at", -1).limit(3).to_list(length=3)
+        )
+        email = email_totals[0] if email_totals else {"count": 0, "sent": 0, "opened": 0, "clicked": 0}
+        whatsapp = whatsapp_totals[0] if whatsapp_totals else {"count": 0, "sent": 0, "read": 0, "replied": 0}
+        return {
+            "email_campaigns": email["count"],
+            "emails_sent": email["sent"],
+            "open_rate": _rate(email["opened"], email["sent"]),
+            "click_rate": _rate(email["clicked"], email["sent"]),
+            "recent": [
+                {
+                    "title": campaign["title"],
+                    "open_rate": _rate(campaign["stats"].get("opened", 0), campaign["stats"].get("sent", 0)),
+                    "click_rate": _rate(campaign["stats"].get("clicked", 0), campaign["stats"].get("sent", 0))
+                }
+                for campaign in recent
+            ],
+            "whatsapp_campaigns": whatsapp["count"],
+            "whatsapp_sent": whatsapp["sent"],
+            "whatsapp_read_rate": _rate(whatsapp["read"], whatsapp["sent"]),
+            "whatsapp_reply_rate": _rate(whatsapp["replied"], whatsapp["sent"])
+        }
+
+    async def _compute_contacts(self, tenant_id: str) -> Dict:
+        """Contact base by subscription status and growth over 30 days"""
+        last_30, last_60 = _days_ago(30), _days_ago(60)
+        rows = await self.db.contacts.aggregate([
+            {"$match": {"user_id": tenant_id}},
+            {"$group": {
+                "_id": "$subscription_status",
+                "total": {"$sum": 1},
+                "active": {"$sum": {"$cond": ["$active", 1, 0]}},
+                "new_30d": {"$sum": {"$cond": [{"$gte": ["$created_at", last_30]}, 1, 0]}},
+                "new_prev_30d": {"$sum": {"$cond": [
+                    {"$and": [{"$gte": ["$created_at", last_60]}, {"$lt": ["$created_at", last_30]}]}, 1, 0
+                ]}}
+            }}
+        ]).to_list(length=20)
+        return {
+            "total": sum(row["total"] for row in rows),
+            "active": sum(row["active"] for row in rows),
+            "by_status": {row["_id"] or "unknown": row["total"] for row in rows},
+            "new_30d": sum(row["new_30d"] for row in rows),
+            "new_prev_30d": sum(row["new_prev_30d"] for row in rows)
+        }
+
+    async def _compute_reservations(self, tenant_id: str) -> Dict:
+        """Reservations and paid revenue, last 30 days against the 30 before"""
+        last_30 = _days_ago(30)
+        rows = await self.db.reservations.aggregate([
+            {"$match": {"user_id": tenant_id, "created_at": {"$gte": _days_ago(60)}, "status": {"$ne": "cancelled"}}},
+            {"$group": {
+                "_id": {
+                    "current": {"$gte": ["$created_at", last_30]},
+                    "currency": "$currency"
+                },
+                "count": {"$sum": 1},
+                "revenue": {"$sum": {"$cond": [{"$eq": ["$payment_status", "completed"]}, "$total_price", 0]}}
+            }}
+        ]).to_list(length=20)
+
+        periods: Dict[str, Dict] = {
+            "last_30d": {"count": 0, "revenue": {}},
+            "prev_30d": {"count": 0, "revenue": {}}
+        }
+        for row in rows:
+            period = periods["last_30d" if row["_id"]["current"] else "prev_30d"]
+            currency = row["_id"].get("currency") or "CHF"
+            period["count"] += row["count"]
+            period["revenue"][currency] = round(period["revenue"].get(currency, 0) + row["revenue"], 2)
+        return periods
+
+    async def _compute_top_items(self, tenant_id: str) -> List[Dict]:
+        """Best-selling catalog items over 90 days"""
+        rows = await self.db.reservations.aggregate([
+            {"$match": {"user_id": tenant_id, "created_at": {"$gte": _days_ago(90)}, "status": {"$ne": "cancelled"}}},
+            {"$group": {
+                "_id": "$catalog_item_id",
+                "reservations": {"$sum": "$quantity"},
+                "revenue": {"$sum": "$total_price"},
+                "currency": {"$first": "$currency"}
+            }},
+            {"$sort": {"revenue": -1}},
+            {"$limit": 5}
+        ]).to_list(length=5)
+        if not rows:
+            return []
+
+        items = await self.db.catalog_items.find(
+            {"id": {"$in": [row["_id"] for row in rows]}},
+            {"_id": 0, "id": 1, "title": 1}
+        ).to_list(length=5)
+        titles = {item["id"]: item["title"] for item in items}
+        return [
+            {
+                "title": titles.get(row["_id"], row["_id"]),
+                "reservations": row["reservations"],
+                "revenue": round(row["revenue"], 2),
+                "currency": row.get("currency") or "CHF"
+            }
+            for row in rows
+        ]
+
+    @staticmethod
+    def format_digest(digest: Dict) -> str:
+        """
+        Render the digest as a short text block for an AI prompt
+
+        Args:
+            digest: Result of get_digest
+
+        Returns:
+            Text of a few lines (empty if nothing could be computed)
+        """
+        lines = []
+        campaigns = digest.get("campaigns")
+        if campaigns:
+            lines.append(
+                f"Campagnes email: {campaigns['email_campaigns']} envoyées, {campaigns['emails_sent']} emails, "
+                f"ouverture {campaigns['open_rate']}%, clic {campaigns['click_rate']}%"
+            )
+            if campaigns["recent"]:
+                lines.append("Dernières campagnes: " + "; ".join(
+                    f"\"{c['title']}\" (ouv. {c['open_rate']}%, clic {c['click_rate']}%)" for c in campaigns["recent"]
+                ))
+            lines.append(
+                f"Campagnes WhatsApp: {campaigns['whatsapp_campaigns']} envoyées, {campaigns['whatsapp_sent']} messages, "
+                f"lus {campaigns['whatsapp_read_rate']}%, réponses {campaigns['whatsapp_reply_rate']}%"
+            )
+
+        contacts = digest.get("contacts")
+        if contacts:
+            statuses = ", ".join(f"{status} {count}" for status, count in contacts["by_status"].items())
+            lines.append(
+                f"Contacts: {contacts['total']} (actifs {contacts['active']}; {statuses}); "
+                f"nouveaux sur 30 j: {contacts['new_30d']} (30 j précédents: {contacts['new_prev_30d']})"
+            )
+
+        reservations = digest.get("reservations")
+        if reservations:
+            def revenue(period: Dict) -> str:
+                return ", ".join(f"{amount} {currency}" for currency, amount in period["revenue"].items()) or "0"
+            lines.append(
+                f"Réservations 30 j: {reservations['last_30d']['count']} (revenu payé {revenue(reservations['last_30d'])}) "
+                f"vs 30 j précédents: {reservations['prev_30d']['count']} ({revenue(reservations['prev_30d'])})"
+            )
+
+        top_items = digest.get("top_items")
+        if top_items:
+            lines.append("Top produits (90 j): " + "; ".join(
+                f"{item['title']} {item['reservations']} rés. {item['revenue']} {item['currency']}" for item in top_items
+            ))
+
+        if not lines:
+            return ""
+        return f"DONNÉES ANALYTIQUES (au {digest['computed_at'][:16].replace('T', ' ')} UTC):\n" + "\n".join(lines)
@@ -0,0 +1,67 @@
+"""
+Micro-benchmark of template_engine render throughput
+
+Compares a template compiled once per send with a regex substitution per
+recipient. Run from the backend folder:
+
+    python bench_template_engine.py [recipients]
+"""
+import re
+import sys
+import time
+
+from template_engine import TAG_PATTERN, compile_template
+
+TEMPLATE = (
+    "Bonjour {{prenom}} 👋\n\n"
+    "Ton abonnement {{membership_type}} se termine le {{subscription_end}}. "
+    "Renouvelle-le avant cette date pour garder ta place au cours de {{course}} !\n\n"
+    "À très vite,\nL'équipe Afroboost"
+)
+ALLOWED = ("prenom", "membership_type", "subscription_end", "course")
+
+
+def recipients(count: int):
+    return [
+        {
+            "prenom": f"Contact{i}",
+            "membership_type": ("standard", "premium", "vip")[i % 3],
+            "subscription_end": f"{1 + i % 28:02d}.{1 + i % 12:02d}.2026"
+        }
+        for i in range(count)
+    ]
+
+
+def regex_render(source: str, values: dict, defaults: dict) -> str:
+    def replace(match: re.Match) -> str:
+        value = values.get(match.group(1), defaults.get(match.group(1)))
+        return "" if value is None else str(value)
+    return TAG_PATTERN.sub(replace, source)
+
+
+def bench(label: str, render, rows) -> float:
+    start = time.perf_counter()
+    for values in rows:
+        render(values)
+    elapsed = time.perf_counter() - start
+    rate = len(rows) / elapsed
+    print(f"{label:<28} {elapsed * 1000:8.1f} ms  {rate:12,.0f} renders/s")
+    return rate
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rows = recipients(count)
+    defaults = {"course": "Afro Dance"}
+
+    template = compile_template(TEMPLATE, allowed=ALLOWED, defaults=defaults)
+    assert template.render(rows[0]) == regex_render(TEMPLATE, rows[0], defaults)
+
+    print(f"{count:,} recipients, {len(template.variables)} variables")
+    compiled = bench("compiled (once per send)", template.render, rows)
+    regex = bench("regex per recipient", lambda values: regex_render(TEMPLATE, values, defaults), rows)
+    print(f"speed-up: x{compiled / regex:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Catalog Search
+In-memory BM25 index over catalog items, used to put only the items
+relevant to a visitor's question into the chat prompt
+"""
+from typing import Dict, List, Set
+import hashlib
+import math
+import re
+import unicodedata
+
+# Field weights: a term in the title counts as much as three in the description
+FIELD_WEIGHTS = {
+    "title": 3,
+    "category": 2,
+    "location": 2,
+    "description": 1
+}
+
+STOPWORDS = {
+    # fr
+    "le", "la", "les", "un", "une", "des", "du", "de", "et", "ou", "est", "en", "pour", "avec",
+    "sur", "au", "aux", "ce", "ces", "je", "tu", "il", "vous", "nous", "vos", "votre", "mon",
+    "ma", "mes", "que", "qui", "quoi", "quel", "quelle", "quels", "quelles", "pas", "plus",
+    "bonjour", "merci", "avez",
+    # en
+    "the", "a", "an", "and", "or", "is", "are", "for", "with", "on", "to", "of", "in", "do",
+    "you", "your", "my", "what", "which", "have", "hello", "hi", "thanks",
+    # de
+    "der", "die", "das", "und", "oder", "ist", "ein", "eine", "mit", "fur", "zu", "von", "im",
+    "ich", "sie", "ihr", "was", "haben", "hallo", "danke"
+}
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, strip accents and drop stopwords ("Été" and "ete" match)"""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return [token for token in _TOKEN_RE.findall(text) if len(token) > 1 and token not in STOPWORDS]
+
+
+def _item_terms(item: Dict) -> Dict[str, int]:
+    terms: Dict[str, int] = {}
+    for name, weight in FIELD_WEIGHTS.items():
+        for token in tokenize(str(item.get(name) or "")):
+            terms[token] = terms.get(token, 0) + weight
+    return terms
+
+
+def _fingerprint(item: Dict) -> str:
+    text = "\x1f".join(str(item.get(name) or "") for name in FIELD_WEIGHTS)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class CatalogIndex:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        Initialize Catalog Index
+
+        Args:
+            k1: BM25 term frequency saturation
+            b: BM25 document length normalisation
+        """
+        self.k1 = k1
+        self.b = b
+        self.items: Dict[str, Dict] = {}
+        self.order: Dict[str, int] = {}
+        self._terms: Dict[str, Dict[str, int]] = {}
+        self._lengths: Dict[str, int] = {}
+        self._fingerprints: Dict[str, str] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def _add(self, item_id: str, item: Dict) -> None:
+        terms = _item_terms(item)
+        self._terms[item_id] = terms
+        self._lengths[item_id] = sum(terms.values())
+        self._total_length += self._lengths[item_id]
+        self._fingerprints[item_id] = _fingerprint(item)
+        for term in terms:
+            self._postings.setdefault(term, set()).add(item_id)
+
+    def _remove(self, item_id: str) -> None:
+        for term in self._terms.pop(item_id, {}):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.discard(item_id)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(item_id, 0)
+        self._fingerprints.pop(item_id, None)
+        self.items.pop(item_id, None)
+
+    def sync(self, items: List[Dict]) -> int:
+        """
+        Bring the index in line with the current catalog
+
+        Only items whose indexed fields changed are re-tokenised; stock and
+        price updates just replace the stored item.
+
+        Args:
+            items: Current catalog items (with id)
+
+        Returns:
+            Number of items added, re-indexed or removed
+        """
+        changed = 0
+        current = {item["id"]: item for item in items}
+        for item_id in [item_id for item_id in self.items if item_id not in current]:
+            self._remove(item_id)
+            changed += 1
+
+        for item_id, item in current.items():
+            if self._fingerprints.get(item_id) != _fingerprint(item):
+                self._remove(item_id)
+                self._add(item_id, item)
+                changed += 1
+            self.items[item_id] = item
+
+        self.order = {item["id"]: position for position, item in enumerate(items)}
+        return changed
+
+    def search(self, query: str, k: int = 8) -> List[Dict]:
+        """
+        Top-k items for a query, ranked by BM25
+
+        Args:
+            query: Visitor message (and recent context)
+            k: Number of items to return
+
+        Returns:
+            Matching items, best first (empty if no query term is indexed)
+        """
+        if not self.items:
+            return []
+        count = len(self.items)
+        average_length = self._total_length / count or 1
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for item_id in postings:
+                frequency = self._terms[item_id][term]
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[item_id] / average_length)
+                scores[item_id] = scores.get(item_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        ranked = sorted(scores, key=lambda item_id: (-scores[item_id], self.order.get(item_id, 0)))
+        return [self.items[item_id] for item_id in ranked[:k]]
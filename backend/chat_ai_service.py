@@ -5,15 +5,131 @@ Connaissance des produits, cartes cadeaux, et mémoire conversationnelle
 
 import os
 import re
-from typing import Dict, List, Optional
+import time
+import json
+import asyncio
+import hashlib
+from typing import AsyncIterator, Dict, List, Optional
 from datetime import datetime, timezone
 
+from prompt_builder import PromptBuilder, PromptBuild, DEFAULT_PROMPT_TOKEN_BUDGET
+from llm_provider import LLMClient, SingleFlight, get_llm_provider
+from llm_scheduler import PRIORITY_INTERACTIVE
+from intent_matcher import IntentMatcher
+from catalog_search import CatalogIndex
+from cachetools import TTLCache
+
+# Durée de vie du contexte catalogue/promotions mis en cache (secondes).
+# Les modifications du catalogue et des réductions invalident le cache
+# immédiatement, la TTL ne couvre que les promotions qui commencent ou
+# expirent d'elles-mêmes.
+CONTEXT_CACHE_TTL = int(os.environ.get('CHAT_AI_CONTEXT_TTL', '300'))
+
+# Durée de vie des réponses mises en cache pour une même question posée
+# avec le même contexte (0 désactive le cache, la coalescence reste active)
+ANSWER_CACHE_TTL = int(os.environ.get('CHAT_AI_ANSWER_TTL', '60'))
+
+# Produits chargés par tenant (index de recherche) et produits pertinents
+# envoyés au modèle pour chaque message
+CATALOG_MAX_ITEMS = 500
+CATALOG_TOP_K = int(os.environ.get('CHAT_AI_CATALOG_TOP_K', '8'))
+
+# Réponses instantanées (sans LLM) aux questions simples et courtes
+FAST_PATH_ENABLED = os.environ.get('CHAT_AI_FAST_PATH', '1') == '1'
+FAST_PATH_MAX_WORDS = 12
+FAST_ANSWER_MAX_ITEMS = 5
+
+# Mots-clés par intention et par langue, compilés en un seul automate
+INTENT_KEYWORDS = {
+    "human": {
+        "fr": ["parler à quelqu'un", "parler à un humain", "agent", "coach",
+               "personne réelle", "humain", "conseiller", "vendeur"],
+        "en": ["talk to someone", "speak to human", "real person"],
+        "de": ["mit jemandem sprechen", "menschlich"]
+    },
+    "prices": {
+        "fr": ["prix", "tarif", "combien", "coût", "cout"],
+        "en": ["price", "pricing", "how much", "cost"],
+        "de": ["preis", "kostet", "kosten", "wie viel", "wieviel"]
+    },
+    "location": {
+        "fr": ["où", "adresse", "lieu", "endroit", "se situe"],
+        "en": ["where", "address", "location"],
+        "de": ["wo", "standort", "ort"]
+    },
+    "schedule": {
+        "fr": ["horaire", "quand", "quelle heure", "planning", "quel jour"],
+        "en": ["when", "schedule", "what time", "timetable", "opening hours"],
+        "de": ["wann", "uhrzeit", "zeitplan", "stundenplan"]
+    },
+    "promotions": {
+        "fr": ["code promo", "réduction", "reduction", "promo", "remise"],
+        "en": ["discount", "coupon", "promo code"],
+        "de": ["rabatt", "aktion"]
+    },
+    "gift_cards": {
+        "fr": ["carte cadeau", "cartes cadeaux", "bon cadeau"],
+        "en": ["gift card", "gift voucher"],
+        "de": ["gutschein", "geschenkkarte"]
+    }
+}
+
+INTENT_MATCHER = IntentMatcher(INTENT_KEYWORDS)
+
+FAST_ANSWER_TEMPLATES = {
+    "prices": {
+        "fr": "Voici nos tarifs actuels :\n{lines}\n\nDites-moi ce qui vous intéresse, je vous aide à réserver !",
+        "en": "Here are our current prices:\n{lines}\n\nTell me what interests you and I'll help you book!",
+        "de": "Hier sind unsere aktuellen Preise:\n{lines}\n\nSagen Sie mir, was Sie interessiert, ich helfe Ihnen bei der Buchung!"
+    },
+    "location": {
+        "fr": "Voici où ont lieu nos activités :\n{lines}",
+        "en": "Here is where our activities take place:\n{lines}",
+        "de": "Hier finden unsere Aktivitäten statt:\n{lines}"
+    },
+    "schedule": {
+        "fr": "Voici nos horaires :\n{lines}",
+        "en": "Here is our schedule:\n{lines}",
+        "de": "Hier ist unser Zeitplan:\n{lines}"
+    },
+    "promotions": {
+        "fr": "Promotions en cours :\n{lines}",
+        "en": "Current promotions:\n{lines}",
+        "de": "Aktuelle Aktionen:\n{lines}"
+    },
+    "no_promotions": {
+        "fr": "Aucune promotion n'est active pour le moment, mais nos cartes cadeaux sont toujours disponibles !",
+        "en": "There are no active promotions right now, but our gift cards are always available!",
+        "de": "Derzeit gibt es keine aktiven Aktionen, aber unsere Gutscheine sind jederzeit erhältlich!"
+    },
+    "gift_cards": {
+        "fr": "🎁 Nos cartes cadeaux : montant au choix, valables 1 an sur tous nos produits et services, avec un message personnalisé.",
+        "en": "🎁 Our gift cards: any amount, valid for 1 year on all our products and services, with a personal message.",
+        "de": "🎁 Unsere Gutscheine: frei wählbarer Betrag, 1 Jahr gültig für alle Produkte und Leistungen, mit persönlicher Nachricht."
+    }
+}
+
+DAY_NAMES = {
+    "fr": {"monday": "lundi", "tuesday": "mardi", "wednesday": "mercredi", "thursday": "jeudi",
+           "friday": "vendredi", "saturday": "samedi", "sunday": "dimanche"},
+    "en": {"monday": "Monday", "tuesday": "Tuesday", "wednesday": "Wednesday", "thursday": "Thursday",
+           "friday": "Friday", "saturday": "Saturday", "sunday": "Sunday"},
+    "de": {"monday": "Montag", "tuesday": "Dienstag", "wednesday": "Mittwoch", "thursday": "Donnerstag",
+           "friday": "Freitag", "saturday": "Samstag", "sunday": "Sonntag"}
+}
+
 class ChatAIService:
     """Service IA pour le chat publicitaire intelligent"""
     
-    def __init__(self, db, openai_api_key: str):
+    # Modèle utilisé pour le chat publicitaire
+    model = "gpt-3.5-turbo"
+    # Modèle moins cher interrogé en parallèle si le principal est lent ou en panne
+    hedge_model = "gpt-4o-mini"
+    
+    def __init__(self, db, openai_api_key: str, llm_client: Optional[LLMClient] = None):
         self.db = db
         self.api_key = openai_api_key
+        self.llm = llm_client or LLMClient()
         self.system_prompt = """Tu es un assistant virtuel BoostTribe, expert en marketing et vente.
 Tu connais parfaitement le catalogue de produits, cours, événements, cartes cadeaux et réductions.
 Tu es amical, professionnel et tu aides les clients à trouver ce qu'ils recherchent.
@@ -30,35 +146,57 @@ Quand un client demande un produit:
 Si le client veut parler à un humain, réponds:
 "Je vais transmettre votre demande à un coach BoostTribe. Il vous recontactera très rapidement!"
 """
+        # Contexte rendu par tenant (user_id du coach, None = tous les coachs)
+        self._context_cache: Dict[Optional[str], Dict] = {}
+        self._context_locks: Dict[Optional[str], asyncio.Lock] = {}
+        self._context_version = 0
+        # Index BM25 par tenant, conservé entre deux rechargements du contexte
+        # pour ne ré-indexer que les produits modifiés
+        self._catalog_indexes: Dict[Optional[str], CatalogIndex] = {}
+        self.prompt_token_budget = DEFAULT_PROMPT_TOKEN_BUDGET
+        # Requêtes identiques simultanées (lancement de campagne) : un seul appel LLM
+        self._single_flight = SingleFlight()
+        self._answer_cache = TTLCache(maxsize=1000, ttl=ANSWER_CACHE_TTL) if ANSWER_CACHE_TTL > 0 else None
+        self.answer_stats = {"cache_hits": 0, "cache_misses": 0}
+        self.fast_path_stats: Dict[str, int] = {}
     
-    async def get_catalog_context(self) -> str:
-        """Récupère le catalogue pour le contexte IA"""
+    async def get_catalog_items(self, tenant_id: Optional[str] = None) -> Optional[List[Dict]]:
+        """Récupère les produits publiés (None si le catalogue est indisponible)"""
         try:
-            items = await self.db.catalog_items.find(
-                {"is_published": True, "is_active": True},
-                {"_id": 0}
-            ).to_list(length=100)
-            
-            if not items:
-                return "Aucun produit disponible actuellement."
+            query = {"is_published": True, "is_active": True}
+            if tenant_id:
+                query["user_id"] = tenant_id
             
-            context = "📦 CATALOGUE DISPONIBLE:\n\n"
-            for item in items:
-                stock_info = ""
-                if item.get('stock_quantity') is not None:
-                    stock_info = f" (Stock: {item['stock_quantity']})"
-                elif item.get('max_attendees'):
-                    places_left = item['max_attendees'] - item.get('current_attendees', 0)
-                    stock_info = f" ({places_left} places restantes)"
-                
-                context += f"- {item['title']}: {item['price']} {item['currency']}{stock_info}\n"
-                context += f"  Catégorie: {item['category']}, Description: {item['description']}\n"
-                context += f"  Lien: /p/{item.get('slug', item['id'])}\n\n"
-            
-            return context
+            return await self.db.catalog_items.find(query, {"_id": 0}).to_list(length=CATALOG_MAX_ITEMS)
         except Exception as e:
             print(f"Error fetching catalog context: {e}")
+            return None
+    
+    def format_catalog_context(self, items: Optional[List[Dict]]) -> str:
+        """Catalogue au format texte pour le contexte IA"""
+        if items is None:
             return "Catalogue temporairement indisponible."
+        if not items:
+            return "Aucun produit disponible actuellement."
+        
+        lines = ["📦 CATALOGUE DISPONIBLE:\n"]
+        for item in items:
+            stock_info = ""
+            if item.get('stock_quantity') is not None:
+                stock_info = f" (Stock: {item['stock_quantity']})"
+            elif item.get('max_attendees'):
+                places_left = item['max_attendees'] - item.get('current_attendees', 0)
+                stock_info = f" ({places_left} places restantes)"
+            
+            lines.append(f"- {item['title']}: {item['price']} {item['currency']}{stock_info}")
+            lines.append(f"  Catégorie: {item['category']}, Description: {item['description']}")
+            lines.append(f"  Lien: /p/{item.get('slug', item['id'])}\n")
+        
+        return "\n".join(lines) + "\n"
+    
+    async def get_catalog_context(self, tenant_id: Optional[str] = None) -> str:
+        """Récupère le catalogue pour le contexte IA"""
+        return self.format_catalog_context(await self.get_catalog_items(tenant_id))
     
     async def get_gift_cards_context(self) -> str:
         """Récupère les infos sur les cartes cadeaux"""
@@ -70,34 +208,111 @@ Les clients peuvent offrir des cartes cadeaux personnalisées:
 - Message personnalisé inclus
 """
     
-    async def get_discounts_context(self) -> str:
+    async def get_active_discounts(self, tenant_id: Optional[str] = None) -> List[Dict]:
         """Récupère les codes promo actifs"""
         try:
             now = datetime.now(timezone.utc)
-            discounts = await self.db.discounts.find(
-                {
-                    "is_active": True,
-                    "start_date": {"$lte": now.isoformat()},
-                    "end_date": {"$gte": now.isoformat()}
-                },
+            query = {
+                "is_active": True,
+                "start_date": {"$lte": now.isoformat()},
+                "end_date": {"$gte": now.isoformat()}
+            }
+            if tenant_id:
+                query["created_by"] = tenant_id
+            
+            return await self.db.discounts.find(
+                query,
                 {"_id": 0, "code": 1, "name": 1, "discount_type": 1, "discount_value": 1}
             ).to_list(length=10)
-            
-            if not discounts:
-                return ""
-            
-            context = "💰 PROMOTIONS ACTIVES:\n\n"
-            for disc in discounts:
-                if disc['discount_type'] == 'percentage':
-                    context += f"- Code {disc['code']}: {disc['discount_value']}% de réduction\n"
-                else:
-                    context += f"- Code {disc['code']}: {disc['discount_value']} CHF de réduction\n"
-                context += f"  {disc['name']}\n\n"
-            
-            return context
         except Exception as e:
             print(f"Error fetching discounts: {e}")
+            return []
+    
+    def format_discounts_context(self, discounts: List[Dict]) -> str:
+        """Promotions actives au format texte pour le contexte IA"""
+        if not discounts:
             return ""
+        
+        lines = ["💰 PROMOTIONS ACTIVES:\n"]
+        for disc in discounts:
+            if disc['discount_type'] == 'percentage':
+                lines.append(f"- Code {disc['code']}: {disc['discount_value']}% de réduction")
+            else:
+                lines.append(f"- Code {disc['code']}: {disc['discount_value']} CHF de réduction")
+            lines.append(f"  {disc['name']}\n")
+        
+        return "\n".join(lines) + "\n"
+    
+    async def get_discounts_context(self, tenant_id: Optional[str] = None) -> str:
+        """Récupère les codes promo actifs pour le contexte IA"""
+        return self.format_discounts_context(await self.get_active_discounts(tenant_id))
+    
+    async def get_tenant_context(self, tenant_id: Optional[str] = None) -> Dict:
+        """
+        Catalogue (données brutes et index de recherche), cartes cadeaux et
+        promotions d'un tenant, chargés une seule fois et servis depuis le
+        cache tant qu'ils ne sont pas invalidés.
+        """
+        entry = self._context_cache.get(tenant_id)
+        if entry and entry["expires_at"] > time.monotonic():
+            return entry
+        
+        lock = self._context_locks.setdefault(tenant_id, asyncio.Lock())
+        async with lock:
+            # Un autre message a pu reconstruire le contexte pendant l'attente
+            entry = self._context_cache.get(tenant_id)
+            if entry and entry["expires_at"] > time.monotonic():
+                return entry
+            
+            version = self._context_version
+            items, gift_cards_context, discounts = await asyncio.gather(
+                self.get_catalog_items(tenant_id),
+                self.get_gift_cards_context(),
+                self.get_active_discounts(tenant_id)
+            )
+            
+            index = self._catalog_indexes.setdefault(tenant_id, CatalogIndex())
+            if items is not None:
+                index.sync(items)
+            
+            entry = {
+                # Cartes cadeaux et promotions : identiques pour tous les messages
+                "offers_text": f"{gift_cards_context}\n{self.format_discounts_context(discounts)}",
+                "items": items,
+                "index": index,
+                "discounts": discounts,
+                "expires_at": time.monotonic() + CONTEXT_CACHE_TTL
+            }
+            
+            # Ne pas mettre en cache un contexte invalidé pendant sa construction
+            if version == self._context_version:
+                self._context_cache[tenant_id] = entry
+            return entry
+    
+    def get_relevant_catalog_context(self, context: Dict, query: str) -> str:
+        """
+        Produits les plus pertinents pour la question (BM25), à défaut les
+        premiers du catalogue
+        """
+        if context["items"] is None:
+            return self.format_catalog_context(None)
+        items = context["index"].search(query, CATALOG_TOP_K) or context["items"][:CATALOG_TOP_K]
+        return f"CONTEXTE ACTUEL:\n\n{self.format_catalog_context(items)}"
+    
+    def invalidate_context(self, tenant_id: Optional[str] = None) -> None:
+        """
+        Invalide le contexte mis en cache après une modification du catalogue
+        ou des réductions. Le contexte global (tenant None) agrège tous les
+        coachs, il est donc toujours invalidé.
+        """
+        self._context_version += 1
+        if self._answer_cache is not None:
+            self._answer_cache.clear()
+        self._context_cache.pop(None, None)
+        if tenant_id:
+            self._context_cache.pop(tenant_id, None)
+        else:
+            self._context_cache.clear()
     
     async def get_conversation_history(self, visitor_email: str, limit: int = 5) -> List[Dict]:
         """Récupère l'historique des conversations d'un visiteur"""
@@ -122,85 +337,239 @@ Les clients peuvent offrir des cartes cadeaux personnalisées:
     
     def detect_human_request(self, message: str) -> bool:
         """Détecte si le client demande à parler à un humain"""
-        keywords = [
-            "parler à quelqu'un", "parler à un humain", "agent", "coach",
-            "personne réelle", "humain", "conseiller", "vendeur",
-            "talk to someone", "speak to human", "real person",
-            "mit jemandem sprechen", "menschlich"
-        ]
-        message_lower = message.lower()
-        return any(keyword in message_lower for keyword in keywords)
+        return "human" in INTENT_MATCHER.intents(message)
+    
+    def _schedule_line(self, item: Dict, language: str) -> Optional[str]:
+        """Horaire d'un cours récurrent ou date d'un événement, None si inconnu"""
+        if item.get('is_recurring') and item.get('recurrence_days'):
+            days = ", ".join(DAY_NAMES[language].get(day, day) for day in item['recurrence_days'])
+            time_info = f" {item['recurrence_time']}" if item.get('recurrence_time') else ""
+            return f"- {item['title']} : {days}{time_info}"
+        if item.get('event_date'):
+            try:
+                event_date = datetime.fromisoformat(str(item['event_date'])).strftime("%d.%m.%Y %H:%M")
+            except ValueError:
+                event_date = str(item['event_date'])
+            return f"- {item['title']} : {event_date}"
+        return None
+    
+    def build_fast_answer(self, intent: str, language: str, context: Dict, message: str = "") -> Optional[Dict]:
+        """
+        Réponse modèle remplie avec les données actuelles du catalogue.
+        None si les données ne permettent pas de répondre (le LLM prend le relais).
+        """
+        # Produits cités dans la question d'abord ("prix du cours de zumba")
+        items = context["items"] or []
+        relevant = context["index"].search(message, FAST_ANSWER_MAX_ITEMS) if message else []
+        if relevant:
+            relevant_ids = {item["id"] for item in relevant}
+            items = relevant + [item for item in items if item["id"] not in relevant_ids]
+        listed: List[Dict] = []
+        
+        if intent == "prices":
+            listed = items[:FAST_ANSWER_MAX_ITEMS]
+            lines = [f"- {item['title']} : {item['price']} {item['currency']} (/p/{item.get('slug', item['id'])})" for item in listed]
+        elif intent == "location":
+            listed = [item for item in items if item.get('location')][:FAST_ANSWER_MAX_ITEMS]
+            lines = [f"- {item['title']} : {item['location']}" for item in listed]
+        elif intent == "schedule":
+            lines = []
+            for item in items:
+                line = self._schedule_line(item, language)
+                if line:
+                    listed.append(item)
+                    lines.append(line)
+                if len(listed) >= FAST_ANSWER_MAX_ITEMS:
+                    break
+        elif intent == "promotions":
+            if not context["discounts"]:
+                return self._fast_answer(FAST_ANSWER_TEMPLATES["no_promotions"][language], [])
+            lines = []
+            for disc in context["discounts"][:FAST_ANSWER_MAX_ITEMS]:
+                value = f"{disc['discount_value']}%" if disc['discount_type'] == 'percentage' else f"{disc['discount_value']} CHF"
+                lines.append(f"- {disc['code']} : -{value} ({disc['name']})")
+        elif intent == "gift_cards":
+            return self._fast_answer(FAST_ANSWER_TEMPLATES["gift_cards"][language], [])
+        else:
+            return None
+        
+        if not lines:
+            return None
+        return self._fast_answer(FAST_ANSWER_TEMPLATES[intent][language].format(lines="\n".join(lines)), listed)
+    
+    def _fast_answer(self, text: str, items: List[Dict]) -> Dict:
+        return {
+            "response": text,
+            "needs_human_escalation": False,
+            "suggested_products": [item.get('slug', item['id']) for item in items][:3]
+        }
+    
+    async def answer_from_intent(self, message: str, tenant_id: Optional[str] = None) -> Optional[Dict]:
+        """
+        Réponse instantanée aux questions courtes avec une seule intention
+        reconnue (prix, lieu, horaires, promotions, cartes cadeaux).
+        
+        Returns:
+            Réponse au format generate_response, None pour passer par le LLM
+        """
+        if not FAST_PATH_ENABLED or len(message.split()) > FAST_PATH_MAX_WORDS:
+            return None
+        
+        intents = INTENT_MATCHER.intents(message)
+        if len(intents) != 1:
+            return None
+        intent, language = next(iter(intents.items()))
+        
+        answer = self.build_fast_answer(intent, language, await self.get_tenant_context(tenant_id), message)
+        if answer is not None:
+            self.fast_path_stats[intent] = self.fast_path_stats.get(intent, 0) + 1
+            answer["intent"] = intent
+        return answer
+    
+    async def build_prompt(
+        self,
+        message: str,
+        visitor_email: Optional[str] = None,
+        tenant_id: Optional[str] = None
+    ) -> PromptBuild:
+        """Construit le prompt envoyé au modèle dans le budget de tokens"""
+        # Contexte (mis en cache) et historique conversation en parallèle
+        if visitor_email:
+            context, history = await asyncio.gather(
+                self.get_tenant_context(tenant_id),
+                self.get_conversation_history(visitor_email)
+            )
+        else:
+            context, history = await self.get_tenant_context(tenant_id), []
+        
+        # Le message précédent du visiteur garde les produits dont il parlait
+        previous = next((m["content"] for m in reversed(history) if m["role"] == "user"), "")
+        catalog = self.get_relevant_catalog_context(context, f"{message} {previous}")
+        
+        # Prompt système et offres d'abord (préfixe stable), puis produits
+        # pertinents pour ce message et historique
+        builder = PromptBuilder(budget=self.prompt_token_budget)
+        builder.add_section("system", self.system_prompt, priority=0, stable=True)
+        builder.add_section("offers", context["offers_text"], priority=1, stable=True, truncatable=True)
+        builder.add_section("catalog", catalog, priority=0, truncatable=True)
+        builder.add_history(history[-5:], priority=1)  # Derniers 5 échanges
+        
+        return builder.build(message)
+    
+    def answer_key(self, message: str, prompt: PromptBuild, tenant_id: Optional[str] = None) -> str:
+        """
+        Clé d'une réponse : question normalisée, version du contexte et
+        historique envoyé. Deux visiteurs sans historique qui posent la
+        même question partagent la même clé.
+        """
+        payload = json.dumps({
+            "message": " ".join(message.split()).casefold(),
+            "tenant_id": tenant_id,
+            "context_version": self._context_version,
+            "history": prompt.messages[:-1]
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def get_cached_answer(self, key: str) -> Optional[Dict]:
+        """Réponse récente pour la même question, None si absente"""
+        if self._answer_cache is None:
+            return None
+        answer = self._answer_cache.get(key)
+        if answer is None:
+            self.answer_stats["cache_misses"] += 1
+            return None
+        self.answer_stats["cache_hits"] += 1
+        return answer
+    
+    def get_answer_stats(self) -> Dict:
+        """Statistiques du cache de réponses et de la coalescence"""
+        return {
+            **self.answer_stats,
+            "answer_cache_entries": len(self._answer_cache) if self._answer_cache is not None else 0,
+            "llm_calls": self._single_flight.stats["calls"],
+            "coalesced": self._single_flight.stats["coalesced"],
+            "fast_path": dict(self.fast_path_stats),
+            "in_flight": self._single_flight.in_flight()
+        }
+    
+    async def _complete_answer(self, prompt: PromptBuild, key: str, tenant_id: Optional[str] = None) -> Dict:
+        """Appel LLM partagé par les requêtes identiques simultanées"""
+        version = self._context_version
+        result = await self.llm.complete(
+            get_llm_provider("openai", self.api_key),
+            prompt.messages,
+            model=self.model,
+            endpoint="ad_chat",
+            temperature=0.7,
+            max_tokens=500,
+            tenant_id=tenant_id,
+            priority=PRIORITY_INTERACTIVE,
+            hedge_model=self.hedge_model
+        )
+        
+        # Détecter produits mentionnés pour suggestions
+        answer = {
+            "response": result.content,
+            "needs_human_escalation": False,
+            "suggested_products": await self._extract_product_suggestions(result.content)
+        }
+        
+        # Ne pas mettre en cache une réponse basée sur un contexte invalidé entre-temps
+        if self._answer_cache is not None and version == self._context_version:
+            self._answer_cache[key] = answer
+        return answer
+    
+    def human_escalation_response(self) -> Dict:
+        """Réponse standard lorsque le client demande un humain"""
+        return {
+            "response": "Je vais transmettre votre demande à un coach BoostTribe. Il vous recontactera très rapidement ! 🚀",
+            "needs_human_escalation": True,
+            "suggested_products": []
+        }
+    
+    def unavailable_response(self) -> Dict:
+        """Réponse de repli lorsque l'IA ne répond pas"""
+        return {
+            "response": "Je suis temporairement indisponible. Un coach BoostTribe va vous contacter rapidement !",
+            "needs_human_escalation": True,
+            "suggested_products": []
+        }
     
     async def generate_response(
         self,
         message: str,
         visitor_email: Optional[str] = None,
-        chat_id: Optional[str] = None
+        chat_id: Optional[str] = None,
+        tenant_id: Optional[str] = None
     ) -> Dict:
         """Génère une réponse IA intelligente"""
         try:
             # Détection demande humaine
             needs_human = self.detect_human_request(message)
             if needs_human:
-                return {
-                    "response": "Je vais transmettre votre demande à un coach BoostTribe. Il vous recontactera très rapidement ! 🚀",
-                    "needs_human_escalation": True,
-                    "suggested_products": []
-                }
-            
-            # Construire le contexte
-            catalog_context = await self.get_catalog_context()
-            gift_cards_context = await self.get_gift_cards_context()
-            discounts_context = await self.get_discounts_context()
-            
-            # Historique conversation
-            history = []
-            if visitor_email:
-                history = await self.get_conversation_history(visitor_email)
+                return self.human_escalation_response()
             
-            # Préparer les messages pour l'IA
-            messages = [
-                {"role": "system", "content": self.system_prompt},
-                {"role": "system", "content": f"CONTEXTE ACTUEL:\n\n{catalog_context}\n{gift_cards_context}\n{discounts_context}"}
-            ]
+            # Questions simples : réponse instantanée depuis le catalogue
+            answer = await self.answer_from_intent(message, tenant_id)
+            if answer is not None:
+                return {**answer, "prompt_tokens": 0}
             
-            # Ajouter historique
-            messages.extend(history[-5:])  # Derniers 5 échanges
+            prompt = await self.build_prompt(message, visitor_email, tenant_id)
+            key = self.answer_key(message, prompt, tenant_id)
             
-            # Message actuel
-            messages.append({"role": "user", "content": message})
+            answer = self.get_cached_answer(key)
+            if answer is not None:
+                return {**answer, "prompt_tokens": prompt.prompt_tokens}
             
-            # Appel à l'IA (OpenAI direct)
+            # Appel à l'IA, partagé avec les requêtes identiques en cours
             try:
-                from openai import OpenAI
-                client = OpenAI(api_key=self.api_key)
-                
-                response = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=messages,
-                    temperature=0.7,
-                    max_tokens=500
-                )
-                
-                ai_response = response.choices[0].message.content
-                
-                # Détecter produits mentionnés pour suggestions
-                suggested_products = await self._extract_product_suggestions(ai_response)
-                
-                return {
-                    "response": ai_response,
-                    "needs_human_escalation": False,
-                    "suggested_products": suggested_products
-                }
+                answer = await self._single_flight.do(key, lambda: self._complete_answer(prompt, key, tenant_id))
+                return {**answer, "prompt_tokens": prompt.prompt_tokens}
                 
             except Exception as e:
-                print(f"OpenAI API error: {e}")
+                print(f"LLM API error: {e}")
                 # Fallback response
-                return {
-                    "response": "Je suis temporairement indisponible. Un coach BoostTribe va vous contacter rapidement !",
-                    "needs_human_escalation": True,
-                    "suggested_products": []
-                }
+                return self.unavailable_response()
             
         except Exception as e:
             print(f"Error generating AI response: {e}")
@@ -210,6 +579,75 @@ Les clients peuvent offrir des cartes cadeaux personnalisées:
                 "suggested_products": []
             }
     
+    async def stream_response(
+        self,
+        message: str,
+        visitor_email: Optional[str] = None,
+        chat_id: Optional[str] = None,
+        tenant_id: Optional[str] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        Génère la réponse IA en streaming.
+        
+        Émet des événements {"type": "token", "content": ...} au fil de la
+        génération, puis un unique {"type": "done", ...} contenant la réponse
+        complète au même format que generate_response.
+        """
+        if self.detect_human_request(message):
+            yield {"type": "done", **self.human_escalation_response()}
+            return
+        
+        answer = await self.answer_from_intent(message, tenant_id)
+        if answer is not None:
+            yield {"type": "token", "content": answer["response"]}
+            yield {"type": "done", **answer, "prompt_tokens": 0}
+            return
+        
+        chunks: List[str] = []
+        prompt = None
+        key = None
+        completed = False
+        try:
+            prompt = await self.build_prompt(message, visitor_email, tenant_id)
+            
+            # Même question récente : la réponse en cache est envoyée d'un bloc
+            key = self.answer_key(message, prompt, tenant_id)
+            answer = self.get_cached_answer(key)
+            if answer is not None:
+                yield {"type": "token", "content": answer["response"]}
+                yield {"type": "done", **answer, "prompt_tokens": prompt.prompt_tokens}
+                return
+            
+            version = self._context_version
+            async for delta in self.llm.stream(
+                get_llm_provider("openai", self.api_key),
+                prompt.messages,
+                model=self.model,
+                endpoint="ad_chat",
+                temperature=0.7,
+                max_tokens=500,
+                tenant_id=tenant_id,
+                priority=PRIORITY_INTERACTIVE
+            ):
+                chunks.append(delta)
+                yield {"type": "token", "content": delta}
+            completed = True
+        except Exception as e:
+            print(f"LLM streaming error: {e}")
+            if not chunks:
+                yield {"type": "done", **self.unavailable_response()}
+                return
+        
+        ai_response = "".join(chunks)
+        answer = {
+            "response": ai_response,
+            "needs_human_escalation": False,
+            "suggested_products": await self._extract_product_suggestions(ai_response)
+        }
+        if completed and self._answer_cache is not None and version == self._context_version:
+            self._answer_cache[key] = answer
+        yield {"type": "done", **answer, "prompt_tokens": prompt.prompt_tokens if prompt else 0}
+    
     async def _extract_product_suggestions(self, ai_response: str) -> List[str]:
         """Extrait les IDs de produits suggérés depuis la réponse IA"""
         # Chercher les liens /p/ dans la réponse
@@ -0,0 +1,112 @@
+"""
+Intent Matcher
+Compiled multi-pattern keyword matching (Aho-Corasick) for chat intents
+"""
+from typing import Dict, List, Tuple
+from dataclasses import dataclass
+from collections import deque
+
+# Patterns up to this length must also end on a word boundary ("où", "wo"),
+# longer ones match as word prefixes ("horaire" matches "horaires")
+SHORT_PATTERN_LENGTH = 4
+
+
+@dataclass
+class IntentMatch:
+    intent: str
+    language: str
+    pattern: str
+    start: int
+
+
+def normalize(text: str) -> str:
+    """Case-fold and unify apostrophes so "Qu’est" and "qu'est" match alike"""
+    return text.casefold().replace("’", "'").replace(" ", " ")
+
+
+class IntentMatcher:
+    def __init__(self, keywords: Dict[str, Dict[str, List[str]]]):
+        """
+        Compile the keyword sets into one automaton
+
+        The message is scanned once whatever the number of keywords, instead
+        of one substring search per keyword.
+
+        Args:
+            keywords: intent -> language -> keywords
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[str, str, str]]] = [[]]
+
+        for intent, languages in keywords.items():
+            for language, patterns in languages.items():
+                for pattern in patterns:
+                    self._add(normalize(pattern), (intent, language, normalize(pattern)))
+        self._build_failure_links()
+
+    def _add(self, pattern: str, output: Tuple[str, str, str]) -> None:
+        state = 0
+        for char in pattern:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._output[state].append(output)
+
+    def _build_failure_links(self) -> None:
+        # Breadth-first; depth-1 states keep the root as failure link
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def match(self, text: str) -> List[IntentMatch]:
+        """
+        Find every keyword occurrence starting on a word boundary
+
+        Args:
+            text: Message to scan
+
+        Returns:
+            Matches in order of appearance
+        """
+        text = normalize(text)
+        matches = []
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for intent, language, pattern in self._output[state]:
+                start = index - len(pattern) + 1
+                if start > 0 and text[start - 1].isalnum():
+                    continue
+                end = index + 1
+                if len(pattern) <= SHORT_PATTERN_LENGTH and end < len(text) and text[end].isalnum():
+                    continue
+                matches.append(IntentMatch(intent, language, pattern, start))
+        return sorted(matches, key=lambda m: m.start)
+
+    def intents(self, text: str) -> Dict[str, str]:
+        """
+        Matched intents with the language of their first keyword
+
+        Args:
+            text: Message to scan
+
+        Returns:
+            intent -> language
+        """
+        found: Dict[str, str] = {}
+        for match in self.match(text):
+            found.setdefault(match.intent, match.language)
+        return found
@@ -0,0 +1,95 @@
+"""
+Job Lease
+Ownership of a long-running job document (campaign send, AI batch job) by
+one process: the owner renews lease_expires_at while it works, and other
+processes or workers only take the job over once the lease has expired
+"""
+from typing import AsyncIterator, Dict, Optional
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone, timedelta
+import asyncio
+import os
+import socket
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Identifies this process among uvicorn workers and replicas
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class JobLease:
+    def __init__(self, collection, ttl_seconds: Optional[float] = None):
+        """
+        Initialize Job Lease
+
+        Args:
+            collection: Collection of the job documents (matched by "id")
+            ttl_seconds: Lease duration without renewal (JOB_LEASE_SECONDS, default 60)
+        """
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds or float(os.environ.get('JOB_LEASE_SECONDS', '60'))
+        self.owner = WORKER_ID
+
+    def _expires_at(self) -> str:
+        return (datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds)).isoformat()
+
+    @staticmethod
+    def expired() -> Dict:
+        """Filter of jobs no process holds (never leased, released or lease expired)"""
+        return {"$or": [
+            {"lease_owner": None},
+            {"lease_expires_at": {"$lt": datetime.now(timezone.utc).isoformat()}}
+        ]}
+
+    async def acquire(self, job_filter: Dict, update: Optional[Dict] = None) -> bool:
+        """
+        Take a job if nobody holds it
+
+        Args:
+            job_filter: Job to take (and its required state)
+            update: Fields set together with the lease (e.g. status)
+
+        Returns:
+            False if the job does not match or another process holds it
+        """
+        result = await self.collection.update_one(
+            {"$and": [job_filter, self.expired()]},
+            {"$set": {**(update or {}), "lease_owner": self.owner, "lease_expires_at": self._expires_at()}}
+        )
+        return result.matched_count == 1
+
+    async def renew(self, job_id: str) -> bool:
+        result = await self.collection.update_one(
+            {"id": job_id, "lease_owner": self.owner},
+            {"$set": {"lease_expires_at": self._expires_at()}}
+        )
+        return result.matched_count == 1
+
+    async def release(self, job_id: str, update: Optional[Dict] = None,
+                      increments: Optional[Dict] = None) -> None:
+        """Give the job up, setting its final fields (status...) and counters at the same time"""
+        changes = {"$set": {**(update or {}), "lease_owner": None, "lease_expires_at": None}}
+        if increments:
+            changes["$inc"] = increments
+        await self.collection.update_one({"id": job_id, "lease_owner": self.owner}, changes)
+
+    @asynccontextmanager
+    async def keep(self, job_id: str) -> AsyncIterator[None]:
+        """Renew the lease in the background while the job runs"""
+        async def heartbeat() -> None:
+            while True:
+                await asyncio.sleep(self.ttl_seconds / 3)
+                try:
+                    if not await self.renew(job_id):
+                        logger.warning(f"Lease on job {job_id} lost by {self.owner}")
+                        return
+                except Exception as e:
+                    logger.error(f"Error renewing lease on job {job_id}: {e}")
+
+        task = asyncio.create_task(heartbeat())
+        try:
+            yield
+        finally:
+            task.cancel()
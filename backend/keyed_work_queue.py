@@ -0,0 +1,185 @@
+"""
+Keyed Work Queue
+Bounded async worker pool that runs jobs with the same key one after the
+other (in submission order) and jobs with different keys in parallel
+"""
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from collections import deque
+import asyncio
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[None]]
+OnDrop = Optional[Callable[[], Awaitable[None]]]
+
+
+class KeyedWorkQueue:
+    def __init__(self, name: str, workers: Optional[int] = None, max_pending: Optional[int] = None):
+        """
+        Initialize Keyed Work Queue
+
+        Args:
+            name: Label used in logs and metrics
+            workers: Jobs running at once across keys (<NAME>_WORKERS)
+            max_pending: Jobs waiting before submit refuses new ones (<NAME>_MAX_PENDING)
+        """
+        prefix = name.upper()
+        self.name = name
+        self.workers = workers or int(os.environ.get(f'{prefix}_WORKERS', '8'))
+        self.max_pending = max_pending or int(os.environ.get(f'{prefix}_MAX_PENDING', '500'))
+        # key -> jobs waiting, in order; a key is in _ready at most once and
+        # never while one of its jobs is running
+        self._jobs: Dict[str, Deque[Tuple[Job, float, OnDrop]]] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._running_keys: set = set()
+        self._tasks: List[asyncio.Task] = []
+        self.pending = 0
+        self.stats = {
+            "submitted": 0,
+            "processed": 0,
+            "errors": 0,
+            "rejected": 0,
+            "total_wait": 0.0,
+            "max_wait": 0.0
+        }
+
+    def _ensure_workers(self) -> None:
+        self._tasks = [task for task in self._tasks if not task.done()]
+        loop = asyncio.get_running_loop()
+        while len(self._tasks) < self.workers:
+            self._tasks.append(loop.create_task(self._worker()))
+
+    def is_full(self) -> bool:
+        return self.pending >= self.max_pending
+
+    def submit(self, key: str, job: Job, force: bool = False, on_drop: OnDrop = None) -> bool:
+        """
+        Queue a job behind the other jobs of its key
+
+        Args:
+            key: Ordering key (e.g. the contact's phone number)
+            job: Coroutine factory
+            force: Queue even when full (follow-up of work already accepted)
+            on_drop: Awaited if the job is dropped or cancelled at shutdown
+                (e.g. to record it for a retry)
+
+        Returns:
+            False if the queue is full (shed the load, e.g. answer 503)
+        """
+        if self.is_full() and not force:
+            self.stats["rejected"] += 1
+            return False
+        self._ensure_workers()
+        jobs = self._jobs.get(key)
+        if jobs is None:
+            jobs = self._jobs[key] = deque()
+            if key not in self._running_keys:
+                self._ready.put_nowait(key)
+        jobs.append((job, time.perf_counter(), on_drop))
+        self.pending += 1
+        self.stats["submitted"] += 1
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            jobs = self._jobs[key]
+            job, enqueued_at, on_drop = jobs.popleft()
+            if not jobs:
+                del self._jobs[key]
+            self.pending -= 1
+            self._running_keys.add(key)
+
+            wait = time.perf_counter() - enqueued_at
+            self.stats["total_wait"] += wait
+            self.stats["max_wait"] = max(self.stats["max_wait"], wait)
+            try:
+                await job()
+            except asyncio.CancelledError:
+                await self._dropped(key, on_drop)
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Error in {self.name} job for {key}: {e}")
+            finally:
+                self.stats["processed"] += 1
+                self._running_keys.discard(key)
+                # Next job of this key goes to the back of the line (fairness across keys)
+                if key in self._jobs:
+                    self._ready.put_nowait(key)
+
+    async def _dropped(self, key: str, on_drop: OnDrop) -> None:
+        if on_drop is None:
+            return
+        try:
+            await on_drop()
+        except Exception as e:
+            logger.error(f"Error dropping {self.name} job for {key}: {e}")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        Let queued jobs finish for up to timeout seconds, then cancel the
+        workers (call at shutdown); on_drop runs for every unfinished job
+        """
+        deadline = time.monotonic() + timeout
+        while (self.pending or self._running_keys) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self.pending or self._running_keys:
+            logger.warning(f"{self.name}: dropping {self.pending} queued job(s) at shutdown")
+        # Running jobs call their on_drop as they are cancelled
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        jobs, self._jobs = self._jobs, {}
+        self._ready = asyncio.Queue()
+        self.pending = 0
+        for key, queued in jobs.items():
+            for _, _, on_drop in queued:
+                await self._dropped(key, on_drop)
+
+    def snapshot(self) -> Dict:
+        """
+        Queue depth and wait-time metrics
+
+        Returns:
+            Dictionary with pending, running, keys and counters
+        """
+        started = self.stats["processed"] + len(self._running_keys)
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "running": len(self._running_keys),
+            "waiting_keys": len(self._jobs),
+            **self.stats,
+            "total_wait": round(self.stats["total_wait"], 4),
+            "max_wait": round(self.stats["max_wait"], 4),
+            "avg_wait": round(self.stats["total_wait"] / started, 4) if started else 0.0
+        }
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition of the queue metrics"""
+        snapshot = self.snapshot()
+        name = self.name
+        return "\n".join([
+            f"# HELP {name}_queue_pending Jobs waiting for a worker",
+            f"# TYPE {name}_queue_pending gauge",
+            f"{name}_queue_pending {snapshot['pending']}",
+            f"# HELP {name}_queue_running Jobs being processed",
+            f"# TYPE {name}_queue_running gauge",
+            f"{name}_queue_running {snapshot['running']}",
+            f"# HELP {name}_queue_jobs_total Jobs by outcome",
+            f"# TYPE {name}_queue_jobs_total counter",
+            f'{name}_queue_jobs_total{{outcome="processed"}} {snapshot["processed"]}',
+            f'{name}_queue_jobs_total{{outcome="error"}} {snapshot["errors"]}',
+            f'{name}_queue_jobs_total{{outcome="rejected"}} {snapshot["rejected"]}',
+            f"# HELP {name}_queue_wait_seconds Time jobs waited before running",
+            f"# TYPE {name}_queue_wait_seconds summary",
+            f"{name}_queue_wait_seconds_sum {snapshot['total_wait']}",
+            f"{name}_queue_wait_seconds_count {self.stats['processed'] + snapshot['running']}",
+        ]) + "\n"
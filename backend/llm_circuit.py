@@ -0,0 +1,157 @@
+"""
+LLM Circuit Breaker
+Per provider/model breaker that fails calls fast while the provider is
+erroring or slow, so callers fall back instead of piling up on timeouts
+"""
+from typing import Deque, Dict, List, Optional, Tuple
+from collections import deque
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class LLMCircuitOpen(Exception):
+    """Raised instead of calling a provider/model whose circuit is open"""
+
+
+class CircuitBreaker:
+    def __init__(self, window: int, min_calls: int, failure_rate: float,
+                 slow_seconds: float, cooldown: float):
+        """
+        Initialize Circuit Breaker
+
+        Args:
+            window: Number of recent calls considered
+            min_calls: Calls needed in the window before the breaker can trip
+            failure_rate: Share of failed or slow calls that opens the circuit
+            slow_seconds: Calls slower than this count as failed
+            cooldown: Seconds the circuit stays open before a probe call is let through
+        """
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.cooldown = cooldown
+        self.state = CLOSED
+        # True for a bad (failed or slow) call
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.stats = {"rejected": 0, "opened": 0}
+
+    def available(self) -> bool:
+        """Whether a call would be let through, without reserving the probe"""
+        if self.state == OPEN:
+            return time.monotonic() - self._opened_at >= self.cooldown
+        if self.state == HALF_OPEN:
+            return not self._probe_in_flight
+        return True
+
+    def allow(self) -> bool:
+        """Admit a call; after the cooldown a single probe call is admitted"""
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == HALF_OPEN:
+            if self._probe_in_flight:
+                self.stats["rejected"] += 1
+                return False
+            self._probe_in_flight = True
+            return True
+        if self.state == OPEN:
+            self.stats["rejected"] += 1
+            return False
+        return True
+
+    def record(self, success: bool, latency: float) -> bool:
+        """
+        Record the outcome of an admitted call
+
+        Returns:
+            True if this call opened the circuit
+        """
+        bad = not success or latency > self.slow_seconds
+        if self.state == HALF_OPEN:
+            self._probe_in_flight = False
+            if bad:
+                self._open()
+                return True
+            self.state = CLOSED
+            self._outcomes.clear()
+            return False
+
+        self._outcomes.append(bad)
+        if (self.state == CLOSED and len(self._outcomes) >= self.min_calls
+                and sum(self._outcomes) / len(self._outcomes) >= self.failure_rate):
+            self._open()
+            return True
+        return False
+
+    def release(self) -> None:
+        """Forget an admitted call that never reached the provider (queue timeout, cancelled)"""
+        if self.state == HALF_OPEN:
+            self._probe_in_flight = False
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self.stats["opened"] += 1
+
+
+class CircuitBreakers:
+    def __init__(self, window: Optional[int] = None, min_calls: Optional[int] = None,
+                 failure_rate: Optional[float] = None, slow_seconds: Optional[float] = None,
+                 cooldown: Optional[float] = None):
+        """
+        Initialize the breaker registry (one breaker per provider and model)
+
+        Args:
+            window: Recent calls considered (LLM_CIRCUIT_WINDOW)
+            min_calls: Calls needed before tripping (LLM_CIRCUIT_MIN_CALLS)
+            failure_rate: Bad call share that trips (LLM_CIRCUIT_FAILURE_RATE)
+            slow_seconds: Latency counted as a failure (LLM_CIRCUIT_SLOW_SECONDS)
+            cooldown: Seconds open before probing (LLM_CIRCUIT_COOLDOWN)
+        """
+        self.window = window or int(os.environ.get('LLM_CIRCUIT_WINDOW', '20'))
+        self.min_calls = min_calls or int(os.environ.get('LLM_CIRCUIT_MIN_CALLS', '5'))
+        self.failure_rate = failure_rate or float(os.environ.get('LLM_CIRCUIT_FAILURE_RATE', '0.5'))
+        self.slow_seconds = slow_seconds or float(os.environ.get('LLM_CIRCUIT_SLOW_SECONDS', '20'))
+        self.cooldown = cooldown or float(os.environ.get('LLM_CIRCUIT_COOLDOWN', '30'))
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+    def get(self, provider: str, model: str) -> CircuitBreaker:
+        key = (provider, model)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(
+                self.window, self.min_calls, self.failure_rate, self.slow_seconds, self.cooldown
+            )
+        return breaker
+
+    def snapshot(self) -> List[Dict]:
+        """
+        State of every breaker
+
+        Returns:
+            List of dictionaries with provider, model, state and counters
+        """
+        return [
+            {
+                "provider": provider,
+                "model": model,
+                "state": breaker.state,
+                "recent_calls": len(breaker._outcomes),
+                "recent_bad": sum(breaker._outcomes),
+                **breaker.stats
+            }
+            for (provider, model), breaker in self._breakers.items()
+        ]
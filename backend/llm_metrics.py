@@ -0,0 +1,326 @@
+"""
+LLM Metrics
+Per-call telemetry for every LLM call: in-memory counters and histograms
+(Prometheus exposition) and per-tenant daily usage persisted to MongoDB
+"""
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+import asyncio
+import os
+import logging
+
+from pymongo import UpdateOne
+
+from llm_circuit import STATE_VALUES
+
+logger = logging.getLogger(__name__)
+
+# USD per 1M tokens (prompt, completion), used for the cost estimate
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4": (30.00, 60.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+# Histogram buckets (seconds) for total latency and time to first token
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+OUTCOMES = ("ok", "error", "queue_timeout", "cancelled", "circuit_open")
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimated USD cost of a call, 0 for models without a known price"""
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+
+def _labels(**labels) -> str:
+    body = ",".join(f'{name}="{str(value).replace(chr(34), "")}"' for name, value in labels.items())
+    return "{" + body + "}"
+
+
+class LLMMetrics:
+    def __init__(self, db=None, flush_interval: Optional[float] = None):
+        """
+        Initialize LLM Metrics
+
+        Args:
+            db: MongoDB database instance, usage is only kept in memory without it
+            flush_interval: Seconds between usage flushes (LLM_USAGE_FLUSH_SECONDS)
+        """
+        self.db = db
+        self.flush_interval = flush_interval or float(os.environ.get('LLM_USAGE_FLUSH_SECONDS', '10'))
+        # (endpoint, provider, model) -> counters
+        self.calls: Dict[Tuple[str, str, str], Dict] = {}
+        self.latency: Dict[Tuple[str, str, str], _Histogram] = {}
+        self.ttft: Dict[Tuple[str, str, str], _Histogram] = {}
+        # (tenant_id, day, endpoint, model) -> usage increments not yet persisted
+        self._usage_pending: Dict[Tuple[str, str, str, str], Dict] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    def record(self, endpoint: str, provider: str, model: str, latency: float,
+               prompt_tokens: int = 0, completion_tokens: int = 0, ttft: Optional[float] = None,
+               outcome: str = "ok", error: Optional[str] = None, tenant_id: Optional[str] = None) -> None:
+        """
+        Record one LLM call
+
+        Args:
+            endpoint: Call site label (ai_generate, ad_chat, ...)
+            provider: Provider name
+            model: Model name
+            latency: Total call duration in seconds, queue time excluded
+            prompt_tokens: Prompt tokens reported or estimated
+            completion_tokens: Completion tokens reported or estimated
+            ttft: Time to first token in seconds (streamed calls)
+            outcome: ok, error, queue_timeout, cancelled or circuit_open
+            error: Exception name for failed calls
+            tenant_id: Coach user id, None for public traffic
+        """
+        key = (endpoint, provider, model)
+        # Stub calls use real model names but cost nothing
+        cost = 0.0 if provider == "stub" else estimate_cost(model, prompt_tokens, completion_tokens)
+        stats = self.calls.setdefault(key, {
+            "calls": 0,
+            "errors": 0,
+            "outcomes": {name: 0 for name in OUTCOMES},
+            "total_latency": 0.0,
+            "max_latency": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cost_usd": 0.0,
+            "last_error": None
+        })
+        stats["calls"] += 1
+        stats["outcomes"][outcome] = stats["outcomes"].get(outcome, 0) + 1
+        stats["total_latency"] += latency
+        stats["max_latency"] = max(stats["max_latency"], latency)
+        stats["prompt_tokens"] += prompt_tokens
+        stats["completion_tokens"] += completion_tokens
+        stats["cost_usd"] += cost
+        if outcome != "ok":
+            stats["errors"] += 1
+            stats["last_error"] = error or outcome
+
+        if outcome not in ("queue_timeout", "circuit_open"):
+            self.latency.setdefault(key, _Histogram()).observe(latency)
+        if ttft is not None:
+            self.ttft.setdefault(key, _Histogram()).observe(ttft)
+
+        self._add_usage(tenant_id, endpoint, model, latency, prompt_tokens, completion_tokens, cost, outcome)
+
+    def _add_usage(self, tenant_id: Optional[str], endpoint: str, model: str, latency: float,
+                   prompt_tokens: int, completion_tokens: int, cost: float, outcome: str) -> None:
+        """Aggregate the call into the per-tenant daily usage buffer"""
+        if self.db is None:
+            return
+        day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        usage = self._usage_pending.setdefault((tenant_id or "public", day, endpoint, model), {
+            "calls": 0,
+            "errors": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_latency": 0.0,
+            "cost_usd": 0.0
+        })
+        usage["calls"] += 1
+        usage["errors"] += 0 if outcome == "ok" else 1
+        usage["prompt_tokens"] += prompt_tokens
+        usage["completion_tokens"] += completion_tokens
+        usage["total_latency"] += latency
+        usage["cost_usd"] += cost
+        self._ensure_flusher()
+
+    def _ensure_flusher(self) -> None:
+        """Start the background flush loop if it is not running"""
+        if self._flush_task is None or self._flush_task.done():
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+            except RuntimeError:
+                pass  # No running loop, flushed on the next call or at shutdown
+
+    async def _flush_loop(self) -> None:
+        """Flush usage every flush_interval until nothing is pending"""
+        while self._usage_pending:
+            await asyncio.sleep(self.flush_interval)
+            # Shielded so that stopping the loop never abandons a write half-way
+            await asyncio.shield(self.flush())
+
+    async def flush(self) -> None:
+        """
+        Persist buffered usage: one $inc upsert per (tenant, day, endpoint, model)
+        """
+        async with self._flush_lock:
+            if not self._usage_pending or self.db is None:
+                return
+            pending, self._usage_pending = self._usage_pending, {}
+            now = datetime.now(timezone.utc).isoformat()
+            operations = [
+                UpdateOne(
+                    {"tenant_id": tenant_id, "day": day, "endpoint": endpoint, "model": model},
+                    {"$inc": usage, "$set": {"updated_at": now}},
+                    upsert=True
+                )
+                for (tenant_id, day, endpoint, model), usage in pending.items()
+            ]
+            try:
+                await self.db.llm_usage.bulk_write(operations, ordered=False)
+            except Exception as e:
+                logger.error(f"Error persisting LLM usage: {e}")
+                # Merge back so increments are not lost
+                for key, usage in pending.items():
+                    current = self._usage_pending.setdefault(key, {name: 0 for name in usage})
+                    for name, value in usage.items():
+                        current[name] += value
+
+    async def stop(self) -> None:
+        """Stop the flush loop and persist everything still buffered (call at shutdown)"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        self._flush_task = None
+        await self.flush()
+
+    async def ensure_indexes(self) -> None:
+        """Unique index of the usage aggregation"""
+        if self.db is not None:
+            await self.db.llm_usage.create_index(
+                [("tenant_id", 1), ("day", 1), ("endpoint", 1), ("model", 1)],
+                unique=True
+            )
+
+    def latency_quantile(self, endpoint: str, provider: str, model: str, quantile: float,
+                         min_count: int = 20) -> Optional[float]:
+        """
+        Latency quantile estimated from the histogram (bucket upper bound)
+
+        Returns:
+            Seconds, None with fewer than min_count calls or beyond the last bucket
+        """
+        histogram = self.latency.get((endpoint, provider, model))
+        if histogram is None or histogram.count < min_count:
+            return None
+        for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+            if count >= quantile * histogram.count:
+                return bound
+        return None
+
+    def snapshot(self) -> List[Dict]:
+        """
+        Per (endpoint, provider, model) counters since startup
+
+        Returns:
+            List of dictionaries with calls, outcomes, latency, tokens and cost
+        """
+        result = []
+        for (endpoint, provider, model), stats in self.calls.items():
+            latency = self.latency.get((endpoint, provider, model))
+            ttft = self.ttft.get((endpoint, provider, model))
+            result.append({
+                "endpoint": endpoint,
+                "provider": provider,
+                "model": model,
+                **stats,
+                "cost_usd": round(stats["cost_usd"], 6),
+                "avg_latency": round(latency.total / latency.count, 4) if latency and latency.count else 0.0,
+                "avg_ttft": round(ttft.total / ttft.count, 4) if ttft and ttft.count else None
+            })
+        return result
+
+    def render_prometheus(self, scheduler: Optional[Dict] = None, circuits: Optional[List[Dict]] = None) -> str:
+        """
+        Prometheus text exposition of the LLM metrics
+
+        Args:
+            scheduler: LLMScheduler.snapshot() to expose queue gauges as well
+            circuits: CircuitBreakers.snapshot() to expose breaker states
+
+        Returns:
+            Metrics in the text format (version 0.0.4)
+        """
+        lines = [
+            "# HELP llm_calls_total LLM calls by outcome",
+            "# TYPE llm_calls_total counter"
+        ]
+        for (endpoint, provider, model), stats in self.calls.items():
+            for outcome, count in stats["outcomes"].items():
+                labels = _labels(endpoint=endpoint, provider=provider, model=model, outcome=outcome)
+                lines.append(f"llm_calls_total{labels} {count}")
+
+        lines += ["# HELP llm_tokens_total LLM tokens", "# TYPE llm_tokens_total counter"]
+        for (endpoint, provider, model), stats in self.calls.items():
+            for kind in ("prompt", "completion"):
+                labels = _labels(endpoint=endpoint, provider=provider, model=model, type=kind)
+                lines.append(f"llm_tokens_total{labels} {stats[f'{kind}_tokens']}")
+
+        lines += ["# HELP llm_cost_usd_total Estimated LLM cost", "# TYPE llm_cost_usd_total counter"]
+        for (endpoint, provider, model), stats in self.calls.items():
+            labels = _labels(endpoint=endpoint, provider=provider, model=model)
+            lines.append(f"llm_cost_usd_total{labels} {stats['cost_usd']:.6f}")
+
+        for name, help_text, histograms in (
+            ("llm_latency_seconds", "LLM call duration", self.latency),
+            ("llm_ttft_seconds", "LLM time to first token", self.ttft)
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for (endpoint, provider, model), histogram in histograms.items():
+                base = _labels(endpoint=endpoint, provider=provider, model=model)[1:-1]
+                for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                    lines.append(f'{name}_bucket{{{base},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{base},le="+Inf"}} {histogram.count}')
+                lines.append(f"{name}_sum{{{base}}} {histogram.total:.6f}")
+                lines.append(f"{name}_count{{{base}}} {histogram.count}")
+
+        if scheduler:
+            lines += [
+                "# HELP llm_scheduler_active LLM calls holding a slot",
+                "# TYPE llm_scheduler_active gauge",
+                f"llm_scheduler_active {scheduler['active']}",
+                "# HELP llm_scheduler_queued LLM calls waiting for a slot",
+                "# TYPE llm_scheduler_queued gauge"
+            ]
+            for priority, count in scheduler["queued"].items():
+                lines.append(f'llm_scheduler_queued{{priority="{priority}"}} {count}')
+            lines += [
+                "# HELP llm_scheduler_queue_timeouts_total LLM calls rejected after waiting too long",
+                "# TYPE llm_scheduler_queue_timeouts_total counter"
+            ]
+            for priority, stats in scheduler["classes"].items():
+                lines.append(f'llm_scheduler_queue_timeouts_total{{priority="{priority}"}} {stats["timeouts"]}')
+
+        if circuits:
+            lines += [
+                "# HELP llm_circuit_state LLM circuit breaker state (0 closed, 1 half open, 2 open)",
+                "# TYPE llm_circuit_state gauge"
+            ]
+            for circuit in circuits:
+                labels = _labels(provider=circuit["provider"], model=circuit["model"])
+                lines.append(f"llm_circuit_state{labels} {STATE_VALUES[circuit['state']]}")
+            lines += [
+                "# HELP llm_circuit_rejected_total LLM calls failed fast by an open circuit",
+                "# TYPE llm_circuit_rejected_total counter"
+            ]
+            for circuit in circuits:
+                labels = _labels(provider=circuit["provider"], model=circuit["model"])
+                lines.append(f"llm_circuit_rejected_total{labels} {circuit['rejected']}")
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,472 @@
+"""
+LLM Provider Layer
+Single interface for every AI completion (OpenAI, Emergent, local stub)
+with per-call latency, token and error accounting
+"""
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from dataclasses import dataclass
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+import logging
+
+from prompt_builder import count_tokens
+from llm_scheduler import LLMScheduler, LLMQueueTimeout, PRIORITY_INTERACTIVE
+from llm_metrics import LLMMetrics
+from llm_circuit import CircuitBreakers, LLMCircuitOpen
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LLMUsage:
+    prompt_tokens: int
+    completion_tokens: int
+
+
+@dataclass
+class LLMResult:
+    content: str
+    provider: str
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    latency: float
+    ttft: Optional[float] = None
+
+
+def estimate_usage(messages: List[Dict], completion: str) -> LLMUsage:
+    """Count tokens locally when the provider does not report usage"""
+    return LLMUsage(
+        prompt_tokens=sum(count_tokens(m["content"]) for m in messages),
+        completion_tokens=count_tokens(completion)
+    )
+
+
+class LLMProvider:
+    """Base class for LLM providers"""
+    name = "base"
+
+    async def complete(self, messages: List[Dict], model: str, temperature: float = 0.7,
+                       max_tokens: Optional[int] = None, session_id: Optional[str] = None) -> Tuple[str, LLMUsage]:
+        """
+        Run a chat completion
+
+        Args:
+            messages: Chat messages (role, content)
+            model: Model name
+            temperature: Sampling temperature
+            max_tokens: Completion token limit
+            session_id: Conversation id for providers that keep history server-side
+
+        Returns:
+            Completion text and token usage
+        """
+        raise NotImplementedError
+
+    async def stream(self, messages: List[Dict], model: str, temperature: float = 0.7,
+                     max_tokens: Optional[int] = None,
+                     session_id: Optional[str] = None) -> AsyncIterator[Union[str, LLMUsage]]:
+        """
+        Stream a chat completion
+
+        Yields text deltas, then optionally one LLMUsage. Providers without
+        native streaming yield the whole completion at once.
+        """
+        content, usage = await self.complete(messages, model, temperature, max_tokens, session_id)
+        yield content
+        yield usage
+
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    def __init__(self, api_key: str):
+        from openai import AsyncOpenAI
+        self.client = AsyncOpenAI(api_key=api_key)
+
+    async def complete(self, messages, model, temperature=0.7, max_tokens=None, session_id=None):
+        kwargs = {"model": model, "messages": messages, "temperature": temperature}
+        if max_tokens:
+            kwargs["max_tokens"] = max_tokens
+        response = await self.client.chat.completions.create(**kwargs)
+        content = response.choices[0].message.content or ""
+        if response.usage:
+            usage = LLMUsage(response.usage.prompt_tokens, response.usage.completion_tokens)
+        else:
+            usage = estimate_usage(messages, content)
+        return content, usage
+
+    async def stream(self, messages, model, temperature=0.7, max_tokens=None, session_id=None):
+        kwargs = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
+        if max_tokens:
+            kwargs["max_tokens"] = max_tokens
+        stream = await self.client.chat.completions.create(**kwargs)
+        async for chunk in stream:
+            if chunk.usage:
+                yield LLMUsage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+
+class EmergentProvider(LLMProvider):
+    """emergentintegrations LlmChat; keeps the conversation per session_id itself"""
+    name = "emergent"
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+
+    async def complete(self, messages, model, temperature=0.7, max_tokens=None, session_id=None):
+        from emergentintegrations.llm.chat import LlmChat, UserMessage
+
+        system_message = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+        chat = LlmChat(
+            api_key=self.api_key,
+            session_id=session_id or str(uuid.uuid4()),
+            system_message=system_message
+        ).with_model("openai", model)
+
+        content = await chat.send_message(UserMessage(text=messages[-1]["content"]))
+        return content, estimate_usage(messages, content)
+
+
+STUB_VOCABULARY = [
+    "Afroboost", "cours", "danse", "fitness", "énergie", "séance", "coach", "réservez",
+    "votre", "place", "dès", "maintenant", "offre", "spéciale", "cette", "semaine",
+    "rejoignez", "la", "tribu", "motivation", "rythme", "ensemble", "progresser", "bienvenue"
+]
+
+
+class StubProvider(LLMProvider):
+    """
+    Deterministic local provider for offline load tests
+
+    The same messages always produce the same completion. Latency is
+    simulated as a time to first token followed by a constant token rate.
+    """
+    name = "stub"
+
+    def __init__(self, ttft_ms: float = 300, tokens_per_second: float = 50,
+                 completion_tokens: int = 60, error_rate: float = 0.0):
+        self.ttft = ttft_ms / 1000
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+
+    def _words(self, messages: List[Dict], max_tokens: Optional[int]) -> List[str]:
+        digest = hashlib.sha256("".join(m["content"] for m in messages).encode("utf-8")).digest()
+        count = min(self.completion_tokens, max_tokens or self.completion_tokens)
+        return [STUB_VOCABULARY[digest[i % len(digest)] % len(STUB_VOCABULARY)] for i in range(count)]
+
+    def _maybe_fail(self, messages: List[Dict]) -> None:
+        if self.error_rate <= 0:
+            return
+        digest = hashlib.sha256(messages[-1]["content"].encode("utf-8")).digest()
+        if digest[0] / 255 < self.error_rate:
+            raise RuntimeError("Stub provider simulated error")
+
+    async def complete(self, messages, model, temperature=0.7, max_tokens=None, session_id=None):
+        words = self._words(messages, max_tokens)
+        await asyncio.sleep(self.ttft + len(words) / self.tokens_per_second)
+        self._maybe_fail(messages)
+        content = " ".join(words)
+        return content, estimate_usage(messages, content)
+
+    async def stream(self, messages, model, temperature=0.7, max_tokens=None, session_id=None):
+        words = self._words(messages, max_tokens)
+        await asyncio.sleep(self.ttft)
+        self._maybe_fail(messages)
+        for index, word in enumerate(words):
+            yield word if index == 0 else f" {word}"
+            await asyncio.sleep(1 / self.tokens_per_second)
+        yield estimate_usage(messages, " ".join(words))
+
+
+_providers: Dict[Tuple[str, str], LLMProvider] = {}
+
+
+def llm_stub_enabled() -> bool:
+    """True when LLM_PROVIDER=stub routes every call to the local stub"""
+    return os.environ.get('LLM_PROVIDER', '').lower() == "stub"
+
+
+def get_llm_provider(name: str, api_key: str = "") -> LLMProvider:
+    """
+    Get a (cached) provider instance
+
+    Args:
+        name: openai or emergent
+        api_key: Provider API key
+
+    Returns:
+        The provider, or the stub provider when LLM_PROVIDER=stub
+    """
+    if llm_stub_enabled():
+        name, api_key = "stub", ""
+
+    key = (name, api_key)
+    if key not in _providers:
+        if name == "stub":
+            _providers[key] = StubProvider(
+                ttft_ms=float(os.environ.get('LLM_STUB_TTFT_MS', '300')),
+                tokens_per_second=float(os.environ.get('LLM_STUB_TOKENS_PER_SECOND', '50')),
+                completion_tokens=int(os.environ.get('LLM_STUB_COMPLETION_TOKENS', '60')),
+                error_rate=float(os.environ.get('LLM_STUB_ERROR_RATE', '0'))
+            )
+        elif name == "openai":
+            _providers[key] = OpenAIProvider(api_key)
+        elif name == "emergent":
+            _providers[key] = EmergentProvider(api_key)
+        else:
+            raise ValueError(f"Unknown LLM provider: {name}")
+    return _providers[key]
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent calls
+
+    The first caller for a key runs the call; callers arriving while it is
+    in flight await the same result instead of starting their own. The call
+    runs as its own task, so a caller that disconnects does not cancel it
+    for the others.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.stats = {"calls": 0, "coalesced": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run fn once per key among concurrent callers
+
+        Args:
+            key: Identity of the call
+            fn: Coroutine factory, only invoked by the first caller
+
+        Returns:
+            The shared result (exceptions are shared as well)
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self.stats["calls"] += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+class LLMClient:
+    """Entry point used by every AI call site"""
+
+    def __init__(self, scheduler: Optional[LLMScheduler] = None, metrics: Optional[LLMMetrics] = None,
+                 breakers: Optional[CircuitBreakers] = None, call_timeout: Optional[float] = None,
+                 hedge_delay: Optional[float] = None):
+        """
+        Initialize LLM Client
+
+        Args:
+            scheduler: Admission control shared by every call
+            metrics: Call telemetry, also the source of the hedge delay (p95)
+            breakers: Per provider/model circuit breakers
+            call_timeout: Seconds before a completion is abandoned (LLM_CALL_TIMEOUT)
+            hedge_delay: Hedge delay until enough latencies are known (LLM_HEDGE_DELAY)
+        """
+        self.scheduler = scheduler or LLMScheduler()
+        self.metrics = metrics or LLMMetrics()
+        self.breakers = breakers or CircuitBreakers()
+        self.call_timeout = call_timeout or float(os.environ.get('LLM_CALL_TIMEOUT', '60'))
+        self.hedge_delay = hedge_delay or float(os.environ.get('LLM_HEDGE_DELAY', '8'))
+        self.hedge_stats = {"hedged": 0, "hedge_won": 0}
+
+    async def complete(self, provider: LLMProvider, messages: List[Dict], model: str,
+                       endpoint: str = "default", temperature: float = 0.7,
+                       max_tokens: Optional[int] = None, session_id: Optional[str] = None,
+                       tenant_id: Optional[str] = None, priority: int = PRIORITY_INTERACTIVE,
+                       hedge_model: Optional[str] = None) -> LLMResult:
+        """
+        Run a completion through a provider and record latency, tokens and outcome
+
+        Args:
+            provider: Provider from get_llm_provider
+            messages: Chat messages
+            model: Model name
+            endpoint: Call site label used for accounting
+            tenant_id: Coach user id for the per-tenant cap, None for public traffic
+            priority: Scheduler priority class (PRIORITY_* in llm_scheduler)
+            hedge_model: Cheaper model asked in parallel once the call is slower
+                than its usual p95, or right away if the call fails or its circuit
+                is open; the first answer wins (ignored for session-based calls)
+
+        Raises:
+            LLMCircuitOpen: The model's circuit is open (and no hedge answered)
+            LLMQueueTimeout: No scheduler slot within the queue timeout
+        """
+        call = (provider, messages, endpoint, temperature, max_tokens, session_id, tenant_id, priority)
+        if hedge_model and hedge_model != model and not session_id:
+            return await self._hedged(call, model, hedge_model)
+        return await self._guarded(call, model)
+
+    async def _guarded(self, call: Tuple, model: str) -> LLMResult:
+        """One completion behind the circuit breaker and the scheduler"""
+        provider, messages, endpoint, temperature, max_tokens, session_id, tenant_id, priority = call
+        breaker = self.breakers.get(provider.name, model)
+        if not breaker.allow():
+            self.metrics.record(endpoint, provider.name, model, 0.0, outcome="circuit_open", tenant_id=tenant_id)
+            raise LLMCircuitOpen(f"Circuit open for {provider.name}/{model}")
+        try:
+            async with self.scheduler.slot(tenant_id, priority):
+                return await self._complete(provider, messages, model, endpoint, temperature,
+                                            max_tokens, session_id, tenant_id)
+        except LLMQueueTimeout:
+            breaker.release()
+            self.metrics.record(endpoint, provider.name, model, 0.0, outcome="queue_timeout", tenant_id=tenant_id)
+            raise
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+
+    async def _hedged(self, call: Tuple, model: str, hedge_model: str) -> LLMResult:
+        """Primary call, plus a hedge call if the primary is slow or fails; first success wins"""
+        provider, endpoint = call[0], call[2]
+        primary = asyncio.ensure_future(self._guarded(call, model))
+        tasks = {primary}
+        try:
+            delay = self.metrics.latency_quantile(endpoint, provider.name, model, 0.95) or self.hedge_delay
+            await asyncio.wait(tasks, timeout=delay)
+            if primary.done() and primary.exception() is None:
+                return primary.result()
+
+            self.hedge_stats["hedged"] += 1
+            logger.info(f"Hedging {endpoint} {provider.name}/{model} with {hedge_model}")
+            hedge = asyncio.ensure_future(self._guarded(call, hedge_model))
+            tasks = {hedge} if primary.done() else {primary, hedge}
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_stats["hedge_won"] += 1
+                        return task.result()
+            # Both failed: report the primary's error
+            raise primary.exception()
+        finally:
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _complete(self, provider: LLMProvider, messages: List[Dict], model: str, endpoint: str,
+                        temperature: float, max_tokens: Optional[int], session_id: Optional[str],
+                        tenant_id: Optional[str]) -> LLMResult:
+        breaker = self.breakers.get(provider.name, model)
+        start = time.perf_counter()
+        try:
+            content, usage = await asyncio.wait_for(
+                provider.complete(messages, model, temperature, max_tokens, session_id),
+                timeout=self.call_timeout
+            )
+        except asyncio.CancelledError:
+            self.metrics.record(endpoint, provider.name, model, time.perf_counter() - start,
+                                outcome="cancelled", tenant_id=tenant_id)
+            raise
+        except Exception as e:
+            latency = time.perf_counter() - start
+            if breaker.record(False, latency):
+                logger.warning(f"LLM circuit opened for {provider.name}/{model} after {type(e).__name__}")
+            self.metrics.record(endpoint, provider.name, model, latency,
+                                outcome="error", error=type(e).__name__, tenant_id=tenant_id)
+            raise
+
+        latency = time.perf_counter() - start
+        if breaker.record(True, latency):
+            logger.warning(f"LLM circuit opened for {provider.name}/{model}: calls slower than {breaker.slow_seconds}s")
+        self.metrics.record(endpoint, provider.name, model, latency, usage.prompt_tokens,
+                            usage.completion_tokens, tenant_id=tenant_id)
+        return LLMResult(
+            content=content,
+            provider=provider.name,
+            model=model,
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+            latency=latency
+        )
+
+    async def stream(self, provider: LLMProvider, messages: List[Dict], model: str,
+                     endpoint: str = "default", temperature: float = 0.7,
+                     max_tokens: Optional[int] = None, session_id: Optional[str] = None,
+                     tenant_id: Optional[str] = None, priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[str]:
+        """
+        Stream a completion as text deltas, recording the call once it ends
+
+        The scheduler slot is held until the stream ends or is closed. The
+        circuit breaker judges streams on their time to first token.
+        """
+        breaker = self.breakers.get(provider.name, model)
+        if not breaker.allow():
+            self.metrics.record(endpoint, provider.name, model, 0.0, outcome="circuit_open", tenant_id=tenant_id)
+            raise LLMCircuitOpen(f"Circuit open for {provider.name}/{model}")
+        try:
+            async with self.scheduler.slot(tenant_id, priority):
+                async for delta in self._stream(provider, messages, model, endpoint, temperature,
+                                                max_tokens, session_id, tenant_id):
+                    yield delta
+        except LLMQueueTimeout:
+            breaker.release()
+            self.metrics.record(endpoint, provider.name, model, 0.0, outcome="queue_timeout", tenant_id=tenant_id)
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            breaker.release()
+            raise
+
+    async def _stream(self, provider: LLMProvider, messages: List[Dict], model: str, endpoint: str,
+                      temperature: float, max_tokens: Optional[int], session_id: Optional[str],
+                      tenant_id: Optional[str]) -> AsyncIterator[str]:
+        breaker = self.breakers.get(provider.name, model)
+        start = time.perf_counter()
+        ttft = None
+        chunks: List[str] = []
+        usage = None
+        try:
+            async for item in provider.stream(messages, model, temperature, max_tokens, session_id):
+                if isinstance(item, LLMUsage):
+                    usage = item
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                chunks.append(item)
+                yield item
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client went away mid-stream
+            usage = estimate_usage(messages, "".join(chunks))
+            self.metrics.record(endpoint, provider.name, model, time.perf_counter() - start,
+                                usage.prompt_tokens, usage.completion_tokens, ttft,
+                                outcome="cancelled", tenant_id=tenant_id)
+            raise
+        except Exception as e:
+            latency = time.perf_counter() - start
+            breaker.record(False, ttft if ttft is not None else latency)
+            self.metrics.record(endpoint, provider.name, model, latency, ttft=ttft,
+                                outcome="error", error=type(e).__name__, tenant_id=tenant_id)
+            raise
+
+        breaker.record(True, ttft if ttft is not None else time.perf_counter() - start)
+        usage = usage or estimate_usage(messages, "".join(chunks))
+        self.metrics.record(endpoint, provider.name, model, time.perf_counter() - start,
+                            usage.prompt_tokens, usage.completion_tokens, ttft, tenant_id=tenant_id)
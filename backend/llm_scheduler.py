@@ -0,0 +1,195 @@
+"""
+LLM Scheduler
+Admission control for LLM calls: global and per-tenant concurrency caps
+with priority classes and queue-time metrics
+"""
+from typing import Dict, List, Optional
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+import asyncio
+import heapq
+import itertools
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, lower is served first
+PRIORITY_INTERACTIVE = 0  # Visitors and coaches waiting on screen (ad chat, assistant)
+PRIORITY_WHATSAPP = 1     # WhatsApp auto-replies
+PRIORITY_BATCH = 2        # Content generation (/ai/generate)
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_WHATSAPP: "whatsapp",
+    PRIORITY_BATCH: "batch"
+}
+
+
+class LLMQueueTimeout(asyncio.TimeoutError):
+    """Raised when a call waited longer than the queue timeout for a slot"""
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    tenant_id: Optional[str] = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False)
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: Optional[int] = None, tenant_concurrency: Optional[int] = None,
+                 batch_concurrency: Optional[int] = None, queue_timeout: Optional[float] = None):
+        """
+        Initialize LLM Scheduler
+
+        A call runs when a global slot is free, its tenant is under its cap and
+        its class is under its cap. Waiting calls are served by priority then
+        arrival; a waiter blocked by its tenant cap does not hold back others.
+        Calls without tenant (public ad chat) only count against the global cap.
+
+        Args:
+            max_concurrency: Concurrent LLM calls overall (LLM_MAX_CONCURRENCY)
+            tenant_concurrency: Concurrent calls per tenant (LLM_TENANT_CONCURRENCY)
+            batch_concurrency: Concurrent batch calls, keeps slots for interactive
+                traffic (LLM_BATCH_CONCURRENCY, half the global cap by default)
+            queue_timeout: Seconds a call may wait for a slot (LLM_QUEUE_TIMEOUT)
+        """
+        self.max_concurrency = max_concurrency or int(os.environ.get('LLM_MAX_CONCURRENCY', '16'))
+        self.tenant_concurrency = tenant_concurrency or int(os.environ.get('LLM_TENANT_CONCURRENCY', '4'))
+        self.batch_concurrency = batch_concurrency or int(
+            os.environ.get('LLM_BATCH_CONCURRENCY', str(max(1, self.max_concurrency // 2)))
+        )
+        self.queue_timeout = queue_timeout or float(os.environ.get('LLM_QUEUE_TIMEOUT', '60'))
+
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self.active = 0
+        self._active_by_tenant: Dict[str, int] = {}
+        self._active_by_priority: Dict[int, int] = {}
+        self.stats = {
+            priority: {"granted": 0, "timeouts": 0, "total_wait": 0.0, "max_wait": 0.0}
+            for priority in PRIORITY_NAMES
+        }
+
+    def _can_run(self, tenant_id: Optional[str], priority: int) -> bool:
+        if self.active >= self.max_concurrency:
+            return False
+        if tenant_id is not None and self._active_by_tenant.get(tenant_id, 0) >= self.tenant_concurrency:
+            return False
+        if priority >= PRIORITY_BATCH and self._active_by_priority.get(priority, 0) >= self.batch_concurrency:
+            return False
+        return True
+
+    def _take(self, tenant_id: Optional[str], priority: int) -> None:
+        self.active += 1
+        self._active_by_priority[priority] = self._active_by_priority.get(priority, 0) + 1
+        if tenant_id is not None:
+            self._active_by_tenant[tenant_id] = self._active_by_tenant.get(tenant_id, 0) + 1
+
+    def _release(self, tenant_id: Optional[str], priority: int) -> None:
+        self.active -= 1
+        self._active_by_priority[priority] -= 1
+        if tenant_id is not None:
+            self._active_by_tenant[tenant_id] -= 1
+            if not self._active_by_tenant[tenant_id]:
+                del self._active_by_tenant[tenant_id]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Grant free slots to the best eligible waiters"""
+        skipped: List[_Waiter] = []
+        while self._queue and self.active < self.max_concurrency:
+            waiter = heapq.heappop(self._queue)
+            if waiter.future.done():
+                continue  # Cancelled or timed out while queued
+            if not self._can_run(waiter.tenant_id, waiter.priority):
+                skipped.append(waiter)
+                continue
+            self._take(waiter.tenant_id, waiter.priority)
+            waiter.future.set_result(None)
+        for waiter in skipped:
+            heapq.heappush(self._queue, waiter)
+
+    def _record_wait(self, priority: int, waited: float) -> None:
+        stats = self.stats[priority]
+        stats["granted"] += 1
+        stats["total_wait"] += waited
+        stats["max_wait"] = max(stats["max_wait"], waited)
+
+    @asynccontextmanager
+    async def slot(self, tenant_id: Optional[str] = None, priority: int = PRIORITY_INTERACTIVE):
+        """
+        Hold an LLM slot for the duration of the block
+
+        Args:
+            tenant_id: Coach user id, None for public traffic
+            priority: One of the PRIORITY_* classes
+
+        Raises:
+            LLMQueueTimeout: No slot became free within the queue timeout
+        """
+        start = time.perf_counter()
+        if not self._queue and self._can_run(tenant_id, priority):
+            self._take(tenant_id, priority)
+        else:
+            waiter = _Waiter(priority, next(self._seq), tenant_id,
+                             asyncio.get_running_loop().create_future(), start)
+            heapq.heappush(self._queue, waiter)
+            self._dispatch()
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    # Granted right as the wait ended: hand the slot back
+                    self._release(tenant_id, priority)
+                else:
+                    waiter.future.cancel()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self.stats[priority]["timeouts"] += 1
+                logger.warning(f"LLM queue timeout ({PRIORITY_NAMES[priority]}, tenant {tenant_id})")
+                raise LLMQueueTimeout(f"No LLM slot available after {self.queue_timeout}s")
+
+        self._record_wait(priority, time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            self._release(tenant_id, priority)
+
+    def snapshot(self) -> Dict:
+        """
+        Current load and queue-time metrics
+
+        Returns:
+            Dictionary with active/queued counts and per-class wait statistics
+        """
+        queued: Dict[str, int] = {name: 0 for name in PRIORITY_NAMES.values()}
+        oldest_wait = 0.0
+        now = time.perf_counter()
+        for waiter in self._queue:
+            if not waiter.future.done():
+                queued[PRIORITY_NAMES[waiter.priority]] += 1
+                oldest_wait = max(oldest_wait, now - waiter.enqueued_at)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "tenant_concurrency": self.tenant_concurrency,
+            "batch_concurrency": self.batch_concurrency,
+            "active": self.active,
+            "active_tenants": len(self._active_by_tenant),
+            "queued": queued,
+            "oldest_wait": round(oldest_wait, 4),
+            "classes": {
+                PRIORITY_NAMES[priority]: {
+                    "granted": stats["granted"],
+                    "timeouts": stats["timeouts"],
+                    "max_wait": round(stats["max_wait"], 4),
+                    "active": self._active_by_priority.get(priority, 0),
+                    "avg_wait": round(stats["total_wait"] / stats["granted"], 4) if stats["granted"] else 0.0
+                }
+                for priority, stats in self.stats.items()
+            }
+        }
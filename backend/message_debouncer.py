@@ -0,0 +1,80 @@
+"""
+Message Debouncer
+Collects consecutive items per key (e.g. WhatsApp messages of one contact)
+and hands them over together once the key has been quiet for a short window
+"""
+from typing import Any, Callable, Dict, List, Optional
+import asyncio
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MessageDebouncer:
+    def __init__(self, flush: Callable[[str, List[Any]], None], window: Optional[float] = None,
+                 max_wait: Optional[float] = None):
+        """
+        Initialize Message Debouncer
+
+        Args:
+            flush: Called with (key, items) when a burst is over
+            window: Quiet seconds that end a burst (WHATSAPP_DEBOUNCE_SECONDS, 0 disables)
+            max_wait: Longest a burst is held after its first item (WHATSAPP_DEBOUNCE_MAX_SECONDS)
+        """
+        self.flush = flush
+        self.window = window if window is not None else float(os.environ.get('WHATSAPP_DEBOUNCE_SECONDS', '2.5'))
+        self.max_wait = max_wait or float(os.environ.get('WHATSAPP_DEBOUNCE_MAX_SECONDS', '8'))
+        # key -> {"items": [...], "first": monotonic, "deadline": monotonic, "task": Task}
+        self._bursts: Dict[str, Dict] = {}
+        self.stats = {"items": 0, "flushes": 0}
+
+    def add(self, key: str, item: Any) -> None:
+        """Add an item to the key's burst, pushing its flush back by one window"""
+        self.stats["items"] += 1
+        if self.window <= 0:
+            self._flush(key, [item])
+            return
+
+        now = time.monotonic()
+        burst = self._bursts.get(key)
+        if burst is None:
+            burst = self._bursts[key] = {"items": [], "first": now}
+            burst["task"] = asyncio.get_running_loop().create_task(self._wait(key))
+        burst["items"].append(item)
+        burst["deadline"] = min(now + self.window, burst["first"] + self.max_wait)
+
+    async def _wait(self, key: str) -> None:
+        # One timer per burst; later items only move its deadline
+        while True:
+            delay = self._bursts[key]["deadline"] - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        burst = self._bursts.pop(key)
+        self._flush(key, burst["items"])
+
+    def _flush(self, key: str, items: List[Any]) -> None:
+        self.stats["flushes"] += 1
+        try:
+            self.flush(key, items)
+        except Exception as e:
+            logger.error(f"Error flushing {len(items)} debounced item(s) for {key}: {e}")
+
+    async def stop(self) -> None:
+        """Flush every pending burst now (call at shutdown, before stopping the consumers)"""
+        bursts, self._bursts = self._bursts, {}
+        for key, burst in bursts.items():
+            burst["task"].cancel()
+            self._flush(key, burst["items"])
+        await asyncio.gather(*(burst["task"] for burst in bursts.values()), return_exceptions=True)
+
+    def snapshot(self) -> Dict:
+        return {
+            "window": self.window,
+            "max_wait": self.max_wait,
+            "pending_bursts": len(self._bursts),
+            **self.stats,
+            "merged": self.stats["items"] - self.stats["flushes"]
+        }
@@ -0,0 +1,250 @@
+"""
+Prompt Builder
+Token-budgeted assembly of chat prompts (system prompt, catalog, history)
+"""
+from typing import Dict, List, Optional
+from dataclasses import dataclass, field
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of prompt tokens sent to the model, completion excluded
+DEFAULT_PROMPT_TOKEN_BUDGET = int(os.environ.get('AI_PROMPT_TOKEN_BUDGET', '3000'))
+
+# Share of the budget kept for per-request content (context, history)
+DEFAULT_VOLATILE_RESERVE = 0.3
+
+# Tokens added by the chat format around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """Load the tiktoken encoding once, None if unavailable (e.g. offline)"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"tiktoken unavailable, using approximate token counts: {e}")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens of a text locally
+
+    Args:
+        text: Text to measure
+
+    Returns:
+        Exact count with tiktoken, ~4 characters per token otherwise
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cut a text to at most max_tokens, preferring a line boundary
+
+    Args:
+        text: Text to cut
+        max_tokens: Token limit
+
+    Returns:
+        Truncated text (empty string if nothing fits)
+    """
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        cut = encoding.decode(tokens[:max_tokens])
+    else:
+        if count_tokens(text) <= max_tokens:
+            return text
+        cut = text[:max_tokens * 4]
+
+    # Keep whole lines (whole catalog items) when possible
+    last_newline = cut.rfind("\n")
+    if last_newline > len(cut) // 2:
+        cut = cut[:last_newline]
+    return cut
+
+
+@dataclass
+class PromptSection:
+    name: str
+    content: str
+    priority: int
+    stable: bool
+    truncatable: bool
+    role: str = "system"
+
+
+@dataclass
+class PromptBuild:
+    messages: List[Dict]
+    prompt_tokens: int
+    budget: int
+    sections: Dict[str, int] = field(default_factory=dict)
+    truncated: List[str] = field(default_factory=list)
+    dropped: List[str] = field(default_factory=list)
+    history_messages: int = 0
+
+    def usage(self) -> Dict:
+        """Token accounting of the build, for logs and metrics"""
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "budget": self.budget,
+            "sections": self.sections,
+            "truncated": self.truncated,
+            "dropped": self.dropped,
+            "history_messages": self.history_messages
+        }
+
+
+class PromptBuilder:
+    def __init__(self, budget: Optional[int] = None, volatile_reserve: float = DEFAULT_VOLATILE_RESERVE):
+        """
+        Initialize Prompt Builder
+
+        Sections marked stable (system prompt, catalog) are placed first and
+        are sized against a fixed share of the budget only, so the prompt
+        prefix stays byte-identical across turns and provider-side prompt
+        caching can hit. Volatile sections and history fill what is left.
+        Within each group, lower priority numbers are kept first.
+
+        Args:
+            budget: Prompt token budget (AI_PROMPT_TOKEN_BUDGET by default)
+            volatile_reserve: Share of the budget the stable sections cannot use
+        """
+        self.budget = budget or DEFAULT_PROMPT_TOKEN_BUDGET
+        self.volatile_reserve = volatile_reserve
+        self.sections: List[PromptSection] = []
+        self.history: List[Dict] = []
+        self.history_priority = 0
+
+    def add_section(self, name: str, content: str, priority: int = 0, stable: bool = False,
+                    truncatable: bool = False, role: str = "system") -> "PromptBuilder":
+        """
+        Add a prompt section
+
+        Args:
+            name: Section name used in the usage report
+            content: Section text
+            priority: Lower is kept first when the budget is tight
+            stable: Content identical across requests (placed in the prefix)
+            truncatable: Cut the section instead of dropping it when it does not fit
+            role: Chat role of the emitted message
+        """
+        if content:
+            self.sections.append(PromptSection(name, content, priority, stable, truncatable, role))
+        return self
+
+    def add_history(self, messages: List[Dict], priority: int = 0) -> "PromptBuilder":
+        """
+        Add conversation history, oldest first; the newest messages are kept
+
+        Args:
+            messages: Messages with role and content
+            priority: Priority of the history among volatile sections
+        """
+        self.history = [{"role": m["role"], "content": m["content"]} for m in messages if m.get("content")]
+        self.history_priority = priority
+        return self
+
+    def _fit(self, section: PromptSection, available: int, build: PromptBuild) -> Optional[str]:
+        """Return the section content that fits in available tokens, None if dropped"""
+        tokens = count_tokens(section.content) + MESSAGE_OVERHEAD_TOKENS
+        if tokens <= available:
+            build.sections[section.name] = tokens
+            return section.content
+        if section.truncatable:
+            content = truncate_to_tokens(section.content, available - MESSAGE_OVERHEAD_TOKENS)
+            if content:
+                build.sections[section.name] = count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+                build.truncated.append(section.name)
+                return content
+        build.dropped.append(section.name)
+        return None
+
+    def build(self, user_message: str) -> PromptBuild:
+        """
+        Assemble the chat messages within the budget
+
+        Args:
+            user_message: Current user message, always included
+
+        Returns:
+            PromptBuild with the messages and the token accounting
+        """
+        build = PromptBuild(messages=[], prompt_tokens=0, budget=self.budget)
+        user_tokens = count_tokens(user_message) + MESSAGE_OVERHEAD_TOKENS
+
+        # 1. Stable prefix, sized independently of the per-request content
+        stable_budget = min(self.budget - user_tokens, int(self.budget * (1 - self.volatile_reserve)))
+        stable_used = 0
+        stable_content: Dict[int, str] = {}
+        for index, section in sorted(
+            ((i, s) for i, s in enumerate(self.sections) if s.stable),
+            key=lambda pair: pair[1].priority
+        ):
+            content = self._fit(section, stable_budget - stable_used, build)
+            if content is not None:
+                stable_content[index] = content
+                stable_used += build.sections[section.name]
+
+        # 2. Volatile sections and history share what is left
+        available = self.budget - stable_used - user_tokens
+        volatile_content: Dict[int, str] = {}
+        history_kept: List[Dict] = []
+        volatile = [(i, s) for i, s in enumerate(self.sections) if not s.stable]
+        entries = sorted(
+            [(s.priority, 0, i, s) for i, s in volatile] + [(self.history_priority, 1, -1, None)],
+            key=lambda entry: (entry[0], entry[1])
+        )
+        for _, is_history, index, section in entries:
+            if is_history:
+                for message in reversed(self.history):
+                    tokens = count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+                    if tokens > available:
+                        break
+                    history_kept.insert(0, message)
+                    available -= tokens
+                if history_kept:
+                    build.sections["history"] = sum(
+                        count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in history_kept
+                    )
+                if len(history_kept) < len(self.history):
+                    build.truncated.append("history")
+                continue
+            content = self._fit(section, available, build)
+            if content is not None:
+                volatile_content[index] = content
+                available -= build.sections[section.name]
+
+        # 3. Emit: stable prefix, volatile sections, history, user message
+        for index in sorted(stable_content):
+            build.messages.append({"role": self.sections[index].role, "content": stable_content[index]})
+        for index in sorted(volatile_content):
+            build.messages.append({"role": self.sections[index].role, "content": volatile_content[index]})
+        build.messages.extend(history_kept)
+        build.messages.append({"role": "user", "content": user_message})
+
+        build.history_messages = len(history_kept)
+        build.prompt_tokens = sum(build.sections.values()) + user_tokens
+        build.sections["user"] = user_tokens
+        return build
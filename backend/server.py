@@ -1,5 +1,5 @@
 from fastapi import FastAPI, APIRouter, HTTPException, File, UploadFile, BackgroundTasks, Request, Depends
-from fastapi.responses import Response, RedirectResponse, JSONResponse
+from fastapi.responses import Response, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
@@ -11,19 +11,26 @@ from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional, Dict, Any
 import uuid
 import re
+import json
 from datetime import datetime, timezone, timedelta
 import io
+import html
 import base64
-from openai import OpenAI
 import resend
 import openpyxl
 import pandas as pd
 import stripe
 import bcrypt
 import jwt
-from whatsapp_service import WhatsAppService
+from whatsapp_service import WhatsAppService, WhatsAppClientPool, campaign_payload, payload_text, with_text
 from ai_memory_service import AIMemoryService
-from emergentintegrations.llm.chat import LlmChat, UserMessage
+from ai_response_cache import AIResponseCache
+from prompt_builder import PromptBuilder
+from llm_provider import LLMClient, LLMProvider, get_llm_provider, llm_stub_enabled
+from llm_scheduler import LLMScheduler, PRIORITY_INTERACTIVE, PRIORITY_WHATSAPP, PRIORITY_BATCH
+from llm_metrics import LLMMetrics
+from llm_circuit import CircuitBreakers
+from template_engine import TemplateError, compile_template
 from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
 
 
@@ -48,13 +55,90 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize AI Memory Service
-ai_memory = AIMemoryService(db)
+# Initialize AI Response Cache (exact-match cache for /ai/generate)
+ai_response_cache = AIResponseCache(
+    db,
+    ttl_seconds=int(os.environ.get('AI_RESPONSE_CACHE_TTL', str(7 * 24 * 3600)))
+)
+
+# Initialize LLM client (every AI call goes through it for admission control and latency/token accounting)
+llm_scheduler = LLMScheduler()
+llm_metrics = LLMMetrics(db)
+llm_breakers = CircuitBreakers()
+llm_client = LLMClient(llm_scheduler, llm_metrics, llm_breakers)
+
+MEMORY_SUMMARY_MODEL = "gpt-4o-mini"
+
+async def summarize_conversation_memory(previous_summary: Optional[str], messages: List[Dict]) -> str:
+    """Fold messages leaving the AI memory window into the contact's running summary"""
+    settings = await get_settings()
+    transcript = "\n".join(
+        f"{'Client' if m['role'] == 'user' else 'Afroboost'}: {m['content']}" for m in messages
+    )
+    result = await llm_client.complete(
+        get_openai_provider(settings.openai_api_key),
+        [
+            {
+                "role": "system",
+                "content": "Tu résumes des conversations client d'Afroboost (danse et fitness). "
+                           "Mets à jour le résumé existant avec les nouveaux messages en 5 phrases maximum: "
+                           "besoins, produits évoqués, réservations, préférences et questions en suspens."
+            },
+            {
+                "role": "user",
+                "content": f"Résumé existant:\n{previous_summary or '(aucun)'}\n\nNouveaux messages:\n{transcript}"
+            }
+        ],
+        model=MEMORY_SUMMARY_MODEL,
+        endpoint="memory_summary",
+        temperature=0.3,
+        max_tokens=200,
+        priority=PRIORITY_BATCH
+    )
+    return result.content
+
+# Initialize AI Memory Service (older messages are summarized in the background)
+ai_memory = AIMemoryService(db, summarizer=summarize_conversation_memory)
 
 # Initialize Chat AI Service
 from chat_ai_service import ChatAIService
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')
-chat_ai = ChatAIService(db, OPENAI_API_KEY) if OPENAI_API_KEY else None
+chat_ai = ChatAIService(db, OPENAI_API_KEY, llm_client) if OPENAI_API_KEY or llm_stub_enabled() else None
+
+# Initialize Analytics Digest (compact analytics injected in AI assistant prompts)
+from analytics_digest import AnalyticsDigestService
+analytics_digest = AnalyticsDigestService(db)
+
+# Initialize WhatsApp clients (one keep-alive HTTP client per phone number ID, closed at shutdown)
+whatsapp_clients = WhatsAppClientPool()
+
+# Initialize WhatsApp campaign sender (concurrent, messages-per-second ceiling per phone number ID)
+from whatsapp_sender import WhatsAppCampaignSender, provider_message_id
+whatsapp_sender = WhatsAppCampaignSender(db)
+
+# Initialize WhatsApp status ingestion (status webhooks matched by wamid)
+from whatsapp_status import WhatsAppStatusService
+whatsapp_status = WhatsAppStatusService(db)
+
+# Initialize WhatsApp media cache (campaign media uploaded once per phone number)
+from whatsapp_media import WhatsAppMediaCache
+whatsapp_media = WhatsAppMediaCache(db)
+
+# Initialize job leases (a campaign or AI batch job runs in one worker process at a time)
+from job_lease import JobLease
+campaign_lease = JobLease(db.advanced_whatsapp_campaigns)
+
+# Initialize Webhook Dedupe (Meta and Stripe retries are acknowledged without reprocessing)
+from webhook_dedupe import WebhookDedupe
+webhook_dedupe = WebhookDedupe(db)
+
+# Initialize WhatsApp inbound queue (serial per contact, bounded, sheds load with 503)
+from keyed_work_queue import KeyedWorkQueue
+whatsapp_inbound = KeyedWorkQueue("whatsapp_inbound")
+
+# Initialize WhatsApp debounce (a burst of messages from one contact gets one AI reply)
+from message_debouncer import MessageDebouncer
+whatsapp_debouncer = MessageDebouncer(lambda from_phone, messages: queue_whatsapp_reply(from_phone, messages))
 
 # Initialize Notifications Service
 from notifications_service import NotificationsService
@@ -68,6 +152,7 @@ JWT_EXPIRATION_HOURS = 24 * 7  # 7 days
 
 # Security
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 
 # ========================
@@ -432,10 +517,19 @@ class AIGenerateRequest(BaseModel):
     language: str = "fr"
     tone: str = "professional"  # professional, friendly, energetic
     type: str = "email"  # email, subject, cta
+    regenerate: bool = False  # Skip the response cache and ask the model again
 
 class AIGenerateResponse(BaseModel):
     content: str
     language: str
+    cached: bool = False
+
+class AIBatchVariant(AIGenerateRequest):
+    label: Optional[str] = None  # Free text shown with the result (group, segment...)
+
+class AIBatchGenerateRequest(BaseModel):
+    variants: List[AIBatchVariant]
+    concurrency: Optional[int] = None  # Variants generated at once (capped server-side)
 
 # WhatsApp Models
 class WhatsAppConfig(BaseModel):
@@ -493,6 +587,7 @@ class WhatsAppMessage(BaseModel):
     status: str  # sent, delivered, read, failed
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     error_message: Optional[str] = None
+    provider_message_id: Optional[str] = None  # Graph API wamid, matches status webhooks
 
 class WhatsAppIncomingMessage(BaseModel):
     from_phone: str
@@ -511,6 +606,7 @@ class AIConversationRequest(BaseModel):
 class AIConversationResponse(BaseModel):
     response: str
     context_used: str
+    prompt_tokens: int = 0
 
 
 
@@ -634,6 +730,7 @@ class AdvancedWhatsAppCampaign(BaseModel):
     
     # Scheduling
     status: str = "draft"  # draft, scheduled, sending, sent, failed
+    dry_run: bool = False  # Last send was a simulation
     scheduled_at: Optional[datetime] = None
     sent_at: Optional[datetime] = None
     
@@ -667,6 +764,7 @@ class AdvancedWhatsAppCampaignCreate(BaseModel):
     target_tags: List[str] = []
     target_status: Optional[str] = None
     use_personalization: bool = False
+    variables: Dict[str, str] = {}
     scheduled_at: Optional[str] = None
     payment_links: List[Dict[str, str]] = []
 
@@ -684,6 +782,10 @@ class CampaignAnalytics(BaseModel):
     read: bool = False
     replied: bool = False
     clicked: bool = False
+    failed: bool = False
+    status: str = "pending"  # pending, sent, delivered, read, failed (status webhooks)
+    error_message: Optional[str] = None
+    provider_message_id: Optional[str] = None  # Graph API message ID (wamid)
     
     # Timestamps
     sent_at: Optional[datetime] = None
@@ -1316,11 +1418,22 @@ async def get_settings():
         settings['updated_at'] = datetime.fromisoformat(settings['updated_at'])
     return AdminSettings(**settings)
 
-def get_openai_client(api_key: str):
-    """Create OpenAI client with API key"""
-    if not api_key:
+def invalidate_chat_ai_context(tenant_id: Optional[str] = None):
+    """Drop the cached ad-chat AI prompt context after catalog or discount changes"""
+    if chat_ai:
+        chat_ai.invalidate_context(tenant_id)
+
+def get_openai_provider(api_key: str) -> LLMProvider:
+    """Get the OpenAI LLM provider for an API key (local stub when LLM_PROVIDER=stub)"""
+    if not api_key and not llm_stub_enabled():
         raise HTTPException(status_code=400, detail="OpenAI API key not configured")
-    return OpenAI(api_key=api_key)
+    return get_llm_provider("openai", api_key)
+
+def llm_tenant_id(current_user: Optional[Dict], request: Request) -> str:
+    """Tenant used by the LLM scheduler: the coach, or the client IP for anonymous calls"""
+    if current_user:
+        return current_user["id"]
+    return f"ip:{request.client.host if request.client else 'unknown'}"
 
 def get_resend_client(api_key: str):
     """Configure Resend with API key"""
@@ -1353,6 +1466,68 @@ async def get_contacts_by_filters(groups: List[str] = None, tags: List[str] = No
     logger.info(f"Found {len(contacts)} contacts")
     return [Contact(**c) for c in contacts]
 
+def contact_phone(contact: Dict) -> Optional[str]:
+    """Phone number of a contact (phone field, or phone: tag of contacts created by the WhatsApp webhook)"""
+    if contact.get("phone"):
+        return contact["phone"]
+    for tag in contact.get("tags") or []:
+        if tag.startswith("phone:"):
+            return tag.replace("phone:", "")
+    return None
+
+# Merge tags available in campaign, WhatsApp and reminder messages ({{prenom}}, ...)
+CONTACT_TEMPLATE_VARIABLES = (
+    "name", "prenom", "nom", "first_name", "last_name", "email", "phone",
+    "membership_type", "subscription_status", "subscription_start", "subscription_end",
+    "total_courses_attended"
+)
+
+# Contact fields read by contact_template_values
+CONTACT_TEMPLATE_FIELDS = (
+    "name", "email", "phone", "tags", "membership_type", "subscription_status",
+    "subscription_start", "subscription_end", "total_courses_attended"
+)
+
+def format_template_date(value: Any) -> Any:
+    """Dates as shown in messages (dd.mm.yyyy)"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    return value.strftime("%d.%m.%Y") if isinstance(value, datetime) else value
+
+def contact_template_values(contact: Any) -> Dict[str, Any]:
+    """Values of CONTACT_TEMPLATE_VARIABLES for a contact (document or Contact)"""
+    data = contact if isinstance(contact, dict) else contact.model_dump()
+    name = data.get("name") or ""
+    first_name, _, last_name = name.partition(" ")
+    return {
+        "name": name,
+        "prenom": first_name,
+        "nom": last_name,
+        "first_name": first_name,
+        "last_name": last_name,
+        "email": data.get("email"),
+        "phone": contact_phone(data),
+        "membership_type": data.get("membership_type"),
+        "subscription_status": data.get("subscription_status"),
+        "subscription_start": format_template_date(data.get("subscription_start")),
+        "subscription_end": format_template_date(data.get("subscription_end")),
+        "total_courses_attended": data.get("total_courses_attended")
+    }
+
+def declared_template_variables(variables: List[str]) -> List[str]:
+    """Variable names of a template's variables list ("{{nom}}" or "nom")"""
+    return [variable.strip("{} ") for variable in variables]
+
+def check_template(source: Optional[str], extra_variables: Any = ()) -> None:
+    """Reject a template using unknown merge tags (400)"""
+    try:
+        compile_template(source, allowed=[*CONTACT_TEMPLATE_VARIABLES, *extra_variables])
+    except TemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 
 # ========================
 # AUTH UTILITIES
@@ -1399,6 +1574,17 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     
     return user
 
+async def get_optional_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> Optional[Dict]:
+    """Get current user if a valid JWT token is sent, None otherwise"""
+    if not credentials:
+        return None
+    try:
+        return await get_current_user(credentials)
+    except HTTPException:
+        return None
+
 async def require_admin(current_user: Dict = Depends(get_current_user)) -> Dict:
     """Require admin role"""
     if current_user.get("role") != "admin":
@@ -1864,10 +2050,8 @@ async def configure_whatsapp(
 ):
     """Configure WhatsApp credentials for user"""
     try:
-        # Test credentials by creating client
-        from whatsapp_client import WhatsAppClient
-        client = WhatsAppClient(phone_id=phone_id, access_token=access_token)
-        await client.close()
+        # Register the client (replaces the token of an existing one)
+        whatsapp_clients.get(phone_id, access_token)
         
         # Save or update config
         existing_config = await db.whatsapp_configs.find_one({"user_id": current_user["id"]})
@@ -1962,6 +2146,7 @@ async def create_contact(contact_data: ContactCreate, current_user: Dict = Depen
     doc['created_at'] = doc['created_at'].isoformat()
     
     await db.contacts.insert_one(doc)
+    analytics_digest.mark_dirty(current_user["id"], "contacts")
     logger.info(f"User {current_user['email']} created contact: {contact.email}")
     
     # Send welcome email automatically
@@ -1993,6 +2178,7 @@ async def update_contact(contact_id: str, contact_update: ContactUpdate, current
     doc['created_at'] = doc['created_at'].isoformat()
     
     await db.contacts.update_one({"id": contact_id, "user_id": current_user["id"]}, {"$set": doc})
+    analytics_digest.mark_dirty(current_user["id"], "contacts")
     logger.info(f"User {current_user['email']} updated contact: {contact_id}")
     return contact_obj
 
@@ -2002,6 +2188,7 @@ async def delete_contact(contact_id: str, current_user: Dict = Depends(get_curre
     result = await db.contacts.delete_one({"id": contact_id, "user_id": current_user["id"]})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Contact not found")
+    analytics_digest.mark_dirty(current_user["id"], "contacts")
     logger.info(f"User {current_user['email']} deleted contact: {contact_id}")
     return {"message": "Contact deleted successfully"}
 
@@ -2112,6 +2299,7 @@ async def import_contacts(
                 error_details.append(f"Ligne {idx+2}: {str(e)}")
         
         logger.info(f"User {current_user['email']} imported {imported} contacts, {duplicates} duplicates, {errors} errors")
+        analytics_digest.mark_dirty(current_user["id"], "contacts")
         
         return {
             "imported": imported,
@@ -2130,6 +2318,7 @@ async def import_contacts(
 async def bulk_delete_contacts(current_user: Dict = Depends(get_current_user)):
     """Delete ALL contacts for current user (requires confirmation)"""
     result = await db.contacts.delete_many({"user_id": current_user["id"]})
+    analytics_digest.mark_dirty(current_user["id"], "contacts")
     logger.warning(f"User {current_user['email']} deleted ALL {result.deleted_count} contacts")
     return {
         "message": f"{result.deleted_count} contact(s) supprimé(s)",
@@ -2180,6 +2369,7 @@ async def update_contact_subscription(
         {"id": contact_id},
         {"$set": update_data}
     )
+    analytics_digest.mark_dirty(None, "contacts")
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Contact not found")
@@ -2241,25 +2431,20 @@ async def send_bulk_message(
         if not config:
             raise HTTPException(status_code=400, detail="WhatsApp not configured")
         
-        from whatsapp_client import WhatsAppClient
-        client = WhatsAppClient(
-            phone_id=config["phone_id"],
-            access_token=config["access_token"]
-        )
+        client = whatsapp_clients.get(config["phone_id"], config["access_token"])
         
         for contact in contacts:
             phone = contact.get("phone") or contact.get("email")  # Fallback to email if no phone
             try:
                 await client.send_text_message(
-                    recipient_phone=phone,
-                    message_text=message
+                    to=phone,
+                    message=message,
+                    preview_url=True
                 )
                 sent_count += 1
             except Exception as e:
                 logger.error(f"Failed to send WhatsApp to {phone}: {e}")
                 failed_count += 1
-        
-        await client.close()
     
     return {
         "message": "Messages sent",
@@ -2297,6 +2482,8 @@ async def get_campaign(campaign_id: str):
 @api_router.post("/campaigns", response_model=Campaign)
 async def create_campaign(campaign_data: CampaignCreate):
     """Create a new campaign"""
+    check_template(campaign_data.subject)
+    check_template(campaign_data.content_html)
     campaign = Campaign(**campaign_data.model_dump())
     if campaign_data.scheduled_at:
         campaign.status = "scheduled"
@@ -2324,6 +2511,9 @@ async def update_campaign(campaign_id: str, campaign_update: CampaignUpdate):
     
     campaign_obj = Campaign(**campaign)
     update_data = campaign_update.model_dump(exclude_unset=True)
+    for field in ("subject", "content_html"):
+        if update_data.get(field):
+            check_template(update_data[field])
     
     for key, value in update_data.items():
         setattr(campaign_obj, key, value)
@@ -2404,16 +2594,32 @@ async def send_campaign_emails(campaign_id: str):
         
         get_resend_client(settings.resend_api_key)
         
+        # Merge tags compiled once, rendered per contact
+        try:
+            subject_template = compile_template(campaign_obj.subject, allowed=CONTACT_TEMPLATE_VARIABLES)
+            body_template = compile_template(
+                campaign_obj.content_html, allowed=CONTACT_TEMPLATE_VARIABLES, escape=html.escape
+            )
+        except TemplateError as e:
+            logger.error(f"Invalid template in campaign {campaign_id}: {e}")
+            await db.campaigns.update_one(
+                {"id": campaign_id},
+                {"$set": {"status": "failed"}}
+            )
+            return
+        
         sent_count = 0
         failed_count = 0
         
         for contact in contacts:
             try:
+                values = contact_template_values(contact)
+                
                 # Create tracking pixel
                 tracking_pixel = f'<img src="{os.getenv("REACT_APP_BACKEND_URL", "http://localhost:8001")}/api/track/open/{campaign_id}/{contact.id}" width="1" height="1" />'
                 
                 # Add tracking to links
-                content_with_tracking = campaign_obj.content_html.replace(
+                content_with_tracking = body_template.render(values).replace(
                     'href="',
                     f'href="{os.getenv("REACT_APP_BACKEND_URL", "http://localhost:8001")}/api/track/click/{campaign_id}/{contact.id}?url='
                 )
@@ -2425,7 +2631,7 @@ async def send_campaign_emails(campaign_id: str):
                 params = {
                     "from": f"{settings.sender_name} <{settings.sender_email}>",
                     "to": [contact.email],
-                    "subject": campaign_obj.subject,
+                    "subject": subject_template.render(values),
                     "html": content_with_tracking,
                 }
                 
@@ -2478,6 +2684,7 @@ async def send_campaign_emails(campaign_id: str):
                 }
             }
         )
+        analytics_digest.mark_dirty(None, "campaigns")
         
         logger.info(f"Campaign {campaign_id} sent: {sent_count} sent, {failed_count} failed")
         
@@ -2596,6 +2803,12 @@ async def get_analytics_overview():
         "click_rate": round(click_rate, 2)
     }
 
+@api_router.get("/analytics/digest")
+async def get_analytics_digest(current_user: Dict = Depends(get_current_user)):
+    """Get the analytics digest used by the AI assistant (cached, stale sections recomputed)"""
+    digest = await analytics_digest.get_digest(current_user["id"])
+    return {**digest, "text": AnalyticsDigestService.format_digest(digest)}
+
 @api_router.get("/analytics/campaigns")
 async def get_campaign_analytics():
     """Get campaign performance analytics"""
@@ -2628,46 +2841,240 @@ async def get_campaign_analytics():
 # ROUTES - AI
 # ========================
 
-@api_router.post("/ai/generate", response_model=AIGenerateResponse)
-async def generate_ai_content(request: AIGenerateRequest):
-    """Generate email content using AI"""
+AI_GENERATE_MODEL = "gpt-4-turbo"
+
+def build_generate_prompts(request: AIGenerateRequest) -> tuple:
+    """System and user prompts for a content generation request"""
+    if request.type == "subject":
+        system_prompt = f"You are an expert email marketer. Generate a compelling email subject line in {request.language}. Be concise and engaging."
+        user_prompt = f"Create an email subject line for: {request.prompt}\nTone: {request.tone}\nLanguage: {request.language}"
+    elif request.type == "cta":
+        system_prompt = f"You are an expert copywriter. Generate a compelling call-to-action button text in {request.language}."
+        user_prompt = f"Create a CTA for: {request.prompt}\nTone: {request.tone}\nLanguage: {request.language}"
+    else:  # email
+        system_prompt = f"You are an expert email marketer for Afroboost, a dance and fitness company. Generate professional HTML email content in {request.language}. Include proper formatting with paragraphs, bold text where appropriate, and a clear structure."
+        user_prompt = f"Create an email about: {request.prompt}\nTone: {request.tone}\nLanguage: {request.language}\n\nFormat the response as clean HTML (use <p>, <strong>, <br> tags). Do not include <html>, <body> or <head> tags, just the content."
+    return system_prompt, user_prompt
+
+async def run_ai_generate(request: AIGenerateRequest, tenant_id: str, endpoint: str = "ai_generate") -> AIGenerateResponse:
+    """Generate content through the response cache, calling the model on a miss"""
+    cache_key = AIResponseCache.make_key(
+        model=AI_GENERATE_MODEL,
+        prompt=request.prompt,
+        language=request.language,
+        tone=request.tone,
+        type=request.type
+    )
+    
+    if request.regenerate:
+        ai_response_cache.record_bypass()
+    else:
+        cached = await ai_response_cache.get(cache_key)
+        if cached:
+            return AIGenerateResponse(content=cached["content"], language=request.language, cached=True)
+    
     settings = await get_settings()
+    provider = get_openai_provider(settings.openai_api_key)
+    system_prompt, user_prompt = build_generate_prompts(request)
+    
+    result = await llm_client.complete(
+        provider,
+        [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        model=AI_GENERATE_MODEL,
+        endpoint=endpoint,
+        temperature=0.7,
+        max_tokens=1000,
+        tenant_id=tenant_id,
+        priority=PRIORITY_BATCH
+    )
+    
+    content = result.content
+    await ai_response_cache.set(cache_key, {"content": content})
     
+    return AIGenerateResponse(
+        content=content,
+        language=request.language
+    )
+
+async def generate_batch_variant(variant: Dict, tenant_id: str) -> Dict:
+    """Generate one variant of a batch job"""
+    request = AIGenerateRequest(**{name: variant[name] for name in AIGenerateRequest.model_fields if name in variant})
+    return (await run_ai_generate(request, tenant_id, endpoint="ai_generate_batch")).model_dump()
+
+# Initialize AI Batch Service (background generation of campaign variants)
+from ai_batch_service import AIBatchService, FINISHED_STATUSES
+ai_batch = AIBatchService(db, generate_batch_variant)
+
+@api_router.post("/ai/generate", response_model=AIGenerateResponse)
+async def generate_ai_content(
+    request: AIGenerateRequest,
+    http_request: Request,
+    current_user: Optional[Dict] = Depends(get_optional_user)
+):
+    """Generate email content using AI"""
     try:
-        client = get_openai_client(settings.openai_api_key)
-        
-        # Build prompt based on type
-        if request.type == "subject":
-            system_prompt = f"You are an expert email marketer. Generate a compelling email subject line in {request.language}. Be concise and engaging."
-            user_prompt = f"Create an email subject line for: {request.prompt}\nTone: {request.tone}\nLanguage: {request.language}"
-        elif request.type == "cta":
-            system_prompt = f"You are an expert copywriter. Generate a compelling call-to-action button text in {request.language}."
-            user_prompt = f"Create a CTA for: {request.prompt}\nTone: {request.tone}\nLanguage: {request.language}"
-        else:  # email
-            system_prompt = f"You are an expert email marketer for Afroboost, a dance and fitness company. Generate professional HTML email content in {request.language}. Include proper formatting with paragraphs, bold text where appropriate, and a clear structure."
-            user_prompt = f"Create an email about: {request.prompt}\nTone: {request.tone}\nLanguage: {request.language}\n\nFormat the response as clean HTML (use <p>, <strong>, <br> tags). Do not include <html>, <body> or <head> tags, just the content."
-        
-        response = client.chat.completions.create(
-            model="gpt-4-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1000
-        )
-        
-        content = response.choices[0].message.content
-        
-        return AIGenerateResponse(
-            content=content,
-            language=request.language
-        )
-        
+        return await run_ai_generate(request, llm_tenant_id(current_user, http_request))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating AI content: {e}")
         raise HTTPException(status_code=500, detail=f"Error generating content: {str(e)}")
 
+@api_router.post("/ai/generate/batch")
+async def create_ai_batch(request: AIBatchGenerateRequest, current_user: Dict = Depends(get_current_user)):
+    """
+    Generate several content variants (per group, language, tone) as a background job.
+    
+    Identical variants are generated once and cached variants skip the model.
+    Follow progress with GET /ai/generate/batch/{job_id}/stream.
+    """
+    try:
+        job = await ai_batch.create_job(
+            current_user["id"],
+            [variant.model_dump() for variant in request.variants],
+            request.concurrency
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        **{name: value for name, value in job.items() if name != "variants"},
+        "variants": [AIBatchService.public_variant(variant) for variant in job["variants"]]
+    }
+
+# Seconds without local progress events before the batch stream re-reads the job
+AI_BATCH_POLL_SECONDS = 2.0
+
+async def get_ai_batch_job(job_id: str, user_id: str) -> Dict:
+    job = await db.ai_batch_jobs.find_one({"id": job_id, "user_id": user_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    job["variants"] = [AIBatchService.public_variant(variant) for variant in job["variants"]]
+    return job
+
+@api_router.get("/ai/generate/batch/{job_id}")
+async def get_ai_batch(job_id: str, current_user: Dict = Depends(get_current_user)):
+    """Get a batch job with the variants generated so far"""
+    return await get_ai_batch_job(job_id, current_user["id"])
+
+@api_router.get("/ai/generate/batch/{job_id}/stream")
+async def stream_ai_batch(job_id: str, current_user: Dict = Depends(get_current_user)):
+    """
+    Batch job progress as server-sent events.
+    
+    Emits one `result` event per finished variant (those already generated
+    first), then a `done` event with the final job status.
+    """
+    queue = ai_batch.subscribe(job_id)
+    try:
+        job = await get_ai_batch_job(job_id, current_user["id"])
+    except HTTPException:
+        ai_batch.unsubscribe(job_id, queue)
+        raise
+    
+    # Job interrupted by a restart of another process: pick it up here (the
+    # runner only takes it if that process's lease has expired)
+    if job["status"] in ("pending", "running") and not ai_batch.is_running(job_id):
+        ai_batch.start(job_id)
+    
+    async def event_stream():
+        try:
+            sent = set()
+            for variant in job["variants"]:
+                if variant["status"] in ("done", "failed"):
+                    sent.add(variant["index"])
+                    yield sse_event("result", variant)
+            if job["status"] in FINISHED_STATUSES:
+                yield sse_event("done", {"job_id": job_id, "status": job["status"]})
+                return
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=AI_BATCH_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    # Job run by another worker process, whose events are not published here
+                    current = await get_ai_batch_job(job_id, current_user["id"])
+                    for variant in current["variants"]:
+                        if variant["status"] in ("done", "failed") and variant["index"] not in sent:
+                            sent.add(variant["index"])
+                            yield sse_event("result", variant)
+                    if current["status"] in FINISHED_STATUSES:
+                        yield sse_event("done", {"job_id": job_id, "status": current["status"]})
+                        return
+                    continue
+                if event == "result":
+                    if data["index"] in sent:
+                        continue
+                    sent.add(data["index"])
+                yield sse_event(event, data)
+                if event == "done":
+                    return
+        finally:
+            ai_batch.unsubscribe(job_id, queue)
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@api_router.post("/ai/generate/batch/{job_id}/resume")
+async def resume_ai_batch(job_id: str, current_user: Dict = Depends(get_current_user)):
+    """Resume an interrupted or cancelled batch job and retry its failed variants"""
+    await get_ai_batch_job(job_id, current_user["id"])
+    started = await ai_batch.resume(job_id)
+    return {"job_id": job_id, "resumed": started}
+
+@api_router.post("/ai/generate/batch/{job_id}/cancel")
+async def cancel_ai_batch(job_id: str, current_user: Dict = Depends(get_current_user)):
+    """Cancel a batch job, variants already generated are kept"""
+    await get_ai_batch_job(job_id, current_user["id"])
+    cancelled = await ai_batch.cancel(job_id)
+    return {"job_id": job_id, "cancelled": cancelled}
+
+@api_router.get("/ai/llm/stats")
+async def get_llm_stats(current_user: Dict = Depends(get_current_user)):
+    """Get per-endpoint LLM call latency, token and error counters"""
+    return {
+        "provider_override": "stub" if llm_stub_enabled() else None,
+        "calls": llm_metrics.snapshot(),
+        "scheduler": llm_scheduler.snapshot(),
+        "circuits": llm_breakers.snapshot(),
+        "hedging": llm_client.hedge_stats,
+        "ad_chat_answers": chat_ai.get_answer_stats() if chat_ai else None
+    }
+
+@api_router.get("/ai/llm/usage")
+async def get_llm_usage(
+    days: int = 30,
+    all_tenants: bool = False,
+    current_user: Dict = Depends(get_current_user)
+):
+    """Get daily LLM usage (calls, tokens, latency, estimated cost) per endpoint and model"""
+    await llm_metrics.flush()
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d")
+    query = {"day": {"$gte": since}}
+    if not (all_tenants and current_user.get("role") == "admin"):
+        query["tenant_id"] = current_user["id"]
+    
+    usage = await db.llm_usage.find(query, {"_id": 0}).sort("day", -1).to_list(length=5000)
+    for row in usage:
+        row["avg_latency"] = round(row["total_latency"] / row["calls"], 4) if row.get("calls") else 0.0
+        row["cost_usd"] = round(row.get("cost_usd", 0.0), 6)
+    return usage
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Prometheus exposition of LLM call and WhatsApp inbound queue metrics (no tenant data)"""
+    return Response(
+        content=(
+            llm_metrics.render_prometheus(llm_scheduler.snapshot(), llm_breakers.snapshot())
+            + whatsapp_inbound.render_prometheus()
+        ),
+        media_type="text/plain; version=0.0.4"
+    )
+
+@api_router.get("/ai/generate/cache/stats")
+async def get_ai_generate_cache_stats(current_user: Dict = Depends(get_current_user)):
+    """Get hit-rate metrics of the /ai/generate response cache"""
+    return ai_response_cache.get_stats()
 
 
 # ========================
@@ -2778,11 +3185,8 @@ async def send_whatsapp_campaign_messages(campaign_id: str):
             )
             return
         
-        # Initialize WhatsApp service
-        whatsapp = WhatsAppService(
-            access_token=settings.whatsapp_access_token,
-            phone_number_id=settings.whatsapp_phone_number_id
-        )
+        # Shared WhatsApp client for the configured phone number
+        whatsapp = whatsapp_clients.get(settings.whatsapp_phone_number_id, settings.whatsapp_access_token)
         
         # Get target contacts
         contacts = await get_contacts_by_filters(
@@ -2798,75 +3202,56 @@ async def send_whatsapp_campaign_messages(campaign_id: str):
             )
             return
         
-        sent_count = 0
+        recipients = []
         failed_count = 0
-        
         for contact in contacts:
-            try:
-                # Assume phone stored in tags or add phone field to Contact model
-                phone = getattr(contact, 'phone', None)
-                if not phone:
-                    # Try to extract from tags
-                    phone_tags = [t for t in contact.tags if t.startswith('phone:')]
-                    if phone_tags:
-                        phone = phone_tags[0].replace('phone:', '')
-                
-                if not phone:
-                    logger.warning(f"No phone number for contact {contact.id}")
-                    failed_count += 1
-                    continue
-                
-                # Send WhatsApp message
-                result = whatsapp.send_text_message(
-                    to=phone,
-                    message=campaign_obj.message_content
-                )
-                
-                # Log message
-                whatsapp_msg = WhatsAppMessage(
-                    campaign_id=campaign_id,
-                    contact_id=contact.id,
-                    contact_phone=phone,
-                    direction="outbound",
-                    content=campaign_obj.message_content,
-                    status="sent"
-                )
-                msg_doc = whatsapp_msg.model_dump()
-                msg_doc['timestamp'] = msg_doc['timestamp'].isoformat()
-                await db.whatsapp_messages.insert_one(msg_doc)
-                
-                sent_count += 1
-                
-            except Exception as e:
-                logger.error(f"Error sending WhatsApp to contact {contact.id}: {e}")
+            # Assume phone stored in tags or add phone field to Contact model
+            phone = getattr(contact, 'phone', None)
+            if not phone:
+                # Try to extract from tags
+                phone_tags = [t for t in contact.tags if t.startswith('phone:')]
+                if phone_tags:
+                    phone = phone_tags[0].replace('phone:', '')
+            
+            if not phone:
+                logger.warning(f"No phone number for contact {contact.id}")
                 failed_count += 1
-                
-                # Log failed message
-                whatsapp_msg = WhatsAppMessage(
-                    campaign_id=campaign_id,
-                    contact_id=contact.id,
-                    contact_phone=phone if phone else "unknown",
-                    direction="outbound",
-                    content=campaign_obj.message_content,
-                    status="failed",
-                    error_message=str(e)
-                )
-                msg_doc = whatsapp_msg.model_dump()
-                msg_doc['timestamp'] = msg_doc['timestamp'].isoformat()
-                await db.whatsapp_messages.insert_one(msg_doc)
-        
-        # Update campaign
-        await db.whatsapp_campaigns.update_one(
-            {"id": campaign_id},
-            {
-                "$set": {
-                    "status": "sent",
-                    "sent_at": datetime.now(timezone.utc).isoformat(),
-                    "stats.sent": sent_count,
-                    "stats.failed": failed_count
-                }
-            }
+                continue
+            recipients.append((contact.id, phone))
+        
+        def build_log(contact_id: str, phone: str, status: str, error_message: Optional[str],
+                      provider_message_id: Optional[str]) -> Dict:
+            whatsapp_msg = WhatsAppMessage(
+                campaign_id=campaign_id,
+                contact_id=contact_id,
+                contact_phone=phone,
+                direction="outbound",
+                content=campaign_obj.message_content,
+                status=status,
+                error_message=error_message,
+                provider_message_id=provider_message_id
+            )
+            msg_doc = whatsapp_msg.model_dump()
+            msg_doc['timestamp'] = msg_doc['timestamp'].isoformat()
+            return msg_doc
+        
+        # Concurrent send within the phone number's messages-per-second ceiling
+        sent_count, send_failed = await whatsapp_sender.send_campaign(
+            whatsapp,
+            campaign_id,
+            recipients,
+            campaign_obj.message_content,
+            build_log
         )
+        no_phone_count = failed_count
+        failed_count += send_failed
+        
+        # Update campaign (the sender already counted its batches into stats)
+        update = {"$set": {"status": "sent", "sent_at": datetime.now(timezone.utc).isoformat()}}
+        if no_phone_count:
+            update["$inc"] = {"stats.failed": no_phone_count}
+        await db.whatsapp_campaigns.update_one({"id": campaign_id}, update)
+        analytics_digest.mark_dirty(None, "campaigns")
         
         logger.info(f"WhatsApp campaign {campaign_id} sent: {sent_count} sent, {failed_count} failed")
         
@@ -2899,11 +3284,21 @@ async def verify_whatsapp_webhook(request: Request):
     else:
         raise HTTPException(status_code=403, detail="Verification failed")
 
+@api_router.get("/whatsapp/inbound/stats")
+async def get_whatsapp_inbound_stats(current_user: Dict = Depends(get_current_user)):
+    """Get inbound WhatsApp queue depth, wait times, merged and shed messages"""
+    return {
+        "queue": whatsapp_inbound.snapshot(),
+        "debounce": whatsapp_debouncer.snapshot(),
+        "dedupe": webhook_dedupe.get_stats()
+    }
+
 @api_router.post("/whatsapp/webhook")
 async def handle_whatsapp_webhook(request: Request, background_tasks: BackgroundTasks):
     """Handle incoming WhatsApp messages"""
     try:
         body = await request.json()
+        shed = False
         
         # Process webhook
         if body.get("object") == "whatsapp_business_account":
@@ -2911,30 +3306,72 @@ async def handle_whatsapp_webhook(request: Request, background_tasks: Background
                 for change in entry.get("changes", []):
                     value = change.get("value", {})
                     
-                    # Handle incoming messages
+                    # Handle incoming messages (Meta retries deliveries: each message is answered once)
                     if "messages" in value:
+                        new_ids = set(await webhook_dedupe.claim_many(
+                            "whatsapp_message",
+                            [message.get("id") for message in value["messages"] if message.get("id")]
+                        ))
+                        contact_info = value.get("contacts", [{}])[0]
                         for message in value["messages"]:
-                            background_tasks.add_task(
-                                handle_incoming_whatsapp_message,
-                                message,
-                                value.get("contacts", [{}])[0]
+                            if message.get("id") not in new_ids:
+                                continue
+                            # Serial per sender (ordered memory and replies), parallel across senders
+                            queued = whatsapp_inbound.submit(
+                                message.get("from") or message["id"],
+                                lambda message=message, contact_info=contact_info: handle_incoming_whatsapp_message(message, contact_info),
+                                on_drop=lambda message=message, contact_info=contact_info: handle_incoming_whatsapp_message(message, contact_info, deferred=True)
                             )
+                            if not queued:
+                                # Saturated: let Meta redeliver this message later
+                                await webhook_dedupe.release("whatsapp_message", message["id"])
+                                shed = True
                     
-                    # Handle message status updates
-                    if "statuses" in value:
-                        for status in value["statuses"]:
+                    # Handle message status updates (one conditional update per message, one $inc per campaign)
+                    if value.get("statuses"):
+                        new_keys = set(await webhook_dedupe.claim_many(
+                            "whatsapp_status",
+                            [f"{status.get('id')}:{status.get('status')}" for status in value["statuses"]]
+                        ))
+                        statuses = [
+                            status for status in value["statuses"]
+                            if f"{status.get('id')}:{status.get('status')}" in new_keys
+                        ]
+                        if statuses:
                             background_tasks.add_task(
-                                update_whatsapp_message_status,
-                                status
+                                update_whatsapp_message_statuses,
+                                statuses
                             )
         
+        if shed:
+            logger.warning("WhatsApp inbound queue full, asking Meta to retry")
+            return JSONResponse({"status": "busy"}, status_code=503)
         return {"status": "ok"}
     except Exception as e:
         logger.error(f"Error processing WhatsApp webhook: {e}")
         return {"status": "error"}
 
-async def handle_incoming_whatsapp_message(message: Dict, contact_info: Dict):
-    """Handle incoming WhatsApp message with AI response"""
+WHATSAPP_SYSTEM_PROMPT = """Tu es l'assistant IA d'Afroboost, une entreprise de danse et fitness.
+Tu réponds aux messages WhatsApp de manière professionnelle, amicale et énergique.
+Tu peux répondre aux questions sur les cours, les tarifs et l'inscription.
+
+Plans Afroboost:
+- Starter: Gratuit, jusqu'à 100 emails/mois
+- Pro Coach: 49 CHF/mois, jusqu'à 5000 emails/mois, IA intégrée
+- Business: 149 CHF/mois, illimité"""
+
+# Cheaper model asked in parallel when the main one is slow or failing
+WHATSAPP_HEDGE_MODEL = "gpt-4o-mini"
+
+# Sent when no model answers (provider incident, circuit open)
+WHATSAPP_FALLBACK_MESSAGE = "Merci pour votre message ! Un coach Afroboost vous répond très rapidement. 🙌"
+
+async def handle_incoming_whatsapp_message(message: Dict, contact_info: Dict, deferred: bool = False):
+    """
+    Log an incoming WhatsApp message; the AI reply is sent once the contact's burst of messages is over
+    
+    deferred only logs it as failed (job dropped at shutdown), so the next startup replies to it.
+    """
     try:
         from_phone = message.get("from")
         message_content = message.get("text", {}).get("body", "")
@@ -2969,69 +3406,163 @@ async def handle_incoming_whatsapp_message(message: Dict, contact_info: Dict):
             contact_phone=from_phone,
             direction="inbound",
             content=message_content,
-            status="received"
+            status="received",
+            provider_message_id=message_id
         )
         msg_doc = incoming_msg.model_dump()
         msg_doc['timestamp'] = msg_doc['timestamp'].isoformat()
-        await db.whatsapp_messages.insert_one(msg_doc)
-        
-        # Add to AI memory
-        await ai_memory.add_message(
-            contact_id=contact_obj.id,
-            role="user",
-            content=message_content,
-            channel="whatsapp"
-        )
+        # Keyed by wamid (logged once); reply_status tracks the reply (pending, replied, failed)
+        update = {"$setOnInsert": msg_doc}
+        if deferred:
+            update["$set"] = {"reply_status": "failed"}
+        else:
+            msg_doc["reply_status"] = "pending"
+        await db.whatsapp_messages.update_one({"provider_message_id": message_id}, update, upsert=True)
+        if deferred:
+            return
         
-        # Generate AI response
-        settings = await get_settings()
-        client = get_openai_client(settings.openai_api_key)
+        # Short messages sent in a row get a single reply
+        whatsapp_debouncer.add(from_phone, {
+            "contact": contact_obj,
+            "message_id": message_id,
+            "content": message_content
+        })
         
-        # Get conversation context
-        context = await ai_memory.get_context_for_ai(
-            contact_id=contact_obj.id,
-            contact_name=contact_obj.name,
-            campaign_context="Message WhatsApp Afroboost"
+    except Exception as e:
+        logger.error(f"Error handling incoming WhatsApp message: {e}")
+        # Meta got its 200 and will not redeliver: retried from the log at the next startup
+        await set_whatsapp_reply_status([message.get("id")], "failed")
+
+async def set_whatsapp_reply_status(message_ids: List[Optional[str]], reply_status: str):
+    """Record whether inbound messages were answered (failed ones are retried at startup)"""
+    message_ids = [message_id for message_id in message_ids if message_id]
+    if not message_ids:
+        return
+    try:
+        await db.whatsapp_messages.update_many(
+            {"provider_message_id": {"$in": message_ids}, "direction": "inbound"},
+            {"$set": {"reply_status": reply_status}}
         )
-        
-        system_prompt = f"""Tu es l'assistant IA d'Afroboost, une entreprise de danse et fitness.
-Tu réponds aux messages WhatsApp de manière professionnelle, amicale et énergique.
-Tu peux répondre aux questions sur les cours, les tarifs et l'inscription.
+    except Exception as e:
+        logger.error(f"Error marking {len(message_ids)} WhatsApp message(s) {reply_status}: {e}")
 
-Plans Afroboost:
-- Starter: Gratuit, jusqu'à 100 emails/mois
-- Pro Coach: 49 CHF/mois, jusqu'à 5000 emails/mois, IA intégrée
-- Business: 149 CHF/mois, illimité
+# Inbound messages older than this are not answered on retry (WhatsApp 24h customer service window)
+WHATSAPP_REPLY_RETRY_HOURS = 24
 
-{context}"""
-        
-        response = client.chat.completions.create(
-            model="gpt-4-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": message_content}
-            ],
-            temperature=0.7,
-            max_tokens=300
+async def retry_failed_whatsapp_replies() -> int:
+    """Queue the replies that failed or were dropped at shutdown again (call at startup)"""
+    since = (datetime.now(timezone.utc) - timedelta(hours=WHATSAPP_REPLY_RETRY_HOURS)).isoformat()
+    failed = await db.whatsapp_messages.find(
+        {"direction": "inbound", "reply_status": "failed", "timestamp": {"$gt": since}},
+        {"_id": 0}
+    ).sort("timestamp", 1).to_list(length=500)
+    
+    bursts: Dict[str, List[Dict]] = {}
+    contacts: Dict[str, Optional[Contact]] = {}
+    for doc in failed:
+        # Claimed one by one: workers starting together do not answer twice
+        claimed = await db.whatsapp_messages.update_one(
+            {"id": doc["id"], "reply_status": "failed"},
+            {"$set": {"reply_status": "pending"}}
         )
+        if not claimed.modified_count:
+            continue
+        if doc["contact_id"] not in contacts:
+            contact = await db.contacts.find_one({"id": doc["contact_id"]}, {"_id": 0})
+            contacts[doc["contact_id"]] = Contact(**contact) if contact else None
+        if contacts[doc["contact_id"]] is None:
+            continue
+        bursts.setdefault(doc["contact_phone"], []).append({
+            "contact": contacts[doc["contact_id"]],
+            "message_id": doc["provider_message_id"],
+            "content": doc["content"]
+        })
+    
+    for from_phone, messages in bursts.items():
+        queue_whatsapp_reply(from_phone, messages)
+    if bursts:
+        logger.info(f"Retrying WhatsApp replies to {len(bursts)} contact(s)")
+    return len(bursts)
+
+def queue_whatsapp_reply(from_phone: str, messages: List[Dict]):
+    """Queue the reply to a burst of messages behind the contact's other inbound work"""
+    # Forced: the messages were already accepted, only new webhooks are shed
+    whatsapp_inbound.submit(
+        from_phone,
+        lambda: reply_to_whatsapp_messages(from_phone, messages),
+        force=True,
+        on_drop=lambda: set_whatsapp_reply_status([message["message_id"] for message in messages], "failed")
+    )
+
+async def reply_to_whatsapp_messages(from_phone: str, messages: List[Dict]):
+    """Generate and send one AI response to consecutive messages of a contact"""
+    replied = False
+    try:
+        contact_obj = messages[-1]["contact"]
+        message_content = "\n".join(message["content"] for message in messages)
         
-        ai_response = response.choices[0].message.content
+        # Conversation so far (the new turns are added to memory once the reply is sent)
+        summary, history = await ai_memory.get_memory(contact_obj.id)
         
-        # Add AI response to memory
-        await ai_memory.add_message(
-            contact_id=contact_obj.id,
-            role="assistant",
-            content=ai_response,
-            channel="whatsapp"
+        # Generate AI response
+        settings = await get_settings()
+        provider = get_openai_provider(settings.openai_api_key)
+        
+        builder = PromptBuilder()
+        builder.add_section("system", WHATSAPP_SYSTEM_PROMPT, priority=0, stable=True)
+        builder.add_section(
+            "contact",
+            f"Conversation avec {contact_obj.name}\nContexte de la campagne: Message WhatsApp Afroboost",
+            priority=0
         )
+        if summary:
+            builder.add_section("summary", f"Résumé des échanges précédents:\n{summary}", priority=1, truncatable=True)
+        builder.add_history(history, priority=1)
+        prompt = builder.build(message_content)
+        logger.info(f"WhatsApp AI prompt for {contact_obj.id} ({len(messages)} message(s)): {prompt.usage()}")
         
-        # Send AI response via WhatsApp
-        whatsapp = WhatsAppService(
-            access_token=settings.whatsapp_access_token,
-            phone_number_id=settings.whatsapp_phone_number_id
-        )
+        try:
+            result = await llm_client.complete(
+                provider,
+                prompt.messages,
+                model="gpt-4-turbo",
+                endpoint="whatsapp_auto_reply",
+                temperature=0.7,
+                max_tokens=300,
+                tenant_id=contact_obj.user_id,
+                priority=PRIORITY_WHATSAPP,
+                hedge_model=WHATSAPP_HEDGE_MODEL
+            )
+            ai_response = result.content
+            generated = True
+        except Exception as e:
+            # Provider down or circuit open: acknowledge right away, a coach takes over
+            logger.error(f"AI reply failed for WhatsApp contact {contact_obj.id}: {e}")
+            ai_response = WHATSAPP_FALLBACK_MESSAGE
+            generated = False
         
-        whatsapp.send_text_message(to=from_phone, message=ai_response)
+        # Send AI response via WhatsApp
+        whatsapp = whatsapp_clients.get(settings.whatsapp_phone_number_id, settings.whatsapp_access_token)
+        
+        send_result = await whatsapp.send_text_message(to=from_phone, message=ai_response)
+        replied = True
+        await set_whatsapp_reply_status([message["message_id"] for message in messages], "replied")
+        
+        # Add the new messages, then the AI response, to AI memory
+        for message in messages:
+            await ai_memory.add_message(
+                contact_id=contact_obj.id,
+                role="user",
+                content=message["content"],
+                channel="whatsapp"
+            )
+        if generated:
+            await ai_memory.add_message(
+                contact_id=contact_obj.id,
+                role="assistant",
+                content=ai_response,
+                channel="whatsapp"
+            )
         
         # Log outgoing response
         outgoing_msg = WhatsAppMessage(
@@ -3039,43 +3570,35 @@ Plans Afroboost:
             contact_phone=from_phone,
             direction="outbound",
             content=ai_response,
-            status="sent"
+            status="sent",
+            provider_message_id=provider_message_id(send_result)
         )
         out_doc = outgoing_msg.model_dump()
         out_doc['timestamp'] = out_doc['timestamp'].isoformat()
         await db.whatsapp_messages.insert_one(out_doc)
         
-        # Mark original message as read
-        whatsapp.mark_message_read(message_id)
+        # Mark the latest message as read (earlier ones are marked with it)
+        await whatsapp.mark_message_read(messages[-1]["message_id"])
         
-        logger.info(f"AI responded to WhatsApp message from {from_phone}")
+        logger.info(f"AI responded to {len(messages)} WhatsApp message(s) from {from_phone}")
         
     except Exception as e:
-        logger.error(f"Error handling incoming WhatsApp message: {e}")
+        logger.error(f"Error replying to WhatsApp messages: {e}")
+        # Not answered: Meta will not redeliver after its 200, retried at the next startup
+        if not replied:
+            await set_whatsapp_reply_status([message["message_id"] for message in messages], "failed")
 
-async def update_whatsapp_message_status(status: Dict):
-    """Update WhatsApp message status (delivered, read, etc.)"""
+async def update_whatsapp_message_statuses(statuses: List[Dict]):
+    """Update WhatsApp message statuses (delivered, read, etc.) of one webhook payload"""
     try:
-        message_id = status.get("id")
-        new_status = status.get("status")
-        
-        # Update in database
-        await db.whatsapp_messages.update_one(
-            {"id": message_id},
-            {"$set": {"status": new_status}}
-        )
-        
-        # Update campaign stats if applicable
-        message = await db.whatsapp_messages.find_one({"id": message_id}, {"_id": 0})
-        if message and message.get("campaign_id"):
-            stat_field = f"stats.{new_status}"
-            await db.whatsapp_campaigns.update_one(
-                {"id": message["campaign_id"]},
-                {"$inc": {stat_field: 1}}
-            )
-        
+        result = await whatsapp_status.ingest(statuses)
+        if result["campaigns"]:
+            analytics_digest.mark_dirty(None, "campaigns")
     except Exception as e:
-        logger.error(f"Error updating WhatsApp message status: {e}")
+        logger.error(f"Error updating WhatsApp message statuses: {e}")
+        # A duplicate delivery of these statuses is applied (updates are conditional, replays are harmless)
+        for status in statuses:
+            await webhook_dedupe.release("whatsapp_status", f"{status.get('id')}:{status.get('status')}")
 
 
 # ========================
@@ -3083,13 +3606,18 @@ async def update_whatsapp_message_status(status: Dict):
 # ========================
 
 @api_router.post("/ai/conversation", response_model=AIConversationResponse)
-async def ai_conversation(request: AIConversationRequest):
+async def ai_conversation(
+    request: AIConversationRequest,
+    http_request: Request,
+    current_user: Optional[Dict] = Depends(get_optional_user)
+):
     """AI conversational response with memory"""
     try:
         settings = await get_settings()
-        client = get_openai_client(settings.openai_api_key)
+        provider = get_openai_provider(settings.openai_api_key)
         
-        # Add user message to memory
+        # Conversation so far, then add user message to memory
+        summary, history = await ai_memory.get_memory(request.contact_id)
         await ai_memory.add_message(
             contact_id=request.contact_id,
             role="user",
@@ -3105,22 +3633,32 @@ async def ai_conversation(request: AIConversationRequest):
         
         system_prompt = f"""Tu es l'assistant IA d'Afroboost, une entreprise de danse et fitness.
 Tu réponds aux messages de manière professionnelle, amicale et énergique en {request.language}.
-
-Contexte de la conversation:
-{context}
-
 Réponds de manière naturelle et personnalisée."""
+        
+        contact_context = f"Conversation avec {request.contact_name}"
+        if request.campaign_context:
+            contact_context += f"\nContexte de la campagne: {request.campaign_context}"
+        
+        builder = PromptBuilder()
+        builder.add_section("system", system_prompt, priority=0, stable=True)
+        builder.add_section("contact", contact_context, priority=0)
+        if summary:
+            builder.add_section("summary", f"Résumé des échanges précédents:\n{summary}", priority=1, truncatable=True)
+        builder.add_history(history, priority=1)
+        prompt = builder.build(request.message)
+        logger.info(f"AI conversation prompt for {request.contact_id}: {prompt.usage()}")
 
         # Generate AI response
-        response = client.chat.completions.create(
+        result = await llm_client.complete(
+            provider,
+            prompt.messages,
             model="gpt-4",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": request.message}
-            ]
+            endpoint="ai_conversation",
+            tenant_id=llm_tenant_id(current_user, http_request),
+            priority=PRIORITY_WHATSAPP
         )
         
-        ai_response = response.choices[0].message.content
+        ai_response = result.content
         
         # Add AI response to memory
         await ai_memory.add_message(
@@ -3131,7 +3669,8 @@ Réponds de manière naturelle et personnalisée."""
         
         return AIConversationResponse(
             response=ai_response,
-            context_used=context
+            context_used=context,
+            prompt_tokens=prompt.prompt_tokens
         )
         
     except Exception as e:
@@ -3166,6 +3705,7 @@ async def create_message_template(
     current_user: Dict = Depends(get_current_user)
 ):
     """Create a new message template"""
+    check_template(template_data.content, declared_template_variables(template_data.variables))
     template = MessageTemplate(
         user_id=current_user["id"],
         **template_data.model_dump(),
@@ -3188,6 +3728,8 @@ async def update_message_template(
 ):
     """Update a message template"""
     update_data = {k: v for k, v in template_data.model_dump().items() if v is not None}
+    if "content" in update_data:
+        check_template(update_data["content"], declared_template_variables(update_data.get("variables") or []))
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
     if "media_url" in update_data:
@@ -3251,6 +3793,9 @@ async def create_advanced_campaign(
     current_user: Dict = Depends(get_current_user)
 ):
     """Create a new advanced WhatsApp campaign"""
+    if campaign_data.use_personalization:
+        check_template(campaign_data.message_content, campaign_data.variables)
+    
     # Parse scheduled_at if provided
     scheduled_at = None
     if campaign_data.scheduled_at:
@@ -3274,6 +3819,7 @@ async def create_advanced_campaign(
         target_tags=campaign_data.target_tags,
         target_status=campaign_data.target_status,
         use_personalization=campaign_data.use_personalization,
+        variables=campaign_data.variables,
         scheduled_at=scheduled_at,
         payment_links=campaign_data.payment_links
     )
@@ -3288,13 +3834,33 @@ async def create_advanced_campaign(
     
     return campaign
 
+def advanced_campaign_query(campaign: Dict) -> Dict:
+    """Contacts targeted by an advanced campaign"""
+    query = {"user_id": campaign["user_id"]}  # CRITICAL: Only user's own contacts
+    
+    if campaign.get("target_contacts"):
+        query["id"] = {"$in": campaign["target_contacts"]}
+    if campaign.get("target_tags"):
+        query["tags"] = {"$in": campaign["target_tags"]}
+    if campaign.get("target_status"):
+        query["status"] = campaign["target_status"]
+    return query
+
 @api_router.post("/whatsapp/advanced-campaigns/{campaign_id}/send")
 async def send_advanced_campaign(
     campaign_id: str,
     background_tasks: BackgroundTasks,
+    dry_run: bool = False,
+    force: bool = False,
     current_user: Dict = Depends(get_current_user)
 ):
-    """Send an advanced WhatsApp campaign (SIMULATION MODE)"""
+    """
+    Send an advanced WhatsApp campaign in the background.
+    
+    Contacts who already received the campaign are skipped, so a failed or
+    interrupted send can be resumed; force=true sends to everyone again.
+    dry_run=true simulates the send.
+    """
     campaign = await db.advanced_whatsapp_campaigns.find_one(
         {"id": campaign_id, "user_id": current_user["id"]},
         {"_id": 0}
@@ -3303,67 +3869,174 @@ async def send_advanced_campaign(
     if not campaign:
         raise HTTPException(status_code=404, detail="Campaign not found")
     
-    # Get target contacts - FILTERED BY USER_ID
-    query = {"user_id": current_user["id"]}  # CRITICAL: Only user's own contacts
-    
-    if campaign.get("target_contacts"):
-        query["id"] = {"$in": campaign["target_contacts"]}
-    if campaign.get("target_tags"):
-        query["tags"] = {"$in": campaign["target_tags"]}
-    if campaign.get("target_status"):
-        query["status"] = campaign["target_status"]
+    if not dry_run:
+        settings = await get_settings()
+        if not settings.whatsapp_access_token or not settings.whatsapp_phone_number_id:
+            raise HTTPException(
+                status_code=400,
+                detail="WhatsApp credentials not configured (use dry_run=true to simulate the send)"
+            )
     
+    # Get target contacts - FILTERED BY USER_ID
+    query = advanced_campaign_query(campaign)
     logger.info(f"WhatsApp campaign query: {query}")
-    contacts = await db.contacts.find(query, {"_id": 0}).to_list(length=None)
+    contacts_targeted = await db.contacts.count_documents(query)
     
-    logger.info(f"Found {len(contacts)} contacts for WhatsApp campaign")
+    logger.info(f"Found {contacts_targeted} contacts for WhatsApp campaign")
     
-    if not contacts:
+    if not contacts_targeted:
         raise HTTPException(status_code=400, detail="No contacts match the targeting criteria")
     
-    # SIMULATION MODE - Just log and update stats
-    logger.info(f"[SIMULATION] Sending campaign {campaign_id} to {len(contacts)} contacts")
-    
-    # Update campaign status
-    await db.advanced_whatsapp_campaigns.update_one(
+    # Lease the campaign so a double click, or another worker, does not send it twice
+    claimed = await campaign_lease.acquire(
         {"id": campaign_id},
         {
-            "$set": {
-                "status": "sent",
-                "sent_at": datetime.now(timezone.utc).isoformat(),
-                "stats.sent": len(contacts),
-                "stats.delivered": len(contacts),  # Simulate all delivered
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }
+            "status": "sending",
+            "dry_run": dry_run,
+            "updated_at": datetime.now(timezone.utc).isoformat()
         }
     )
+    if not claimed:
+        raise HTTPException(status_code=409, detail="Campaign is already being sent")
     
-    # Create analytics records (simulation)
-    for contact in contacts:
+    background_tasks.add_task(send_advanced_campaign_background, campaign_id, dry_run, force)
+    
+    return {
+        "message": "Campaign simulation started (DRY RUN)" if dry_run else "Campaign sending started",
+        "contacts_targeted": contacts_targeted,
+        "status": "sending",
+        "dry_run": dry_run,
+        "force": force
+    }
+
+async def send_advanced_campaign_background(campaign_id: str, dry_run: bool = False, force: bool = False):
+    """Send a leased advanced campaign, renewing the lease until the send ends"""
+    try:
+        async with campaign_lease.keep(campaign_id):
+            await run_advanced_campaign_send(campaign_id, dry_run, force)
+    except Exception as e:
+        logger.error(f"Error sending advanced WhatsApp campaign {campaign_id}: {e}")
+        await campaign_lease.release(
+            campaign_id,
+            {"status": "failed", "updated_at": datetime.now(timezone.utc).isoformat()}
+        )
+
+async def run_advanced_campaign_send(campaign_id: str, dry_run: bool, force: bool):
+    """Stream the targeted contacts and send them the campaign message, built once"""
+    campaign = await db.advanced_whatsapp_campaigns.find_one({"id": campaign_id}, {"_id": 0})
+    
+    # Contacts the campaign really reached (a wamid) in earlier sends, skipped on a resend
+    already_sent = set()
+    if not force:
+        async for row in db.campaign_analytics.find(
+            {"campaign_id": campaign_id, "sent": True, "provider_message_id": {"$ne": None}},
+            {"_id": 0, "contact_id": 1}
+        ):
+            already_sent.add(row["contact_id"])
+        if already_sent:
+            logger.info(f"WhatsApp campaign {campaign_id}: skipping {len(already_sent)} contact(s) already sent")
+    
+    whatsapp = None
+    if not dry_run:
+        settings = await get_settings()
+        whatsapp = whatsapp_clients.get(settings.whatsapp_phone_number_id, settings.whatsapp_access_token)
+    
+    # Media uploaded once and sent by ID, rather than fetched by Meta for every message
+    media_url = campaign.get("media_url") if campaign.get("has_media") else None
+    media_id = None
+    if media_url and not dry_run:
+        try:
+            media_id = await whatsapp_media.media_id(whatsapp, media_url, campaign.get("media_type"))
+        except Exception as e:
+            logger.error(f"Error uploading media of WhatsApp campaign {campaign_id}, sending the link: {e}")
+    
+    # Same buttons / list / media for every recipient
+    payload = campaign_payload(
+        campaign["message_content"],
+        buttons=campaign.get("buttons"),
+        list_sections=campaign.get("list_sections"),
+        media_url=media_url,
+        media_type=campaign.get("media_type"),
+        payment_links=campaign.get("payment_links"),
+        media_id=media_id
+    )
+    
+    # Personalized text: merge tags compiled once, rendered per contact
+    text_template = None
+    if campaign.get("use_personalization"):
+        variables = campaign.get("variables") or {}
+        text_template = compile_template(
+            payload_text(payload),
+            allowed=[*CONTACT_TEMPLATE_VARIABLES, *variables],
+            defaults=variables
+        )
+    
+    no_phone = []
+    
+    async def recipients():
+        projection = {"_id": 0, "id": 1, "phone": 1, "tags": 1}
+        if text_template:
+            projection.update({field: 1 for field in CONTACT_TEMPLATE_FIELDS})
+        async for contact in db.contacts.find(advanced_campaign_query(campaign), projection):
+            if contact["id"] in already_sent:
+                continue
+            phone = contact_phone(contact)
+            if not phone:
+                no_phone.append(contact["id"])
+                continue
+            if text_template:
+                yield contact["id"], phone, with_text(payload, text_template.render(contact_template_values(contact)))
+            else:
+                yield contact["id"], phone
+    
+    def build_log(contact_id: str, phone: str, status: str, error_message: Optional[str],
+                  provider_message_id: Optional[str]) -> Dict:
+        now = datetime.now(timezone.utc)
+        sent = status == "sent"
         analytics = CampaignAnalytics(
             campaign_id=campaign_id,
-            contact_id=contact["id"],
-            contact_phone=contact.get("phone_number", "Unknown"),
-            sent=True,
-            delivered=True,  # Simulate delivery
-            sent_at=datetime.now(timezone.utc),
-            delivered_at=datetime.now(timezone.utc)
+            contact_id=contact_id,
+            contact_phone=phone,
+            sent=sent,
+            delivered=sent and dry_run,  # Simulate delivery
+            failed=not sent,
+            status=("delivered" if dry_run else "sent") if sent else "failed",
+            error_message=error_message,
+            provider_message_id=provider_message_id,
+            sent_at=now if sent else None,
+            delivered_at=now if sent and dry_run else None
         )
-        
         analytics_dict = analytics.model_dump()
         analytics_dict["created_at"] = analytics_dict["created_at"].isoformat()
         if analytics_dict.get("sent_at"):
             analytics_dict["sent_at"] = analytics_dict["sent_at"].isoformat()
         if analytics_dict.get("delivered_at"):
             analytics_dict["delivered_at"] = analytics_dict["delivered_at"].isoformat()
-        
-        await db.campaign_analytics.insert_one(analytics_dict)
+        return analytics_dict
+    
+    await whatsapp_sender.send_campaign(
+        whatsapp,
+        campaign_id,
+        recipients(),
+        payload,
+        build_log,
+        log_collection="campaign_analytics",
+        campaign_collection="advanced_whatsapp_campaigns",
+        dry_run=dry_run
+    )
+    if no_phone:
+        logger.warning(f"No phone number for {len(no_phone)} contact(s) of WhatsApp campaign {campaign_id}")
     
-    return {
-        "message": "Campaign sent successfully (SIMULATION MODE)",
-        "contacts_targeted": len(contacts),
-        "status": "sent"
-    }
+    # The sender (and status webhooks) already counted sent / failed / delivered into stats
+    await campaign_lease.release(
+        campaign_id,
+        {
+            "status": "sent",
+            "sent_at": datetime.now(timezone.utc).isoformat(),
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        },
+        increments={"stats.failed": len(no_phone)} if no_phone else None
+    )
 
 @api_router.get("/whatsapp/campaigns/{campaign_id}/analytics")
 async def get_campaign_analytics(
@@ -3390,6 +4063,7 @@ async def get_campaign_analytics(
     summary = {
         "total": len(analytics),
         "sent": sum(1 for a in analytics if a.get("sent")),
+        "failed": sum(1 for a in analytics if a.get("failed")),
         "delivered": sum(1 for a in analytics if a.get("delivered")),
         "read": sum(1 for a in analytics if a.get("read")),
         "replied": sum(1 for a in analytics if a.get("replied")),
@@ -3466,6 +4140,110 @@ async def clear_conversation_history(contact_id: str):
 # ROUTES - AI ASSISTANT (GLOBAL)
 # ========================
 
+ASSISTANT_MODEL = "gpt-4o-mini"  # Cost-effective default
+
+ASSISTANT_SYSTEM_MESSAGES = {
+    "general": """Tu es l'Assistant IA d'Afroboost, une plateforme de marketing intelligente.
+Tu aides les utilisateurs à gérer leurs campagnes, contacts, et stratégies marketing.
+Sois professionnel, amical et concis. Réponds en français.""",
+    
+    "campaign": """Tu es un expert en création de campagnes marketing.
+Aide l'utilisateur à créer du contenu engageant pour emails et WhatsApp.
+Propose des structures, des accroches, et des appels à l'action efficaces.
+Adapte le ton selon le public cible.""",
+    
+    "analysis": """Tu es un analyste de données marketing.
+Aide l'utilisateur à comprendre ses statistiques et à en tirer des insights actionnables.
+Propose des recommandations concrètes basées sur les données.""",
+    
+    "strategy": """Tu es un stratège marketing.
+Aide l'utilisateur à planifier ses campagnes, définir ses objectifs, et optimiser son approche.
+Pose des questions pertinentes et guide vers les meilleures pratiques."""
+}
+
+ASSISTANT_SUGGESTIONS = {
+    "campaign": [
+        "Créer une campagne email",
+        "Générer du contenu WhatsApp",
+        "Optimiser mon message"
+    ],
+    "analysis": [
+        "Analyser mes statistiques",
+        "Comparer mes campagnes",
+        "Identifier les opportunités"
+    ],
+    "strategy": [
+        "Planifier ma prochaine campagne",
+        "Définir mes objectifs",
+        "Améliorer mon ROI"
+    ],
+    "general": [
+        "Comment créer une campagne ?",
+        "Analyser mes résultats",
+        "Conseils marketing"
+    ]
+}
+
+# Task types that get the user's analytics digest in their prompt
+ASSISTANT_DIGEST_TASK_TYPES = {"analysis", "strategy"}
+
+async def build_assistant_system_message(request: AIAssistantRequest, user_id: str) -> str:
+    """Build the AI Assistant system message for the request task type and context"""
+    system_message = ASSISTANT_SYSTEM_MESSAGES.get(request.task_type, ASSISTANT_SYSTEM_MESSAGES["general"])
+
+    # Actual figures for analysis/strategy, from the cached analytics digest
+    if request.task_type in ASSISTANT_DIGEST_TASK_TYPES:
+        try:
+            digest_text = AnalyticsDigestService.format_digest(await analytics_digest.get_digest(user_id))
+            if digest_text:
+                system_message += f"\n\n{digest_text}"
+        except Exception as e:
+            logger.error(f"Error building analytics digest: {e}")
+    
+    # Add context to system message if provided
+    if request.context:
+        context_str = "\n\nContexte actuel:\n"
+        for key, value in request.context.items():
+            context_str += f"- {key}: {value}\n"
+        system_message += context_str
+    
+    return system_message
+
+async def save_assistant_exchange(user_id: str, session_id: str, request: AIAssistantRequest, response_text: str):
+    """Persist the user message and the assistant response of one AI Assistant exchange"""
+    # Save user message to database
+    user_msg = AIAssistantMessage(
+        user_id=user_id,
+        session_id=session_id,
+        role="user",
+        content=request.message,
+        context=request.context or {}
+    )
+    user_msg_dict = user_msg.model_dump()
+    user_msg_dict["created_at"] = user_msg_dict["created_at"].isoformat()
+    
+    # Save assistant response to database
+    assistant_msg = AIAssistantMessage(
+        user_id=user_id,
+        session_id=session_id,
+        role="assistant",
+        content=response_text,
+        context=request.context or {}
+    )
+    assistant_msg_dict = assistant_msg.model_dump()
+    assistant_msg_dict["created_at"] = assistant_msg_dict["created_at"].isoformat()
+    
+    await db.ai_assistant_messages.insert_many([user_msg_dict, assistant_msg_dict])
+
+def sse_event(event: str, data: Dict) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"  # Disable proxy buffering so tokens reach the client immediately
+}
+
 @api_router.post("/ai/assistant/chat", response_model=AIAssistantResponse)
 async def ai_assistant_chat(
     request: AIAssistantRequest,
@@ -3479,107 +4257,31 @@ async def ai_assistant_chat(
         
         # Get EMERGENT_LLM_KEY
         api_key = os.environ.get('EMERGENT_LLM_KEY')
-        if not api_key:
+        if not api_key and not llm_stub_enabled():
             raise HTTPException(status_code=500, detail="AI service not configured")
         
         # Build system message based on task type
-        system_messages = {
-            "general": """Tu es l'Assistant IA d'Afroboost, une plateforme de marketing intelligente.
-Tu aides les utilisateurs à gérer leurs campagnes, contacts, et stratégies marketing.
-Sois professionnel, amical et concis. Réponds en français.""",
-            
-            "campaign": """Tu es un expert en création de campagnes marketing.
-Aide l'utilisateur à créer du contenu engageant pour emails et WhatsApp.
-Propose des structures, des accroches, et des appels à l'action efficaces.
-Adapte le ton selon le public cible.""",
-            
-            "analysis": """Tu es un analyste de données marketing.
-Aide l'utilisateur à comprendre ses statistiques et à en tirer des insights actionnables.
-Propose des recommandations concrètes basées sur les données.""",
-            
-            "strategy": """Tu es un stratège marketing.
-Aide l'utilisateur à planifier ses campagnes, définir ses objectifs, et optimiser son approche.
-Pose des questions pertinentes et guide vers les meilleures pratiques."""
-        }
-        
-        system_message = system_messages.get(request.task_type, system_messages["general"])
-        
-        # Add context to system message if provided
-        if request.context:
-            context_str = "\n\nContexte actuel:\n"
-            for key, value in request.context.items():
-                context_str += f"- {key}: {value}\n"
-            system_message += context_str
+        system_message = await build_assistant_system_message(request, user_id)
         
-        # Initialize LlmChat with emergentintegrations
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=session_id,
-            system_message=system_message
-        ).with_model("openai", "gpt-4o-mini")  # Using gpt-4o-mini as default (cost-effective)
-        
-        # Get conversation history from database
-        history = await db.ai_assistant_messages.find(
-            {"user_id": user_id, "session_id": session_id},
-            {"_id": 0}
-        ).sort("created_at", 1).limit(20).to_list(length=20)
-        
-        # Create user message
-        user_message = UserMessage(text=request.message)
-        
-        # Send message and get response
-        response_text = await chat.send_message(user_message)
-        
-        # Save user message to database
-        user_msg = AIAssistantMessage(
-            user_id=user_id,
+        # Send message through emergentintegrations (keeps the session history) and get response
+        result = await llm_client.complete(
+            get_llm_provider("emergent", api_key),
+            [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": request.message}
+            ],
+            model=ASSISTANT_MODEL,
+            endpoint="ai_assistant",
             session_id=session_id,
-            role="user",
-            content=request.message,
-            context=request.context or {}
+            tenant_id=user_id,
+            priority=PRIORITY_INTERACTIVE
         )
-        user_msg_dict = user_msg.model_dump()
-        user_msg_dict["created_at"] = user_msg_dict["created_at"].isoformat()
-        await db.ai_assistant_messages.insert_one(user_msg_dict)
+        response_text = result.content
         
-        # Save assistant response to database
-        assistant_msg = AIAssistantMessage(
-            user_id=user_id,
-            session_id=session_id,
-            role="assistant",
-            content=response_text,
-            context=request.context or {}
-        )
-        assistant_msg_dict = assistant_msg.model_dump()
-        assistant_msg_dict["created_at"] = assistant_msg_dict["created_at"].isoformat()
-        await db.ai_assistant_messages.insert_one(assistant_msg_dict)
+        await save_assistant_exchange(user_id, session_id, request, response_text)
         
         # Generate suggestions based on task type
-        suggestions = []
-        if request.task_type == "campaign":
-            suggestions = [
-                "Créer une campagne email",
-                "Générer du contenu WhatsApp",
-                "Optimiser mon message"
-            ]
-        elif request.task_type == "analysis":
-            suggestions = [
-                "Analyser mes statistiques",
-                "Comparer mes campagnes",
-                "Identifier les opportunités"
-            ]
-        elif request.task_type == "strategy":
-            suggestions = [
-                "Planifier ma prochaine campagne",
-                "Définir mes objectifs",
-                "Améliorer mon ROI"
-            ]
-        else:
-            suggestions = [
-                "Comment créer une campagne ?",
-                "Analyser mes résultats",
-                "Conseils marketing"
-            ]
+        suggestions = ASSISTANT_SUGGESTIONS.get(request.task_type, ASSISTANT_SUGGESTIONS["general"])
         
         return AIAssistantResponse(
             response=response_text,
@@ -3592,6 +4294,79 @@ Pose des questions pertinentes et guide vers les meilleures pratiques."""
         logger.error(f"Error in AI Assistant: {str(e)}")
         raise HTTPException(status_code=500, detail=f"AI Assistant error: {str(e)}")
 
+@api_router.post("/ai/assistant/chat/stream")
+async def ai_assistant_chat_stream(
+    request: AIAssistantRequest,
+    current_user: Dict = Depends(get_current_user)
+):
+    """
+    AI Assistant chat streamed as server-sent events.
+    
+    Emits `token` events as the completion is generated, then one `done` event
+    with the same payload as /ai/assistant/chat once the exchange is persisted.
+    """
+    session_id = request.session_id or str(uuid.uuid4())
+    user_id = current_user["id"]
+    
+    settings = await get_settings()
+    emergent_key = os.environ.get('EMERGENT_LLM_KEY')
+    if not settings.openai_api_key and not emergent_key and not llm_stub_enabled():
+        raise HTTPException(status_code=500, detail="AI service not configured")
+    
+    system_message = await build_assistant_system_message(request, user_id)
+    
+    if settings.openai_api_key or not emergent_key:
+        provider = get_llm_provider("openai", settings.openai_api_key)
+        
+        # Session history (the emergent LlmChat keeps it server-side, here we send it explicitly)
+        history = await db.ai_assistant_messages.find(
+            {"user_id": user_id, "session_id": session_id},
+            {"_id": 0, "role": 1, "content": 1}
+        ).sort("created_at", -1).limit(20).to_list(length=20)
+        
+        messages = [{"role": "system", "content": system_message}]
+        messages.extend({"role": m["role"], "content": m["content"]} for m in reversed(history))
+        messages.append({"role": "user", "content": request.message})
+    else:
+        # Only EMERGENT_LLM_KEY configured (as /ai/assistant/chat): it cannot
+        # stream, the whole completion comes as one token event
+        provider = get_llm_provider("emergent", emergent_key)
+        messages = [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": request.message}
+        ]
+    
+    async def event_stream():
+        chunks = []
+        try:
+            async for delta in llm_client.stream(
+                provider,
+                messages,
+                model=ASSISTANT_MODEL,
+                endpoint="ai_assistant",
+                session_id=session_id,
+                tenant_id=user_id,
+                priority=PRIORITY_INTERACTIVE
+            ):
+                chunks.append(delta)
+                yield sse_event("token", {"content": delta})
+        except Exception as e:
+            logger.error(f"Error in AI Assistant stream: {str(e)}")
+            yield sse_event("error", {"detail": f"AI Assistant error: {str(e)}"})
+            return
+        
+        response_text = "".join(chunks)
+        await save_assistant_exchange(user_id, session_id, request, response_text)
+        
+        yield sse_event("done", AIAssistantResponse(
+            response=response_text,
+            session_id=session_id,
+            suggestions=ASSISTANT_SUGGESTIONS.get(request.task_type, ASSISTANT_SUGGESTIONS["general"]),
+            context=request.context or {}
+        ).model_dump())
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @api_router.get("/ai/assistant/sessions")
 async def get_ai_assistant_sessions(current_user: Dict = Depends(get_current_user)):
     """Get all AI Assistant sessions for current user"""
@@ -3999,6 +4774,7 @@ async def create_catalog_item(
         item_dict["event_date"] = item_dict["event_date"].isoformat()
     
     await db.catalog_items.insert_one(item_dict)
+    invalidate_chat_ai_context(current_user["id"])
     
     return {"message": "Catalog item created", "id": item.id, "slug": slug}
 
@@ -4067,6 +4843,7 @@ async def update_catalog_item(
         {"id": item_id},
         {"$set": update_dict}
     )
+    invalidate_chat_ai_context(current_user["id"])
     
     return {"message": "Item updated successfully"}
 
@@ -4085,6 +4862,9 @@ async def delete_catalog_item(
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Item not found or unauthorized")
     
+    # Admins may delete another coach's item, so drop every tenant's context
+    invalidate_chat_ai_context(None if current_user["role"] == "admin" else current_user["id"])
+    
     logger.info(f"Catalog item deleted: {item_id} by user {current_user['email']}")
     return {"message": "Item deleted successfully"}
 
@@ -4267,6 +5047,7 @@ async def create_reservation(reservation_data: ReservationCreate):
     res_dict["updated_at"] = res_dict["updated_at"].isoformat()
     
     await db.reservations.insert_one(res_dict)
+    analytics_digest.mark_dirty(item["user_id"], "reservations", "top_items")
     
     # Update item availability
     if item.get("max_attendees"):
@@ -4281,6 +5062,9 @@ async def create_reservation(reservation_data: ReservationCreate):
             {"$inc": {"stock_quantity": -reservation_data.quantity}}
         )
     
+    if item.get("max_attendees") or item.get("stock_quantity") is not None:
+        invalidate_chat_ai_context(item.get("user_id"))
+    
     # Send confirmation email
     try:
         await send_reservation_confirmation_email(
@@ -4347,6 +5131,7 @@ async def update_reservation_status(
         {"id": reservation_id, "user_id": current_user["id"]},
         {"$set": update_data}
     )
+    analytics_digest.mark_dirty(current_user["id"], "reservations", "top_items")
     
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Reservation not found")
@@ -4657,6 +5442,8 @@ async def create_reminder(
     current_user: Dict = Depends(get_current_user)
 ):
     """Create a new reminder"""
+    if reminder_data.message_template:
+        check_template(reminder_data.message_template, reminder_data.message_variables)
     scheduled_at = datetime.fromisoformat(reminder_data.scheduled_at)
     
     reminder = Reminder(
@@ -4811,6 +5598,7 @@ async def create_reminder_template(
     current_user: Dict = Depends(get_current_user)
 ):
     """Create reminder template"""
+    check_template(template_data.message_content, declared_template_variables(template_data.variables))
     template = ReminderTemplate(
         user_id=current_user["id"],
         **template_data.model_dump()
@@ -4846,17 +5634,26 @@ async def process_due_reminders(current_user: Dict = Depends(get_current_user)):
                     "id": {"$in": reminder_dict["target_contacts"]}
                 }, {"_id": 0}).to_list(length=None)
             
+            # Message compiled once per reminder, rendered per contact
+            variables = reminder_dict.get("message_variables") or {}
+            message_template = compile_template(
+                reminder_dict.get("message_template") or reminder_dict["title"],
+                allowed=[*CONTACT_TEMPLATE_VARIABLES, *variables] if reminder_dict.get("message_template") else None,
+                defaults=variables
+            )
+            messages = {contact["id"]: message_template.render(contact_template_values(contact)) for contact in contacts}
+            
             # Send via selected channels
             for channel in reminder_dict.get("channels", ["email"]):
                 if channel == "email":
                     # Send emails (simulation)
                     for contact in contacts:
-                        logger.info(f"[SIMULATION] Sending email reminder to {contact['email']}")
+                        logger.info(f"[SIMULATION] Sending email reminder to {contact['email']}: {messages[contact['id']]}")
                 
                 elif channel == "whatsapp":
                     # Send WhatsApp (simulation)
                     for contact in contacts:
-                        logger.info(f"[SIMULATION] Sending WhatsApp reminder to {contact.get('phone', 'N/A')}")
+                        logger.info(f"[SIMULATION] Sending WhatsApp reminder to {contact.get('phone', 'N/A')}: {messages[contact['id']]}")
             
             # Update reminder status
             await db.reminders.update_one(
@@ -5078,6 +5875,7 @@ async def create_discount(
         discount_dict['end_date'] = discount_dict['end_date'].isoformat()
         
         await db.discounts.insert_one(discount_dict)
+        invalidate_chat_ai_context(current_user["id"])
         
         logger.info(f"Discount created: {new_discount.code}")
         return new_discount
@@ -5143,6 +5941,9 @@ async def update_discount(
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Discount not found")
         
+        # Discounts are not owner-scoped here, so drop every tenant's context
+        invalidate_chat_ai_context()
+        
         # Return updated discount
         updated_discount = await db.discounts.find_one({"id": discount_id}, {"_id": 0})
         return updated_discount
@@ -5162,6 +5963,7 @@ async def delete_discount(
         result = await db.discounts.delete_one({"id": discount_id})
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Discount not found")
+        invalidate_chat_ai_context()
         return {"message": "Discount deleted successfully"}
     except HTTPException:
         raise
@@ -5494,6 +6296,77 @@ async def send_ad_chat_message(
         logger.error(f"Error sending message: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/ad-chat/{chat_id}/message/stream")
+async def send_ad_chat_message_stream(
+    chat_id: str,
+    message: AdChatMessageCreate
+):
+    """
+    Send a message in an ad chat and stream the AI auto-response as server-sent events.
+    
+    The incoming message is stored right away, `token` events follow while the AI
+    answers, and the agent message is persisted before the final `done` event.
+    """
+    chat = await db.ad_chats.find_one({"id": chat_id}, {"_id": 0})
+    if not chat:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    
+    new_message = AdChatMessage(
+        sender=message.sender,
+        content=message.content
+    )
+    message_dict = new_message.dict()
+    message_dict['timestamp'] = message_dict['timestamp'].isoformat()
+    
+    await db.ad_chats.update_one(
+        {"id": chat_id},
+        {
+            "$push": {"messages": message_dict},
+            "$set": {"last_message_at": datetime.now(timezone.utc).isoformat()}
+        }
+    )
+    
+    auto_respond = message.sender == "visitor" and chat_ai and chat.get('status') != 'archived'
+    
+    async def event_stream():
+        yield sse_event("message", message_dict)
+        
+        if auto_respond:
+            try:
+                async for event in chat_ai.stream_response(
+                    message=message.content,
+                    visitor_email=chat.get('visitor_email'),
+                    chat_id=chat_id
+                ):
+                    if event["type"] == "token":
+                        yield sse_event("token", {"content": event["content"]})
+                        continue
+                    
+                    ai_message = AdChatMessage(
+                        sender="agent",
+                        content=event["response"]
+                    )
+                    ai_message_dict = ai_message.dict()
+                    ai_message_dict['timestamp'] = ai_message_dict['timestamp'].isoformat()
+                    
+                    update = {
+                        "$push": {"messages": ai_message_dict},
+                        "$set": {"last_message_at": datetime.now(timezone.utc).isoformat()}
+                    }
+                    # Update priority if needs human
+                    if event.get("needs_human_escalation"):
+                        update["$set"]["priority"] = "urgent"
+                    await db.ad_chats.update_one({"id": chat_id}, update)
+                    
+                    yield sse_event("message", ai_message_dict)
+            except Exception as e:
+                logger.error(f"AI auto-response stream error: {e}")
+                yield sse_event("error", {"detail": str(e)})
+        
+        yield sse_event("done", {"chat_id": chat_id})
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @api_router.get("/ad-chat", response_model=List[AdChat])
 async def get_ad_chats(
     status: Optional[str] = None,
@@ -5908,6 +6781,7 @@ async def get_payment_status(session_id: str):
                     res_dict["updated_at"] = res_dict["updated_at"].isoformat()
                     
                     await db.reservations.insert_one(res_dict)
+                    analytics_digest.mark_dirty(metadata["user_id"], "reservations", "top_items")
                     
                     # Update availability
                     if item.get("max_attendees"):
@@ -5922,6 +6796,9 @@ async def get_payment_status(session_id: str):
                             {"$inc": {"stock_quantity": -int(metadata["quantity"])}}
                         )
                     
+                    if item.get("max_attendees") or item.get("stock_quantity") is not None:
+                        invalidate_chat_ai_context(item.get("user_id"))
+                    
                     # Send confirmation email
                     try:
                         await send_reservation_confirmation_email(
@@ -5969,17 +6846,27 @@ async def stripe_webhook(request: Request):
         
         logger.info(f"Stripe webhook received: {webhook_response.event_type}")
         
+        # Stripe retries until acknowledged: an event already processed is acknowledged again
+        event_id = getattr(webhook_response, "event_id", None)
+        if event_id and not await webhook_dedupe.claim("stripe", event_id):
+            return JSONResponse({"status": "success", "duplicate": True})
+        
         # Update transaction based on webhook
         if webhook_response.session_id:
-            await db.payment_transactions.update_one(
-                {"session_id": webhook_response.session_id},
-                {
-                    "$set": {
-                        "payment_status": webhook_response.payment_status,
-                        "updated_at": datetime.now(timezone.utc).isoformat()
+            try:
+                await db.payment_transactions.update_one(
+                    {"session_id": webhook_response.session_id},
+                    {
+                        "$set": {
+                            "payment_status": webhook_response.payment_status,
+                            "updated_at": datetime.now(timezone.utc).isoformat()
+                        }
                     }
-                }
-            )
+                )
+            except Exception:
+                if event_id:
+                    await webhook_dedupe.release("stripe", event_id)
+                raise
         
         return JSONResponse({"status": "success"})
     
@@ -6218,6 +7105,58 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def startup_services():
+    try:
+        await ai_response_cache.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Error creating AI response cache indexes: {e}")
+    try:
+        await llm_metrics.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Error creating LLM usage indexes: {e}")
+    try:
+        await webhook_dedupe.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Error creating webhook dedupe indexes: {e}")
+    try:
+        await whatsapp_status.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Error creating WhatsApp message indexes: {e}")
+    try:
+        await whatsapp_media.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Error creating WhatsApp media indexes: {e}")
+    try:
+        await db.ai_batch_jobs.create_index("id", unique=True)
+        await ai_batch.resume_interrupted()
+    except Exception as e:
+        logger.error(f"Error resuming AI batch jobs: {e}")
+    try:
+        # Sends whose process died (lease expired, or from before leases); the
+        # rows already sent are in campaign_analytics and skipped on a resend.
+        # Sends another worker is running keep their live lease.
+        await db.advanced_whatsapp_campaigns.update_many(
+            {"$and": [{"status": "sending"}, JobLease.expired()]},
+            {"$set": {
+                "status": "failed",
+                "lease_owner": None,
+                "updated_at": datetime.now(timezone.utc).isoformat()
+            }}
+        )
+    except Exception as e:
+        logger.error(f"Error resetting interrupted WhatsApp campaigns: {e}")
+    try:
+        await retry_failed_whatsapp_replies()
+    except Exception as e:
+        logger.error(f"Error retrying failed WhatsApp replies: {e}")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await whatsapp_debouncer.stop()
+    await whatsapp_inbound.stop()
+    await ai_batch.stop()
+    await ai_memory.stop()
+    await llm_metrics.stop()
+    await whatsapp_clients.close()
     client.close()
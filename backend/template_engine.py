@@ -0,0 +1,98 @@
+"""
+Template Engine
+Merge-tag templates ({{name}}, {{subscription_end}}) compiled once per send
+and rendered per recipient (email campaigns, WhatsApp campaigns, reminders)
+"""
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+from functools import lru_cache
+import re
+
+TAG_PATTERN = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}")
+
+
+class TemplateError(ValueError):
+    """Template using a variable that is not available"""
+
+
+class CompiledTemplate:
+    __slots__ = ("source", "variables", "_format", "_names", "_defaults", "_escape")
+
+    def __init__(self, source: str, names: Tuple[str, ...], format_string: str,
+                 defaults: Mapping[str, Any], escape: Optional[Callable[[str], str]]):
+        self.source = source
+        self.variables = tuple(dict.fromkeys(names))
+        self._names = names
+        self._format = format_string
+        self._defaults = defaults
+        self._escape = escape
+
+    def render(self, values: Mapping[str, Any]) -> str:
+        """
+        Render for one recipient
+
+        Args:
+            values: Variable values (missing or None values use the defaults, else "")
+        """
+        if not self._names:
+            return self._format
+        defaults = self._defaults
+        escape = self._escape
+        args = []
+        for name in self._names:
+            value = values.get(name)
+            if value is None:
+                value = defaults.get(name)
+            value = "" if value is None else str(value)
+            args.append(escape(value) if escape else value)
+        return self._format.format(*args)
+
+    def render_many(self, values: Iterable[Mapping[str, Any]]) -> List[str]:
+        return [self.render(item) for item in values]
+
+
+@lru_cache(maxsize=512)
+def _parse(source: str) -> Tuple[Tuple[str, ...], str]:
+    """Variable names in order and the equivalent positional format string"""
+    names = []
+    parts = []
+    position = 0
+    for match in TAG_PATTERN.finditer(source):
+        parts.append(source[position:match.start()].replace("{", "{{").replace("}", "}}"))
+        parts.append(f"{{{len(names)}}}")
+        names.append(match.group(1))
+        position = match.end()
+    parts.append(source[position:].replace("{", "{{").replace("}", "}}"))
+    return tuple(names), "".join(parts)
+
+
+def template_variables(source: Optional[str]) -> List[str]:
+    """Variables used by a template, in order of first use"""
+    return list(dict.fromkeys(_parse(source or "")[0]))
+
+
+def compile_template(source: Optional[str], allowed: Optional[Iterable[str]] = None,
+                     defaults: Optional[Mapping[str, Any]] = None,
+                     escape: Optional[Callable[[str], str]] = None) -> CompiledTemplate:
+    """
+    Compile a template (call once per send, not per recipient)
+
+    Args:
+        source: Template text, merge tags written {{variable}}
+        allowed: Variables the send path can provide (None accepts any)
+        defaults: Values used when a recipient has none
+        escape: Applied to every value (e.g. html.escape for email bodies)
+
+    Raises:
+        TemplateError: If the template uses a variable outside allowed
+    """
+    source = source or ""
+    names, format_string = _parse(source)
+    if allowed is not None:
+        allowed = set(allowed)
+        unknown = [name for name in dict.fromkeys(names) if name not in allowed]
+        if unknown:
+            raise TemplateError(
+                f"Unknown template variable(s): {', '.join(unknown)} "
+                f"(available: {', '.join(sorted(allowed))})"
+            )
+    return CompiledTemplate(source, names, format_string, dict(defaults or {}), escape)
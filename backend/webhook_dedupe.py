@@ -0,0 +1,129 @@
+"""
+Webhook Dedupe
+Idempotency store for provider webhooks (WhatsApp messages and statuses,
+Stripe events): an in-memory LRU in front of a TTL-indexed collection
+"""
+from typing import Dict, Iterable, List, Optional
+from datetime import datetime, timezone, timedelta
+import os
+import logging
+
+from cachetools import TTLCache
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookDedupe:
+    def __init__(self, db, ttl_seconds: Optional[int] = None, max_memory_entries: int = 100_000):
+        """
+        Initialize Webhook Dedupe
+
+        Args:
+            db: MongoDB database instance
+            ttl_seconds: How long an event id is remembered (WEBHOOK_DEDUPE_TTL,
+                default 7 days, the longest provider retry window)
+            max_memory_entries: Size of the in-memory LRU answering most retries
+        """
+        self.collection = db.webhook_events
+        self.ttl_seconds = ttl_seconds or int(os.environ.get('WEBHOOK_DEDUPE_TTL', str(7 * 24 * 3600)))
+        self.memory = TTLCache(maxsize=max_memory_entries, ttl=self.ttl_seconds)
+        self.stats = {
+            "new": 0,
+            "memory_duplicates": 0,
+            "db_duplicates": 0
+        }
+
+    async def ensure_indexes(self) -> None:
+        """Unique key index and the TTL index that forgets old events"""
+        await self.collection.create_index("key", unique=True)
+        # TTL indexes only work on BSON dates, so expires_at is not stored as ISO string
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    @staticmethod
+    def _key(source: str, event_id: str) -> str:
+        return f"{source}:{event_id}"
+
+    def _doc(self, key: str) -> Dict:
+        now = datetime.now(timezone.utc)
+        return {
+            "key": key,
+            "created_at": now.isoformat(),
+            "expires_at": now + timedelta(seconds=self.ttl_seconds)
+        }
+
+    async def claim(self, source: str, event_id: str) -> bool:
+        """
+        Claim an event for processing
+
+        Args:
+            source: Provider and kind (stripe, whatsapp_message, ...)
+            event_id: Provider event or message id
+
+        Returns:
+            True the first time the event is seen, False for a retry
+        """
+        key = self._key(source, event_id)
+        if key in self.memory:
+            self.stats["memory_duplicates"] += 1
+            return False
+        self.memory[key] = True
+        try:
+            await self.collection.insert_one(self._doc(key))
+        except DuplicateKeyError:
+            self.stats["db_duplicates"] += 1
+            return False
+        except Exception as e:
+            # Store unavailable: process rather than drop the event
+            logger.error(f"Error recording webhook event {key}: {e}")
+        self.stats["new"] += 1
+        return True
+
+    async def claim_many(self, source: str, event_ids: Iterable[str]) -> List[str]:
+        """
+        Claim several events of one payload with a single insert
+
+        Returns:
+            The event ids seen for the first time, in order
+        """
+        candidates = []
+        for event_id in dict.fromkeys(event_ids):
+            key = self._key(source, event_id)
+            if key in self.memory:
+                self.stats["memory_duplicates"] += 1
+                continue
+            self.memory[key] = True
+            candidates.append(event_id)
+        if not candidates:
+            return []
+
+        duplicates = set()
+        try:
+            await self.collection.insert_many(
+                [self._doc(self._key(source, event_id)) for event_id in candidates],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") == 11000:
+                    duplicates.add(candidates[error["index"]])
+                else:
+                    logger.error(f"Error recording webhook event: {error.get('errmsg')}")
+        except Exception as e:
+            logger.error(f"Error recording webhook events: {e}")
+
+        self.stats["db_duplicates"] += len(duplicates)
+        self.stats["new"] += len(candidates) - len(duplicates)
+        return [event_id for event_id in candidates if event_id not in duplicates]
+
+    async def release(self, source: str, event_id: str) -> None:
+        """Forget an event whose processing failed, so the provider's retry is processed"""
+        key = self._key(source, event_id)
+        self.memory.pop(key, None)
+        try:
+            await self.collection.delete_one({"key": key})
+        except Exception as e:
+            logger.error(f"Error releasing webhook event {key}: {e}")
+
+    def get_stats(self) -> Dict:
+        return {**self.stats, "memory_entries": len(self.memory)}
@@ -0,0 +1,168 @@
+"""
+WhatsApp Media Cache
+Uploads campaign media once per phone number ID and reuses the returned
+media ID, keyed by content hash, instead of having Meta fetch the public
+link for every message
+"""
+from typing import Dict, Optional, Tuple
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from urllib.parse import urlparse
+import asyncio
+import hashlib
+import ipaddress
+import mimetypes
+import os
+import tempfile
+import logging
+
+from cachetools import TTLCache
+
+from whatsapp_service import WhatsAppService
+
+logger = logging.getLogger(__name__)
+
+# Cloud API upload limits per media type
+MAX_MEDIA_BYTES = {
+    "image": 5 * 1024 * 1024,
+    "video": 16 * 1024 * 1024,
+    "document": 100 * 1024 * 1024
+}
+
+
+class WhatsAppMediaCache:
+    def __init__(self, db, ttl_seconds: Optional[int] = None, max_memory_entries: int = 1000):
+        """
+        Initialize WhatsApp Media Cache
+
+        Args:
+            db: MongoDB database instance
+            ttl_seconds: How long a media ID is reused (WHATSAPP_MEDIA_TTL, default
+                25 days; Meta deletes uploaded media after 30 days)
+            max_memory_entries: Media IDs kept in memory in front of the collection
+        """
+        self.collection = db.whatsapp_media
+        self.ttl_seconds = ttl_seconds or int(os.environ.get('WHATSAPP_MEDIA_TTL', str(25 * 24 * 3600)))
+        self.memory = TTLCache(maxsize=max_memory_entries, ttl=self.ttl_seconds)
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def ensure_indexes(self) -> None:
+        """Unique key index and the TTL index that forgets expired media IDs"""
+        await self.collection.create_index("key", unique=True)
+        # TTL indexes only work on BSON dates, so expires_at is not stored as ISO string
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    @staticmethod
+    async def _check_url(media_url: str) -> None:
+        """
+        Refuse media URLs that would make the server fetch an internal address
+        (the URL is given by a coach; the client does not follow redirects)
+        """
+        parsed = urlparse(media_url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ValueError("Media URL must be an http(s) URL")
+        try:
+            addresses = await asyncio.get_running_loop().getaddrinfo(parsed.hostname, parsed.port)
+        except OSError as e:
+            raise ValueError(f"Cannot resolve media host {parsed.hostname}: {e}")
+        for address in addresses:
+            ip = ipaddress.ip_address(address[4][0].split("%")[0])
+            if not ip.is_global or ip.is_multicast:
+                raise ValueError(f"Media host {parsed.hostname} resolves to a non-public address")
+
+    async def _fetch(self, whatsapp: WhatsAppService, media_url: str,
+                     media_type: str) -> Tuple[str, str, int, str]:
+        """
+        Download the campaign media once, within the Cloud API size limit,
+        hashing it while it is written to a temporary file
+
+        Returns:
+            Temporary file path, sha256, size and MIME type
+        """
+        await self._check_url(media_url)
+        limit = MAX_MEDIA_BYTES.get(media_type, MAX_MEDIA_BYTES["document"])
+        digest = hashlib.sha256()
+        size = 0
+        file = await asyncio.to_thread(tempfile.NamedTemporaryFile, prefix="whatsapp-media-", delete=False)
+        try:
+            async with whatsapp.client.stream("GET", media_url) as response:
+                response.raise_for_status()
+                mime_type = (response.headers.get("content-type") or "").split(";")[0].strip()
+                async for chunk in response.aiter_bytes():
+                    size += len(chunk)
+                    if size > limit:
+                        raise ValueError(f"{media_type} larger than {limit // (1024 * 1024)} MB")
+                    digest.update(chunk)
+                    await asyncio.to_thread(file.write, chunk)
+            await asyncio.to_thread(file.close)
+        except BaseException:
+            await asyncio.to_thread(file.close)
+            await asyncio.to_thread(os.remove, file.name)
+            raise
+        if not mime_type or mime_type == "application/octet-stream":
+            mime_type = mimetypes.guess_type(media_url)[0] or mime_type or "application/octet-stream"
+        return file.name, digest.hexdigest(), size, mime_type
+
+    async def media_id(self, whatsapp: WhatsAppService, media_url: str, media_type: str) -> str:
+        """
+        Media ID of a campaign media for the sending phone number
+
+        The media is downloaded and hashed; the same content is uploaded at
+        most once per phone number ID while its media ID is valid.
+
+        Args:
+            whatsapp: Service of the sending phone number
+            media_url: Public URL of the media
+            media_type: image, video or document
+
+        Returns:
+            Media ID to send with media_reference / campaign_payload
+
+        Raises:
+            ValueError: If the URL is not a public http(s) URL or the media is too large
+        """
+        path, sha256, size, mime_type = await self._fetch(whatsapp, media_url, media_type)
+        key = f"{whatsapp.phone_number_id}:{sha256}"
+
+        # One upload per key even if two campaigns start together
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                return await self._lookup_or_upload(whatsapp, key, path, size, mime_type, media_url)
+        finally:
+            if not lock.locked():
+                self._locks.pop(key, None)
+            await asyncio.to_thread(os.remove, path)
+
+    async def _lookup_or_upload(self, whatsapp: WhatsAppService, key: str, path: str, size: int,
+                                mime_type: str, media_url: str) -> str:
+        media_id = self.memory.get(key)
+        if media_id:
+            return media_id
+
+        now = datetime.now(timezone.utc)
+        doc = await self.collection.find_one({"key": key, "expires_at": {"$gt": now}}, {"_id": 0, "media_id": 1})
+        if doc:
+            self.memory[key] = doc["media_id"]
+            return doc["media_id"]
+
+        # Only read into memory when it has to be uploaded
+        content = await asyncio.to_thread(Path(path).read_bytes)
+        filename = os.path.basename(urlparse(media_url).path) or "media"
+        media_id = await whatsapp.upload_media(content, mime_type, filename)
+        self.memory[key] = media_id
+        await self.collection.update_one(
+            {"key": key},
+            {"$set": {
+                "key": key,
+                "media_id": media_id,
+                "mime_type": mime_type,
+                "size": size,
+                "source_url": media_url,
+                "created_at": now.isoformat(),
+                "expires_at": now + timedelta(seconds=self.ttl_seconds)
+            }},
+            upsert=True
+        )
+        logger.info(f"Uploaded WhatsApp media {filename} ({size} bytes) as {media_id}")
+        return media_id
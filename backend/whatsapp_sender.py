@@ -0,0 +1,234 @@
+"""
+WhatsApp Campaign Sender
+Concurrent campaign delivery with a messages-per-second ceiling per phone
+number ID, retry of transient errors and batched message-log writes
+"""
+from typing import AsyncIterable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+import asyncio
+import os
+import random
+import time
+import logging
+
+import httpx
+
+from whatsapp_service import WhatsAppService
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying: Graph API throttling and server errors
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        """
+        Initialize Token Bucket
+
+        Args:
+            rate: Messages per second
+            burst: Messages allowed at once after an idle period (defaults to one second of traffic)
+        """
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        """Wait for a token (callers are served in arrival order)"""
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Hold every sender back, e.g. after the API answered 429"""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    if isinstance(error, httpx.HTTPStatusError):
+        value = error.response.headers.get("retry-after")
+        try:
+            return float(value) if value else None
+        except ValueError:
+            return None
+    return None
+
+
+def provider_message_id(result: Dict) -> Optional[str]:
+    """Graph API message ID (wamid) of a send response, used to match status webhooks"""
+    messages = result.get("messages") or [{}]
+    return messages[0].get("id")
+
+
+def is_transient(error: Exception) -> bool:
+    """Network errors, throttling and 5xx are retried, other API errors are final"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS
+    return isinstance(error, httpx.TransportError)
+
+
+class WhatsAppCampaignSender:
+    def __init__(self, db, messages_per_second: Optional[float] = None, concurrency: Optional[int] = None,
+                 max_retries: Optional[int] = None, log_batch_size: int = 500):
+        """
+        Initialize WhatsApp Campaign Sender
+
+        Args:
+            db: MongoDB database instance
+            messages_per_second: Default ceiling per phone number ID (WHATSAPP_MESSAGES_PER_SECOND),
+                set a phone number's own tier with set_rate
+            concurrency: Requests in flight per campaign (WHATSAPP_SEND_CONCURRENCY)
+            max_retries: Retries of a transient error (WHATSAPP_SEND_RETRIES)
+            log_batch_size: whatsapp_messages documents written per insert_many
+        """
+        self.db = db
+        self.messages_per_second = messages_per_second or float(os.environ.get('WHATSAPP_MESSAGES_PER_SECOND', '80'))
+        self.concurrency = concurrency or int(os.environ.get('WHATSAPP_SEND_CONCURRENCY', '32'))
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get('WHATSAPP_SEND_RETRIES', '3'))
+        self.log_batch_size = log_batch_size
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def set_rate(self, phone_number_id: str, messages_per_second: float) -> None:
+        """Throughput tier of one phone number (Meta raises it with the number's quality)"""
+        self._buckets[phone_number_id] = TokenBucket(messages_per_second)
+
+    def bucket(self, phone_number_id: str) -> TokenBucket:
+        bucket = self._buckets.get(phone_number_id)
+        if bucket is None:
+            bucket = self._buckets[phone_number_id] = TokenBucket(self.messages_per_second)
+        return bucket
+
+    async def _send_one(self, whatsapp: WhatsAppService, bucket: TokenBucket, phone: str,
+                        message: Union[str, Dict]) -> Dict:
+        """Send with retries; exponential backoff with full jitter, Retry-After honoured"""
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            try:
+                if isinstance(message, str):
+                    return await whatsapp.send_text_message(to=phone, message=message)
+                return await whatsapp.send_payload(to=phone, payload=message)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_transient(e):
+                    raise
+                delay = _retry_after(e) or random.uniform(0, min(30.0, 2.0 ** attempt))
+                if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 429:
+                    bucket.pause(delay)
+                attempt += 1
+                logger.warning(f"Retrying WhatsApp message to {phone} in {delay:.1f}s (attempt {attempt}): {e}")
+                await asyncio.sleep(delay)
+
+    async def send_campaign(self, whatsapp: Optional[WhatsAppService], campaign_id: str,
+                            recipients: Union[Iterable[Tuple], AsyncIterable[Tuple]],
+                            message: Union[str, Dict], build_log: Callable[..., Dict],
+                            log_collection: str = "whatsapp_messages",
+                            campaign_collection: str = "whatsapp_campaigns",
+                            dry_run: bool = False) -> Tuple[int, int]:
+        """
+        Send one message to every recipient
+
+        Recipients are pulled as workers free up, so an async iterator over a
+        database cursor never holds the whole audience in memory. Message logs
+        are written in batches and each batch increments the campaign's
+        stats.sent / stats.failed, so progress is visible and the failures
+        status webhooks count meanwhile are kept.
+
+        Args:
+            whatsapp: Service of the sending phone number (may be None for a dry run)
+            campaign_id: Campaign id
+            recipients: (contact_id, phone) pairs, a list or an async iterator; a
+                third element replaces message for that recipient (personalization)
+            message: Text to send, or a payload prepared once (see whatsapp_service.campaign_payload)
+            build_log: Builds a log document from
+                (contact_id, phone, status, error_message, provider_message_id)
+            log_collection: Collection receiving the log documents
+            campaign_collection: Collection holding the campaign and its stats
+            dry_run: Log every recipient as sent without calling the Graph API
+                (and count it as delivered)
+
+        Returns:
+            (sent, failed)
+        """
+        bucket = None if dry_run else self.bucket(whatsapp.phone_number_id)
+        workers = self.concurrency
+        if isinstance(recipients, list):
+            workers = min(workers, len(recipients)) or 1
+        queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 4)
+
+        counts = {"sent": 0, "failed": 0}
+        flushed = {"sent": 0, "failed": 0}
+        logs: List[Dict] = []
+        flush_lock = asyncio.Lock()
+        producer_error: List[Exception] = []
+
+        async def flush() -> None:
+            async with flush_lock:
+                nonlocal logs
+                if not logs:
+                    return
+                batch, logs = logs, []
+                # Counts of the logs in this batch (taken together with the swap)
+                increments = {f"stats.{name}": counts[name] - flushed[name] for name in counts}
+                flushed.update(counts)
+                if dry_run:
+                    increments["stats.delivered"] = increments["stats.sent"]
+                try:
+                    await self.db[log_collection].insert_many(batch, ordered=False)
+                except Exception as e:
+                    logger.error(f"Error writing campaign {campaign_id} message logs: {e}")
+                await self.db[campaign_collection].update_one({"id": campaign_id}, {"$inc": increments})
+
+        async def produce() -> None:
+            try:
+                if hasattr(recipients, "__aiter__"):
+                    async for recipient in recipients:
+                        await queue.put(recipient)
+                else:
+                    for recipient in recipients:
+                        await queue.put(recipient)
+            except Exception as e:
+                producer_error.append(e)
+            finally:
+                for _ in range(workers):
+                    await queue.put(None)
+
+        async def worker() -> None:
+            while True:
+                recipient = await queue.get()
+                if recipient is None:
+                    return
+                contact_id, phone = recipient[0], recipient[1]
+                content = recipient[2] if len(recipient) > 2 else message
+                try:
+                    result = {} if dry_run else await self._send_one(whatsapp, bucket, phone, content)
+                    counts["sent"] += 1
+                    logs.append(build_log(contact_id, phone, "sent", None, provider_message_id(result)))
+                except Exception as e:
+                    logger.error(f"Error sending WhatsApp to contact {contact_id}: {e}")
+                    counts["failed"] += 1
+                    logs.append(build_log(contact_id, phone, "failed", str(e), None))
+                if len(logs) >= self.log_batch_size:
+                    await flush()
+
+        start = time.monotonic()
+        await asyncio.gather(produce(), *(worker() for _ in range(workers)))
+        await flush()
+        logger.info(
+            f"{'[DRY RUN] ' if dry_run else ''}WhatsApp campaign {campaign_id}: {counts['sent']} sent, "
+            f"{counts['failed']} failed in {time.monotonic() - start:.1f}s"
+        )
+        if producer_error:
+            raise producer_error[0]
+        return counts["sent"], counts["failed"]
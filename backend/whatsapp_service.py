@@ -2,191 +2,426 @@
 WhatsApp Business API Service
 Documentation: https://developers.facebook.com/docs/whatsapp/cloud-api
 """
-import requests
+import httpx
+import asyncio
 import os
+import hashlib
 import logging
-from typing import Dict, List, Optional
+import mimetypes
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
+GRAPH_API_URL = "https://graph.facebook.com"
+GRAPH_API_VERSION = os.environ.get('WHATSAPP_API_VERSION', 'v20.0')
+
+# Inbound media downloads
+MEDIA_DIR = Path(os.environ.get('WHATSAPP_MEDIA_DIR', os.path.join(tempfile.gettempdir(), 'whatsapp_media')))
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def create_http_client(http2: Optional[bool] = None, max_connections: Optional[int] = None,
+                       timeout: Optional[float] = None) -> httpx.AsyncClient:
+    """
+    Keep-alive HTTP client for the Graph API
+
+    Args:
+        http2: Use HTTP/2 (WHATSAPP_HTTP2, only if the h2 package is installed)
+        max_connections: Connection limit (WHATSAPP_MAX_CONNECTIONS)
+        timeout: Request timeout in seconds (WHATSAPP_TIMEOUT)
+    """
+    if http2 is None:
+        http2 = os.environ.get('WHATSAPP_HTTP2', '').lower() in ('1', 'true', 'yes')
+    if http2 and not _http2_available():
+        logger.warning("WHATSAPP_HTTP2 is set but the h2 package is not installed, using HTTP/1.1")
+        http2 = False
+    max_connections = max_connections or int(os.environ.get('WHATSAPP_MAX_CONNECTIONS', '20'))
+    timeout = timeout or float(os.environ.get('WHATSAPP_TIMEOUT', '15'))
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=60
+        ),
+        timeout=httpx.Timeout(timeout, connect=5.0)
+    )
+
+
+def media_reference(media_url: Optional[str] = None, media_id: Optional[str] = None) -> Dict:
+    """Media object of a message: uploaded media ID if known, else the public link"""
+    return {"id": media_id} if media_id else {"link": media_url}
+
+
+# Graph API limits of interactive messages
+MAX_REPLY_BUTTONS = 3
+MAX_BUTTON_TITLE = 20
+MAX_LIST_ROWS = 10
+
+
+def campaign_payload(body: str, buttons: Optional[List[Dict]] = None,
+                     list_sections: Optional[List[Dict]] = None,
+                     media_url: Optional[str] = None, media_type: Optional[str] = None,
+                     payment_links: Optional[List[Dict]] = None,
+                     list_button: str = "Voir les options",
+                     media_id: Optional[str] = None) -> Dict:
+    """
+    Message payload of a campaign, built once and sent to every recipient
+    with send_payload
+
+    List sections give a list message, reply buttons a button message and a
+    URL button a call-to-action message (with the image, video or document as
+    header); otherwise the media with the text as caption, or plain text.
+    Elements the chosen message type cannot carry (call buttons, payment
+    links, extra URL buttons) are appended to the text.
+
+    Args:
+        body: Message text
+        buttons: InteractiveButton dicts (type reply, url or call)
+        list_sections: InteractiveSection dicts (title, rows of id/title/description)
+        media_url: Public URL of the media
+        media_type: image, video or document
+        payment_links: [{type, url}] dicts
+        list_button: Label of the button opening a list
+        media_id: Uploaded media (see WhatsAppMediaCache), sent instead of media_url
+
+    Returns:
+        Payload without the "to" field
+    """
+    buttons = buttons or []
+    reply_buttons = [b for b in buttons if b.get("type") == "reply"][:MAX_REPLY_BUTTONS]
+    url_buttons = [b for b in buttons if b.get("type") == "url" and b.get("url")]
+
+    extra_lines = []
+    for button in buttons:
+        if button.get("type") == "call" and button.get("phone_number"):
+            extra_lines.append(f"📞 {button['text']} : {button['phone_number']}")
+    for link in payment_links or []:
+        if link.get("url"):
+            extra_lines.append(f"💳 {link.get('type', 'Paiement').capitalize()} : {link['url']}")
+
+    header = None
+    if (media_url or media_id) and media_type in ("image", "video", "document"):
+        header = {"type": media_type, media_type: media_reference(media_url, media_id)}
+
+    interactive = None
+    if list_sections:
+        rows_left = MAX_LIST_ROWS
+        sections = []
+        for section in list_sections:
+            rows = []
+            for row in section.get("rows", [])[:rows_left]:
+                item = {"id": row["id"], "title": row["title"][:24]}
+                if row.get("description"):
+                    item["description"] = row["description"][:72]
+                rows.append(item)
+            rows_left -= len(rows)
+            if rows:
+                sections.append({"title": section["title"][:24], "rows": rows})
+        interactive = {
+            "type": "list",
+            "action": {"button": list_button[:MAX_BUTTON_TITLE], "sections": sections}
+        }
+        # List headers can only be text
+        header = None
+        extra_lines += [f"🔗 {b['text']} : {b['url']}" for b in url_buttons]
+    elif reply_buttons:
+        interactive = {
+            "type": "button",
+            "action": {"buttons": [
+                {"type": "reply", "reply": {
+                    "id": button.get("id") or f"btn_{index}",
+                    "title": button["text"][:MAX_BUTTON_TITLE]
+                }}
+                for index, button in enumerate(reply_buttons)
+            ]}
+        }
+        extra_lines += [f"🔗 {b['text']} : {b['url']}" for b in url_buttons]
+    elif url_buttons:
+        interactive = {
+            "type": "cta_url",
+            "action": {"name": "cta_url", "parameters": {
+                "display_text": url_buttons[0]["text"][:MAX_BUTTON_TITLE],
+                "url": url_buttons[0]["url"]
+            }}
+        }
+        extra_lines += [f"🔗 {b['text']} : {b['url']}" for b in url_buttons[1:]]
+
+    text = "\n\n".join([body, "\n".join(extra_lines)]) if extra_lines else body
+
+    if interactive is not None:
+        interactive["body"] = {"text": text}
+        if header:
+            interactive["header"] = header
+        return {"messaging_product": "whatsapp", "recipient_type": "individual",
+                "type": "interactive", "interactive": interactive}
+    if header:
+        media = {**header[media_type], "caption": text}
+        return {"messaging_product": "whatsapp", "recipient_type": "individual",
+                "type": media_type, media_type: media}
+    return {"messaging_product": "whatsapp", "recipient_type": "individual",
+            "type": "text", "text": {"preview_url": False, "body": text}}
+
+
+def payload_text(payload: Dict) -> str:
+    """Text of a campaign_payload message (body, caption or text)"""
+    kind = payload["type"]
+    if kind == "interactive":
+        return payload["interactive"]["body"]["text"]
+    if kind == "text":
+        return payload["text"]["body"]
+    return payload[kind].get("caption", "")
+
+
+def with_text(payload: Dict, text: str) -> Dict:
+    """Copy of a campaign_payload message with another text (per-recipient personalization)"""
+    kind = payload["type"]
+    if kind == "interactive":
+        return {**payload, "interactive": {**payload["interactive"], "body": {"text": text}}}
+    if kind == "text":
+        return {**payload, "text": {**payload["text"], "body": text}}
+    return {**payload, kind: {**payload[kind], "caption": text}}
+
 
 class WhatsAppService:
-    def __init__(self, access_token: str, phone_number_id: str):
+    def __init__(self, access_token: str, phone_number_id: str,
+                 http_client: Optional[httpx.AsyncClient] = None):
         """
         Initialize WhatsApp Business API client
-        
+
         Args:
             access_token: Meta WhatsApp Business API token
             phone_number_id: Phone number ID from Meta Business
+            http_client: Shared keep-alive client (see WhatsAppClientPool), a
+                private one is created if omitted and closed by close()
         """
-        self.access_token = access_token
         self.phone_number_id = phone_number_id
-        self.base_url = f"https://graph.facebook.com/v18.0/{phone_number_id}"
+        self.base_url = f"{GRAPH_API_URL}/{GRAPH_API_VERSION}/{phone_number_id}"
+        self.set_access_token(access_token)
+        self._owns_client = http_client is None
+        self.client = http_client or create_http_client()
+
+    def set_access_token(self, access_token: str) -> None:
+        """Use a new token for the next requests (token rotated in the settings)"""
+        self.access_token = access_token
         self.headers = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
         }
-    
-    def send_text_message(self, to: str, message: str) -> Dict:
+
+    async def _post_message(self, payload: Dict, action: str) -> Dict:
+        try:
+            response = await self.client.post(f"{self.base_url}/messages", headers=self.headers, json=payload)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Error {action}: {e} - {e.response.text[:500]}")
+            raise
+        except Exception as e:
+            logger.error(f"Error {action}: {e}")
+            raise
+
+    async def send_text_message(self, to: str, message: str, preview_url: bool = False) -> Dict:
         """
         Send a text message via WhatsApp
-        
+
         Args:
             to: Recipient phone number with country code (e.g., "41791234567")
             message: Text message content
-            
+            preview_url: Whether to show URL previews
+
         Returns:
             Response from WhatsApp API
         """
-        try:
-            url = f"{self.base_url}/messages"
-            payload = {
-                "messaging_product": "whatsapp",
-                "recipient_type": "individual",
-                "to": to,
-                "type": "text",
-                "text": {
-                    "preview_url": False,
-                    "body": message
-                }
+        payload = {
+            "messaging_product": "whatsapp",
+            "recipient_type": "individual",
+            "to": to,
+            "type": "text",
+            "text": {
+                "preview_url": preview_url,
+                "body": message
             }
-            
-            response = requests.post(url, headers=self.headers, json=payload)
-            response.raise_for_status()
-            
-            return response.json()
-        except Exception as e:
-            logger.error(f"Error sending WhatsApp message to {to}: {e}")
-            raise
-    
-    def send_template_message(self, to: str, template_name: str, language: str = "fr", 
-                             components: Optional[List] = None) -> Dict:
+        }
+        return await self._post_message(payload, f"sending WhatsApp message to {to}")
+
+    async def send_payload(self, to: str, payload: Dict) -> Dict:
+        """
+        Send a prepared message payload (see campaign_payload)
+
+        Args:
+            to: Recipient phone number
+            payload: Message payload without the "to" field, shared between recipients
+        """
+        return await self._post_message({**payload, "to": to}, f"sending WhatsApp {payload.get('type')} message to {to}")
+
+    async def send_template_message(self, to: str, template_name: str, language: str = "fr",
+                                    components: Optional[List] = None) -> Dict:
         """
         Send a template message (for campaigns)
-        
+
         Args:
             to: Recipient phone number
             template_name: Name of the approved template
             language: Language code (fr, en, de)
             components: Template components (header, body, buttons)
         """
-        try:
-            url = f"{self.base_url}/messages"
-            payload = {
-                "messaging_product": "whatsapp",
-                "to": to,
-                "type": "template",
-                "template": {
-                    "name": template_name,
-                    "language": {"code": language}
-                }
+        payload = {
+            "messaging_product": "whatsapp",
+            "to": to,
+            "type": "template",
+            "template": {
+                "name": template_name,
+                "language": {"code": language}
             }
-            
-            if components:
-                payload["template"]["components"] = components
-            
-            response = requests.post(url, headers=self.headers, json=payload)
-            response.raise_for_status()
-            
-            return response.json()
-        except Exception as e:
-            logger.error(f"Error sending WhatsApp template to {to}: {e}")
-            raise
-    
-    def send_media_message(self, to: str, media_type: str, media_url: str, 
-                          caption: Optional[str] = None) -> Dict:
+        }
+
+        if components:
+            payload["template"]["components"] = components
+
+        return await self._post_message(payload, f"sending WhatsApp template to {to}")
+
+    async def send_media_message(self, to: str, media_type: str, media_url: Optional[str] = None,
+                                 caption: Optional[str] = None, media_id: Optional[str] = None) -> Dict:
         """
         Send media (image, video, document)
-        
+
         Args:
             to: Recipient phone number
             media_type: Type of media (image, video, document)
-            media_url: URL of the media file
+            media_url: URL of the media file (Meta fetches it for every message)
             caption: Optional caption for the media
+            media_id: ID of media uploaded with upload_media, used instead of media_url
+        """
+        payload = {
+            "messaging_product": "whatsapp",
+            "to": to,
+            "type": media_type,
+            media_type: media_reference(media_url, media_id)
+        }
+
+        if caption and media_type in ["image", "video"]:
+            payload[media_type]["caption"] = caption
+
+        return await self._post_message(payload, f"sending WhatsApp media to {to}")
+
+    async def upload_media(self, content: bytes, mime_type: str, filename: str = "media") -> str:
+        """
+        Upload media once to send it by ID (Meta keeps it 30 days)
+
+        Args:
+            content: File content
+            mime_type: MIME type (image/jpeg, video/mp4, application/pdf...)
+            filename: File name shown for documents
+
+        Returns:
+            Media ID
         """
         try:
-            url = f"{self.base_url}/messages"
-            payload = {
-                "messaging_product": "whatsapp",
-                "to": to,
-                "type": media_type,
-                media_type: {
-                    "link": media_url
-                }
-            }
-            
-            if caption and media_type in ["image", "video"]:
-                payload[media_type]["caption"] = caption
-            
-            response = requests.post(url, headers=self.headers, json=payload)
+            response = await self.client.post(
+                f"{self.base_url}/media",
+                headers={"Authorization": self.headers["Authorization"]},
+                data={"messaging_product": "whatsapp", "type": mime_type},
+                files={"file": (filename, content, mime_type)}
+            )
             response.raise_for_status()
-            
-            return response.json()
+            return response.json()["id"]
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Error uploading WhatsApp media {filename}: {e} - {e.response.text[:500]}")
+            raise
         except Exception as e:
-            logger.error(f"Error sending WhatsApp media to {to}: {e}")
+            logger.error(f"Error uploading WhatsApp media {filename}: {e}")
             raise
-    
-    def mark_message_read(self, message_id: str) -> Dict:
+
+    async def mark_message_read(self, message_id: str) -> Dict:
         """
         Mark a message as read
-        
+
         Args:
             message_id: ID of the message to mark as read
         """
-        try:
-            url = f"{self.base_url}/messages"
-            payload = {
-                "messaging_product": "whatsapp",
-                "status": "read",
-                "message_id": message_id
-            }
-            
-            response = requests.post(url, headers=self.headers, json=payload)
-            response.raise_for_status()
-            
-            return response.json()
-        except Exception as e:
-            logger.error(f"Error marking message as read: {e}")
-            raise
-    
-    def get_media(self, media_id: str) -> bytes:
+        payload = {
+            "messaging_product": "whatsapp",
+            "status": "read",
+            "message_id": message_id
+        }
+        return await self._post_message(payload, "marking message as read")
+
+    async def get_media(self, media_id: str, destination: Optional[str] = None) -> Dict:
         """
-        Download media from WhatsApp
-        
+        Download media from WhatsApp, streamed to disk
+
         Args:
             media_id: ID of the media to download
-            
+            destination: File path (default: WHATSAPP_MEDIA_DIR/<media_id><extension>)
+
         Returns:
-            Media binary content
+            Dictionary with path, mime_type, size and sha256
         """
+        partial = None
         try:
             # First, get media URL
-            url = f"https://graph.facebook.com/v18.0/{media_id}"
-            response = requests.get(url, headers=self.headers)
+            response = await self.client.get(f"{GRAPH_API_URL}/{GRAPH_API_VERSION}/{media_id}", headers=self.headers)
             response.raise_for_status()
-            
-            media_url = response.json().get("url")
-            
-            # Then download the media
-            media_response = requests.get(media_url, headers=self.headers)
-            media_response.raise_for_status()
-            
-            return media_response.content
+            info = response.json()
+            mime_type = info.get("mime_type")
+
+            if destination:
+                path = Path(destination)
+            else:
+                path = MEDIA_DIR / f"{media_id}{mimetypes.guess_extension(mime_type or '') or ''}"
+            await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+            partial = path.with_name(path.name + ".part")
+
+            # Then download the media chunk by chunk
+            digest = hashlib.sha256()
+            size = 0
+            # Disk writes run in a thread so the event loop keeps serving requests
+            async with self.client.stream("GET", info["url"], headers=self.headers) as media_response:
+                media_response.raise_for_status()
+                file = await asyncio.to_thread(open, partial, "wb")
+                try:
+                    async for chunk in media_response.aiter_bytes(MEDIA_CHUNK_SIZE):
+                        await asyncio.to_thread(file.write, chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+                finally:
+                    await asyncio.to_thread(file.close)
+            await asyncio.to_thread(partial.replace, path)
+
+            return {"path": str(path), "mime_type": mime_type, "size": size, "sha256": digest.hexdigest()}
         except Exception as e:
             logger.error(f"Error downloading media {media_id}: {e}")
+            if partial is not None:
+                await asyncio.to_thread(partial.unlink, missing_ok=True)
             raise
-    
+
+    async def close(self) -> None:
+        """Close the HTTP client if this service created it"""
+        if self._owns_client:
+            await self.client.aclose()
+
     @staticmethod
     def verify_webhook(mode: str, token: str, challenge: str, verify_token: str) -> Optional[str]:
         """
         Verify webhook subscription
-        
+
         Args:
             mode: Mode parameter from webhook
             token: Token parameter from webhook
             challenge: Challenge parameter from webhook
             verify_token: Your verify token
-            
+
         Returns:
             Challenge if verification succeeds, None otherwise
         """
@@ -194,3 +429,40 @@ class WhatsAppService:
             logger.info("Webhook verified successfully")
             return challenge
         return None
+
+
+class WhatsAppClientPool:
+    def __init__(self, **client_options: Any):
+        """
+        App-scoped WhatsApp services, one keep-alive HTTP client per phone number ID
+
+        Args:
+            client_options: Passed to create_http_client (http2, max_connections, timeout)
+        """
+        self.client_options = client_options
+        self._services: Dict[str, WhatsAppService] = {}
+
+    def get(self, phone_number_id: str, access_token: str) -> WhatsAppService:
+        """
+        Service for a phone number, created on first use
+
+        Args:
+            phone_number_id: Phone number ID from Meta Business
+            access_token: Current token (replaces the stored one if it changed)
+        """
+        service = self._services.get(phone_number_id)
+        if service is None:
+            service = WhatsAppService(access_token, phone_number_id, create_http_client(**self.client_options))
+            self._services[phone_number_id] = service
+        elif service.access_token != access_token:
+            service.set_access_token(access_token)
+        return service
+
+    async def close(self) -> None:
+        """Close every HTTP client (call at shutdown)"""
+        services, self._services = self._services, {}
+        for service in services.values():
+            try:
+                await service.client.aclose()
+            except Exception as e:
+                logger.error(f"Error closing WhatsApp client {service.phone_number_id}: {e}")
@@ -0,0 +1,159 @@
+"""
+WhatsApp Status Ingestion
+Applies the message statuses of a webhook payload (sent, delivered, read,
+failed) with conditional updates keyed by the Graph API message ID (wamid)
+"""
+from typing import Dict, List, Optional
+from datetime import datetime, timezone
+import asyncio
+import logging
+
+from pymongo import ReturnDocument, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Statuses only move forward: a late "delivered" never replaces "read".
+# "failed" is terminal.
+STATUS_RANK = {
+    "sent": 1,
+    "delivered": 2,
+    "read": 3,
+    "failed": 4
+}
+
+# Campaign counters reached by a status ("read" implies "delivered")
+STATUS_COUNTERS = {
+    "sent": (),
+    "delivered": ("delivered",),
+    "read": ("delivered", "read"),
+    "failed": ("failed",)
+}
+
+
+# Collections logging sent messages by wamid -> collection of their campaigns.
+# campaign_analytics rows (advanced campaigns) also carry delivered/read/failed flags.
+MESSAGE_LOGS = {
+    "whatsapp_messages": "whatsapp_campaigns",
+    "campaign_analytics": "advanced_whatsapp_campaigns"
+}
+
+
+def _statuses_below(status: str) -> List[str]:
+    rank = STATUS_RANK[status]
+    return [name for name, other in STATUS_RANK.items() if other < rank]
+
+
+def _status_time(status: Dict) -> str:
+    try:
+        return datetime.fromtimestamp(int(status["timestamp"]), tz=timezone.utc).isoformat()
+    except (KeyError, TypeError, ValueError):
+        return datetime.now(timezone.utc).isoformat()
+
+
+class WhatsAppStatusService:
+    def __init__(self, db):
+        """
+        Initialize WhatsApp Status Service
+
+        Args:
+            db: MongoDB database instance
+        """
+        self.db = db
+
+    async def ensure_indexes(self) -> None:
+        """Lookup index on the Graph API message ID"""
+        for collection in MESSAGE_LOGS:
+            await self.db[collection].create_index("provider_message_id", sparse=True)
+
+    @staticmethod
+    def collapse(statuses: List[Dict]) -> Dict[str, Dict]:
+        """Keep the most advanced known status per message of a payload"""
+        latest: Dict[str, Dict] = {}
+        for status in statuses:
+            message_id = status.get("id")
+            name = status.get("status")
+            if not message_id or name not in STATUS_RANK:
+                continue
+            current = latest.get(message_id)
+            if current is None or STATUS_RANK[name] > STATUS_RANK[current["status"]]:
+                latest[message_id] = status
+        return latest
+
+    async def _apply(self, collection: str, message_id: str, status: Dict) -> Optional[Dict]:
+        """
+        Move one message to a more advanced status
+
+        Returns:
+            The message as it was before the update, None if nothing changed
+            (unknown message, or already at this status or beyond)
+        """
+        name = status["status"]
+        update = {"status": name, f"{name}_at": _status_time(status)}
+        if name == "failed" and status.get("errors"):
+            error = status["errors"][0]
+            update["error_message"] = error.get("title") or error.get("message") or str(error.get("code"))
+        if collection == "campaign_analytics":
+            update.update({flag: True for flag in STATUS_COUNTERS[name]})
+        return await self.db[collection].find_one_and_update(
+            {"provider_message_id": message_id, "status": {"$in": _statuses_below(name)}},
+            {"$set": update},
+            projection={"_id": 0, "status": 1, "campaign_id": 1},
+            return_document=ReturnDocument.BEFORE
+        )
+
+    async def ingest(self, statuses: List[Dict]) -> Dict:
+        """
+        Apply the statuses of one webhook payload
+
+        Each message gets one conditional update (only if its current status
+        is lower), run concurrently, in whatsapp_messages and then, for the
+        statuses not found there, in campaign_analytics (advanced campaigns).
+        Campaign counters are derived from the status each update actually
+        replaced, so payloads ingested at the same time (delivered and read
+        of one message) never count twice; they get one $inc per campaign.
+
+        Args:
+            statuses: value.statuses entries of the webhook
+
+        Returns:
+            Dictionary with received, applied and campaigns counts
+        """
+        latest = self.collapse(statuses)
+        if not latest:
+            return {"received": len(statuses), "applied": 0, "campaigns": 0}
+
+        applied = 0
+        campaigns = 0
+        # Statuses not matched in a log are looked up in the next one
+        pending = latest
+        for collection, campaign_collection in MESSAGE_LOGS.items():
+            if not pending:
+                break
+            previous = await asyncio.gather(*(
+                self._apply(collection, message_id, status) for message_id, status in pending.items()
+            ))
+
+            counters: Dict[str, Dict[str, int]] = {}
+            unmatched = {}
+            for (message_id, status), before in zip(pending.items(), previous):
+                if before is None:
+                    unmatched[message_id] = status
+                    continue
+                applied += 1
+                if before.get("campaign_id"):
+                    reached_before = set(STATUS_COUNTERS.get(before.get("status"), ()))
+                    campaign = counters.setdefault(before["campaign_id"], {})
+                    for counter in STATUS_COUNTERS[status["status"]]:
+                        if counter not in reached_before:
+                            campaign[f"stats.{counter}"] = campaign.get(f"stats.{counter}", 0) + 1
+            pending = unmatched
+
+            campaign_updates = [
+                UpdateOne({"id": campaign_id}, {"$inc": increments})
+                for campaign_id, increments in counters.items() if increments
+            ]
+            if campaign_updates:
+                await self.db[campaign_collection].bulk_write(campaign_updates, ordered=False)
+            campaigns += len(campaign_updates)
+
+        return {"received": len(statuses), "applied": applied, "campaigns": campaigns}
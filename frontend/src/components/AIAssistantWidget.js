@@ -17,6 +17,7 @@ import { Input } from '@/components/ui/input';
 import { Card, CardContent } from '@/components/ui/card';
 import { Badge } from '@/components/ui/badge';
 import { useToast } from '@/hooks/use-toast';
+import { streamSSE } from '@/lib/sse';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
 const API = `${BACKEND_URL}/api`;
@@ -28,6 +29,7 @@ const AIAssistantWidget = () => {
   const [messages, setMessages] = useState([]);
   const [inputMessage, setInputMessage] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  const [isStreaming, setIsStreaming] = useState(false);
   const [sessionId, setSessionId] = useState(null);
   const [taskType, setTaskType] = useState('general');
   const [suggestions, setSuggestions] = useState([]);
@@ -74,7 +76,8 @@ const AIAssistantWidget = () => {
     setIsLoading(true);
 
     try {
-      const response = await fetch(`${API}/ai/assistant/chat`, {
+      let streamStarted = false;
+      await streamSSE(`${API}/ai/assistant/chat/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -85,23 +88,40 @@ const AIAssistantWidget = () => {
           session_id: sessionId,
           task_type: taskType,
           context: {}
-        })
-      });
-
-      if (response.ok) {
-        const data = await response.json();
-        const assistantMessage = {
-          role: 'assistant',
-          content: data.response,
-          timestamp: new Date()
-        };
-        setMessages(prev => [...prev, assistantMessage]);
-        if (data.suggestions && data.suggestions.length > 0) {
-          setSuggestions(data.suggestions);
+        }),
+        onEvent: (event, data) => {
+          if (event === 'token') {
+            if (!streamStarted) {
+              // First token: replace the loading indicator by the message being written
+              streamStarted = true;
+              setIsStreaming(true);
+              setMessages(prev => [...prev, {
+                role: 'assistant',
+                content: data.content,
+                timestamp: new Date()
+              }]);
+            } else {
+              setMessages(prev => {
+                const last = prev[prev.length - 1];
+                return [...prev.slice(0, -1), { ...last, content: last.content + data.content }];
+              });
+            }
+          } else if (event === 'done') {
+            if (!streamStarted) {
+              setMessages(prev => [...prev, {
+                role: 'assistant',
+                content: data.response,
+                timestamp: new Date()
+              }]);
+            }
+            if (data.suggestions && data.suggestions.length > 0) {
+              setSuggestions(data.suggestions);
+            }
+          } else if (event === 'error') {
+            throw new Error(data.detail || 'Failed to get response');
+          }
         }
-      } else {
-        throw new Error('Failed to get response');
-      }
+      });
     } catch (error) {
       console.error('Error sending message:', error);
       toast({
@@ -117,6 +137,7 @@ const AIAssistantWidget = () => {
       setMessages(prev => [...prev, errorMessage]);
     } finally {
       setIsLoading(false);
+      setIsStreaming(false);
     }
   };
 
@@ -257,7 +278,7 @@ const AIAssistantWidget = () => {
                 </div>
               </div>
             ))}
-            {isLoading && (
+            {isLoading && !isStreaming && (
               <div className="flex justify-start">
                 <div className="bg-background/80 border border-primary/20 rounded-lg p-3 max-w-[80%]">
                   <div className="flex items-center gap-2">
@@ -0,0 +1,52 @@
+// Minimal server-sent events reader for POST endpoints.
+// EventSource only supports GET without custom headers, so the stream is read
+// from fetch() and split into events manually.
+export async function streamSSE(url, { onEvent, ...options }) {
+  const response = await fetch(url, {
+    ...options,
+    headers: {
+      Accept: 'text/event-stream',
+      ...(options.headers || {})
+    }
+  });
+
+  if (!response.ok || !response.body) {
+    throw new Error(`Stream request failed (${response.status})`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  const dispatch = (rawEvent) => {
+    let event = 'message';
+    const dataLines = [];
+    rawEvent.split('\n').forEach((line) => {
+      if (line.startsWith('event:')) {
+        event = line.slice(6).trim();
+      } else if (line.startsWith('data:')) {
+        dataLines.push(line.slice(5).trimStart());
+      }
+    });
+    if (dataLines.length > 0) {
+      onEvent(event, JSON.parse(dataLines.join('\n')));
+    }
+  };
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary = buffer.indexOf('\n\n');
+    while (boundary !== -1) {
+      dispatch(buffer.slice(0, boundary));
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf('\n\n');
+    }
+  }
+
+  if (buffer.trim()) {
+    dispatch(buffer);
+  }
+}
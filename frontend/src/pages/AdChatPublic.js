@@ -7,8 +7,10 @@ import { Badge } from '@/components/ui/badge';
 import { useToast } from '@/hooks/use-toast';
 import { MessageCircle, Send, Sparkles, User, Bot } from 'lucide-react';
 import axios from 'axios';
+import { streamSSE } from '@/lib/sse';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
+const STREAMING_MESSAGE_ID = 'streaming-ai-message';
 
 const AdChatPublic = () => {
   const { toast } = useToast();
@@ -19,6 +21,7 @@ const AdChatPublic = () => {
   const [messages, setMessages] = useState([]);
   const [currentMessage, setCurrentMessage] = useState('');
   const [loading, setLoading] = useState(false);
+  const [streaming, setStreaming] = useState(false);
   
   const [visitorInfo, setVisitorInfo] = useState({
     name: '',
@@ -82,15 +85,39 @@ const AdChatPublic = () => {
     setLoading(true);
     
     try {
-      const response = await axios.post(
-        `${API_URL}/api/ad-chat/${chatId}/message`,
-        {
+      await streamSSE(`${API_URL}/api/ad-chat/${chatId}/message/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
           sender: 'visitor',
           content: tempMessage.content
+        }),
+        onEvent: (event, data) => {
+          if (event === 'token') {
+            setStreaming(true);
+            setMessages(prev => {
+              const last = prev[prev.length - 1];
+              if (last && last.id === STREAMING_MESSAGE_ID) {
+                return [...prev.slice(0, -1), { ...last, content: last.content + data.content }];
+              }
+              return [...prev, {
+                id: STREAMING_MESSAGE_ID,
+                sender: 'agent',
+                content: data.content,
+                timestamp: new Date().toISOString()
+              }];
+            });
+          } else if (event === 'message' && data.sender === 'agent') {
+            // Final persisted AI message replaces the one being streamed
+            setMessages(prev => [
+              ...prev.filter(msg => msg.id !== STREAMING_MESSAGE_ID),
+              data
+            ]);
+          } else if (event === 'error') {
+            throw new Error(data.detail);
+          }
         }
-      );
-      
-      setMessages(response.data.messages || []);
+      });
       
     } catch (error) {
       console.error('Error sending message:', error);
@@ -101,6 +128,7 @@ const AdChatPublic = () => {
       });
     } finally {
       setLoading(false);
+      setStreaming(false);
     }
   };
 
@@ -246,7 +274,7 @@ const AdChatPublic = () => {
             </div>
           ))}
           
-          {loading && (
+          {loading && !streaming && (
             <div className="flex justify-start animate-in fade-in">
               <div className="flex gap-2 sm:gap-3">
                 <div className="h-8 w-8 sm:h-10 sm:w-10 rounded-full bg-gradient-to-br from-purple-500 to-pink-500 flex items-center justify-center flex-shrink-0">